@@ -1,18 +1,48 @@
 import argparse
+import ast
 import contextlib
+import fnmatch
 import glob
+import hashlib
+import inspect
+import json
 import os
+import pipes
 import platform
+import Queue
+import random
 import re
+import runpy
+import select
 import shutil
+import signal
+import struct
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import traceback
+from multiprocessing.pool import ThreadPool
 
 from vector.lib.core import VC_Status
 
+# os.scandir is only available from python 3.5, the scandir package provides the
+# same function for older interpreters, if we have neither we fall back to listdir
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+        
+# fcntl is not available on windows, there the environment cache uses a lock directory
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 '''
 This is a quick-start utility that uses operates on an exiting vcshell.db to:
 
@@ -47,6 +77,9 @@ listOfFilenamesFile = 'vcast-latest-filelist.txt'
 # This file will contain the cumulative list of files in the project
 listOfFilesInProject = 'vcast-inproject-filelist.txt'
 listOfEnvironmentsInProject = 'vcast-inproject-envirolist.txt'
+# This file is the index of the environments in the project, it replaces
+# the listOfEnvironmentsInProject file, which we only read to migrate old work areas
+environmentRegistryFile = 'vcast-inproject-environments.json'
 
 vcWorkArea='vcast-workarea'
 vcManageDirectory='vc_project'
@@ -100,11 +133,17 @@ locationOfInstrumentScript=os.path.join (vcInstallDir,'python','vector','apps','
 pathToUnInstrumentScript=os.path.join (vcInstallDir,'python','vector','apps','EnvCreator','UnInstrument.py')
 pathToEnvCreateScript=os.path.join (vcInstallDir,'python','vector','apps','vcshell','EnvCreate.py')
 
-# List of all files in the DB
-listOfAllFiles = []
+# The files from the DB that will be added for system testing, the files 
+# that need unit test environment scripts during this run, and the include
+# paths.  The lists hold handles into projectPaths rather than the path strings
+listOfUnitTestFiles = []
 listOfFiles = []
 listOfPaths = []
 
+# The file list pipeline reads the files from the DB in batches of this many records,
+# so the memory used depends on the batch size rather than the size of the DB
+fileListBatchSize = 10000
+
 # Contains the status message to display at the end of the run
 summaryStatusFileHandle = 0
 
@@ -154,44 +193,346 @@ def fatalError (errorString):
     
     
     
-def runVCcommand(command, abortOnError):
+# The VectorCAST commands are built as argv lists by the command builders below, 
+# the first element is the name of the tool in VECTORCAST_DIR.  An argv list is run
+# directly, without a shell, so paths with spaces need no quoting.  A command string
+# is still run with the shell, for the user commands such as the make command.
+# Lists of files that would make a command longer than commandLengthLimit are 
+# split over several commands, see commandBatches.
+commandLengthLimit = 30000 if os.name == 'nt' else 120000
+
+def commandWords (command):
+    if isinstance (command, list):
+        return command
+    return command.split()
+    
+    
+def commandTool (command):
+    '''
+    Return the name of the tool that a command runs, e.g. clicast
+    '''
+    words = commandWords (command)
+    return os.path.splitext (os.path.basename (words[0]))[0] if words else ''
+    
+    
+def commandString (command):
+    '''
+    Return a command as it would be typed, for the log and the status file
+    '''
+    if not isinstance (command, list):
+        return command
+    elif os.name == 'nt':
+        return subprocess.list2cmdline (command)
+    return ' '.join ([pipes.quote (word) for word in command])
+    
+    
+def toolCommand (command):
+    '''
+    Return the command with the tool name replaced by its path in VECTORCAST_DIR
+    '''
+    if isinstance (command, list):
+        return [os.path.join (vcInstallDir, command[0])] + command[1:]
+    return os.path.join (vcInstallDir, command)
+    
+    
+def clicastCommand (*args, **options):
+    '''
+    clicast [-lc] [-e environment] [-u unit] args...
+    '''
+    argv = ['clicast']
+    if options.get ('lc'):
+        argv.append ('-lc')
+    if options.get ('environment'):
+        argv += ['-e', options['environment']]
+    if options.get ('unit'):
+        argv += ['-u', options['unit']]
+    return argv + list (args)
+    
+    
+def clicoverCommand (action, coverProject, *args):
+    return ['clicover', action, coverProject] + list (args)
+    
+    
+def vcdbCommand (*args, **options):
+    '''
+    vcdb --db=... args..., see vcshellDBarg for the force option
+    '''
+    return ['vcdb', vcshellDBarg (options.get ('force', False))] + list (args)
+    
+    
+def vcutilCommand (*args, **options):
+    argv = ['vcutil']
+    if options.get ('lc'):
+        argv.append ('-lc')
+    return argv + list (args)
+    
+    
+def manageCommand (project, *args):
+    return ['manage', '-p', project] + list (args)
+    
+    
+def vpythonCommand (script, *args):
+    return ['vpython', script] + list (args)
+    
+    
+def commandBatches (command, items):
+    '''
+    Yield command with as many of items added as fit in commandLengthLimit,
+    until all of the items are used
+    '''
+    batch = []
+    batchLength = len (commandString (toolCommand (command)))
+    for item in items:
+        itemLength = len (commandString ([item])) + 1
+        if batch and batchLength + itemLength > commandLengthLimit:
+            yield command + batch
+            batch = []
+            batchLength = len (commandString (toolCommand (command)))
+        batch.append (item)
+        batchLength += itemLength
+    if batch:
+        yield command + batch
+        
+        
+# Every VectorCAST command has a wall clock limit and an inactivity limit in seconds,
+# (0 for no limit), the defaults depend on the tool, and can be changed with the
+# COMMAND_TIME_LIMITS and COMMAND_IDLE_LIMITS in vcdb2vcm.py, or for one call with 
+# the timeLimit and idleLimit arguments of runVCcommand.  A command that is over
+# a limit is killed with everything it started, a manage build can be silent while
+# a big environment compiles, so the manage limits are generous.  The commands that
+# work on a whole cover project (instrument, lint_analyze, incremental_reinstrument,
+# cover environment build) can run for hours on a big code base, they are run with
+# no limits.  For a vcdb query that is streamed, only the time that we spend waiting
+# for vcdb counts.
+commandTimeLimits = {'clicast':3600, 'clicover':3600, 'vcutil':7200, 'vcdb':3600, 'manage':0, 'vpython':0}
+commandIdleLimits = {'clicast':1800, 'clicover':1800, 'vcutil':1800, 'vcdb':1800, 'manage':3600, 'vpython':0}
+
+# The errors of runVCcommand that a step can report and continue from, a command 
+# that was stopped at its limit is handled like one that failed
+continuableCommandErrors = ['FLEXlm Error', 'VectorCAST command failed', 'VectorCAST command timed out']
+
+# The VectorCAST tools that run at the same time are limited to the license seats
+# that we have for each feature, 0 is no limit.  A command waits for a seat before
+# it is started, and when a command fails because all of the seats are in use 
+# anyway, e.g. another job has them, it is run again after a random wait, that
+# doubles with each retry.  Only the single commands of licenseRetryTools are run
+# again, a manage script or a python helper does several things, and may have done
+# some of them before it failed.  The time spent waiting is reported at the end of 
+# the run, so that we can see when more seats would make the runs faster.
+licenseSeats = {'clicast':0, 'manage':0, 'cover':0}
+licenseRetryTools = ['clicast', 'clicover', 'vcutil', 'vcdb']
+licenseRetries = 6
+licenseBackoffSeconds = 10
+licenseBackoffLimit = 300
+licenseExhaustedPattern = re.compile (r'Licensed number of users already reached|\(-4,')
+licenseStatistics = {}
+licenseCondition = threading.Condition()
+licenseSeatsInUse = {}
+
+def licenseFeature (command):
+    '''
+    Return the license feature that a command needs, or None
+    '''
+    words = commandWords (command)
+    toolName = commandTool (command)
+    if toolName == 'clicover' or (toolName == 'clicast' and 'cover' in words[1:]) or (toolName == 'vcutil' and 'instrument' in words[1:]):
+        return 'cover'
+    elif toolName in ['clicast', 'manage']:
+        return toolName
+    return None
+    
+    
+def licenseStatistic (feature):
+    return licenseStatistics.setdefault (feature, {'commands':0, 'waits':0, 'waitSeconds':0.0, 'longestWait':0.0, 'retries':0})
+    
+    
+@contextlib.contextmanager
+def licenseSeat (feature):
+    '''
+    Wait for one of the license seats of feature, and give it back when we are done
+    '''
+    seats = licenseSeats.get (feature, 0) if feature else 0
+    startTime = time.time()
+    with licenseCondition:
+        if seats > 0:
+            while licenseSeatsInUse.get (feature, 0) >= seats:
+                # A timeout, so that a Ctrl-C is not held up
+                licenseCondition.wait (1.0)
+            licenseSeatsInUse[feature] = licenseSeatsInUse.get (feature, 0) + 1
+        if feature:
+            waitSeconds = time.time() - startTime
+            statistic = licenseStatistic (feature)
+            statistic['commands'] += 1
+            if waitSeconds > 0.1:
+                statistic['waits'] += 1
+                statistic['waitSeconds'] += waitSeconds
+                statistic['longestWait'] = max (statistic['longestWait'], waitSeconds)
+    try:
+        yield
+    finally:
+        if seats > 0:
+            with licenseCondition:
+                licenseSeatsInUse[feature] -= 1
+                licenseCondition.notify()
+                
+                
+def runWithLicense (command, runFunction):
+    '''
+    Call runFunction, which runs command and returns a tuple that starts with the 
+    output, while we hold a license seat.  If the license server says that all of
+    the seats are in use, we wait and try again, up to licenseRetries times, when
+    the command is one of licenseRetryTools.
+    '''
+    feature = licenseFeature (command)
+    retries = licenseRetries if commandTool (command) in licenseRetryTools else 0
+    attempt = 0
+    while True:
+        with licenseSeat (feature):
+            result = runFunction()
+        if attempt >= retries or 'FLEXlm Error:' not in result[0] or not licenseExhaustedPattern.search (result[0]):
+            return result
+        # Full jitter, so that the jobs that failed together do not retry together
+        backoffSeconds = random.uniform (0, min (licenseBackoffLimit, licenseBackoffSeconds * 2**attempt))
+        attempt += 1
+        with licenseCondition:
+            licenseStatistic (feature or 'other')['retries'] += 1
+        recordCommandEvent ('   no ' + (feature or 'license') + ' seat available, retry ' + str (attempt) + ' in ' + 
+                            '%.1f' % backoffSeconds + ' seconds: ' + commandString (command))
+        time.sleep (backoffSeconds)
+        
+        
+def reportLicenseWaits ():
+    '''
+    Add the time spent waiting for license seats to the status file
+    '''
+    for feature, statistic in sorted (licenseStatistics.items()):
+        if statistic['waits'] > 0 or statistic['retries'] > 0:
+            addToSummaryStatus ('   ' + feature + ' licenses: ' + str (statistic['commands']) + ' command(s), ' + 
+                                str (statistic['waits']) + ' waited ' + getTimeString (statistic['waitSeconds']*1000.0) + 
+                                ' (longest ' + getTimeString (statistic['longestWait']*1000.0) + '), ' + 
+                                str (statistic['retries']) + ' retried')
+                                
+
+# The commands that are running, so that a Ctrl-C can stop all of them
+activeProcesses = set()
+activeProcessesLock = threading.Lock()
+
+
+def commandLimits (command, timeLimit, idleLimit):
+    '''
+    Return the time and idle limits for a command, the arguments win over the
+    defaults for the tool
+    '''
+    toolName = commandTool (command)
+    if timeLimit is None:
+        timeLimit = commandTimeLimits.get (toolName, 0)
+    if idleLimit is None:
+        idleLimit = commandIdleLimits.get (toolName, 0)
+    return timeLimit, idleLimit
+    
+    
+def recordCommandEvent (message):
+    '''
+    Timeouts and cancelled commands go to the status file when it is open
+    '''
+    if summaryStatusFileHandle:
+        addToSummaryStatus (message)
+    else:
+        print message
+        
+        
+def startCommand (commandToRun, **popenArgs):
+    '''
+    Start a command in its own process group, so that we can kill everything 
+    that the command started, and remember it until stopCommand is called
+    '''
+    if os.name != 'nt':
+        popenArgs['preexec_fn'] = os.setsid
+    process = subprocess.Popen (commandToRun, shell=not isinstance (commandToRun, list), **popenArgs)
+    process.commandText = commandString (commandToRun)
+    with activeProcessesLock:
+        activeProcesses.add (process)
+    return process
+    
+    
+def stopCommand (process):
+    with activeProcessesLock:
+        activeProcesses.discard (process)
+        
+        
+def cancelActiveCommands ():
+    '''
+    Kill all of the running VectorCAST commands, this is called for a Ctrl-C
+    '''
+    with activeProcessesLock:
+        processes = list (activeProcesses)
+        activeProcesses.clear()
+    for process in processes:
+        if process.poll() is None:
+            killProcessTree (process)
+            recordCommandEvent ('   cancelled: ' + process.commandText)
+            
+            
+def mapOnPool (pool, function, tasks):
+    '''
+    The same as pool.map, but a Ctrl-C is not held up until all of the tasks
+    are finished, because the wait has a timeout.  A Ctrl-C kills the commands 
+    that the tasks are running, so that the pool can be joined
+    '''
+    try:
+        return pool.map_async (function, tasks).get (sys.maxint)
+    except KeyboardInterrupt:
+        cancelActiveCommands()
+        pool.terminate()
+        raise
+    
+    
+def readCommandOutput (stream, streamName, outputQueue):
+    '''
+    Read the lines of stdout or stderr of a command on a thread, the lines 
+    are passed back on outputQueue, None marks the end of the stream
+    '''
+    for line in iter (stream.readline, ''):
+        outputQueue.put ((streamName, line))
+    stream.close()
+    outputQueue.put ((streamName, None))
+    
+
+def runVCcommand(command, abortOnError, outputCallback=None, timeLimit=None, idleLimit=None):
     '''
     Run Command with subprocess.Popen and return status
     If the fatal flag is true, we abort the process, if 
     not, we print the stdout and continue ...
+    If outputCallback is given, it is called with each line of stdout as it arrives
+    timeLimit and idleLimit override the limits for the tool, see commandTimeLimits
     '''
     
     global verboseOutput
     if verboseOutput:
-        print "CWD: " +  os.getcwd() + " => " + command
+        print "CWD: " +  os.getcwd() + " => " + commandString (command)
 
-    cmdOutput = ''
-    commandToRun = os.path.join (vcInstallDir, command)
+    timeLimit, idleLimit = commandLimits (command, timeLimit, idleLimit)
+    cmdOutput, exitCode, killedFor = runWithLicense (command, lambda: watchVCcommand (command, outputCallback, timeLimit, idleLimit))
     
-    print '   running command: ' + commandToRun
-    vcProc = subprocess.Popen(commandToRun, stdout=subprocess.PIPE,\
-                                stderr=subprocess.PIPE,universal_newlines=True,shell=True)
-    stdoutLines = iter(vcProc.stdout.readline, "")
-    stderrLines = iter(vcProc.stderr.readline, "")
-
-    for line in stdoutLines:
-        if verboseOutput:
-           sys.stdout.write(line)
+    if killedFor:
+        if killedFor == 'time':
+            recordCommandEvent ('   command stopped after the ' + str (timeLimit) + ' second limit: ' + commandString (command))
         else:
-            sys.stdout.write('.')
-        cmdOutput+=line
-        
-    for line in stderrLines:
-        if verboseOutput:
-           sys.stderr.write(line)
-        else:
-            sys.stderr.write('.')
-        cmdOutput+=line    
+            recordCommandEvent ('   command stopped after ' + str (idleLimit) + ' seconds with no output: ' + commandString (command))
+        if abortOnError:
+            print "AC: Raising Exception"
+            raise Exception ('VectorCAST command timed out')
+        return cmdOutput, exitCode
         
-    vcProc.stdout.close()
-    exitCode = vcProc.wait()
-    sys.stdout.write('\n')
+    checkCommandOutput (cmdOutput, exitCode, abortOnError)
+    return cmdOutput, exitCode
     
+    
+def checkCommandOutput (cmdOutput, exitCode, abortOnError):
+    '''
+    Handle the errors of a VectorCAST command, a license error is always fatal
+    a non-zero exit code is fatal when abortOnError is set
+    '''
     # check for license error and handle this as a special case
     if 'FLEXlm Error:' in cmdOutput:
         print ('FLEXlm Error While Running VectorCAST Command')
@@ -214,17 +555,190 @@ def runVCcommand(command, abortOnError):
         if abortOnError:
             print "AC: Raising Exception"
             raise Exception ('VectorCAST command failed')
+    
+    
+def watchVCcommand (command, outputCallback, timeLimit, idleLimit):
+    '''
+    Run one attempt of a runVCcommand command, and kill it if it is over the limits
+    Returns the output, the exit code, and why the command was killed
+    '''
+    stdoutText = ''
+    stderrText = ''
+    commandToRun = toolCommand (command)
+    
+    print '   running command: ' + commandString (commandToRun)
+    vcProc = startCommand (commandToRun, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    outputQueue = Queue.Queue()
+    readers = [threading.Thread (target=readCommandOutput, args=(vcProc.stdout, 'stdout', outputQueue)),
+               threading.Thread (target=readCommandOutput, args=(vcProc.stderr, 'stderr', outputQueue))]
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+        
+    killedFor = None
+    startTime = time.time()
+    lastOutputTime = startTime
+    openStreams = len (readers)
+    try:
+        while openStreams > 0:
+            if timeLimit > 0 and time.time() - startTime > timeLimit:
+                killedFor = 'time'
+            elif idleLimit > 0 and time.time() - lastOutputTime > idleLimit:
+                killedFor = 'idle'
+            if killedFor:
+                killProcessTree (vcProc)
+                break
+            try:
+                streamName, line = outputQueue.get (timeout=0.5)
+            except Queue.Empty:
+                continue
+            lastOutputTime = time.time()
+            if line is None:
+                openStreams -= 1
+            elif streamName == 'stdout':
+                if verboseOutput:
+                    sys.stdout.write(line)
+                else:
+                    sys.stdout.write('.')
+                stdoutText+=line
+                if outputCallback:
+                    outputCallback (line)
+            else:
+                if verboseOutput:
+                    sys.stderr.write(line)
+                else:
+                    sys.stderr.write('.')
+                stderrText+=line
+        exitCode = vcProc.wait()
+    except KeyboardInterrupt:
+        cancelActiveCommands()
+        raise
+    finally:
+        stopCommand (vcProc)
+    sys.stdout.write('\n')
+    return stdoutText + stderrText, exitCode, killedFor
+    
 
-    return cmdOutput, exitCode
+def killProcessTree (process):
+    '''
+    Kill a command that was started by startCommand, and the processes that it started
+    '''
+    if os.name == 'nt':
+        with open (os.devnull, 'w') as devnull:
+            subprocess.call ('taskkill /T /F /PID ' + str (process.pid), stdout=devnull, stderr=devnull)
+    else:
+        try:
+            os.killpg (process.pid, signal.SIGKILL)
+        except OSError:
+            # It finished on its own
+            pass
+            
+            
+def runWithTimeLimit (command, timeLimit, cwd=None, idleLimit=0):
+    '''
+    Run a VectorCAST command with a wall clock limit in seconds (0 for no limit).
+    A command that runs over the limit, or that has no new output for idleLimit 
+    seconds, is killed, with the processes that it started.  This is safe to call
+    from threads, it does not change the working directory.
+    Returns the output, the exit code, and why the command was killed: 
+    None, 'time' or 'idle'
+    '''
+    return runWithLicense (command, lambda: watchCommandInFile (command, timeLimit, cwd, idleLimit))
+    
     
+def watchCommandInFile (command, timeLimit, cwd, idleLimit):
+    '''
+    Run one attempt of a runWithTimeLimit command.  The output goes to a temporary 
+    file, so that a command with a lot of output does not block while we wait for it
+    '''
+    commandToRun = toolCommand (command)
+    if verboseOutput:
+        print "CWD: " + (cwd or os.getcwd()) + " => " + commandString (command)
+    with tempfile.TemporaryFile () as outputFile:
+        process = startCommand (commandToRun, stdout=outputFile, stderr=subprocess.STDOUT, cwd=cwd)
+        killedFor = None
+        endTime = time.time() + timeLimit
+        outputSize = 0
+        lastOutputTime = time.time()
+        try:
+            while process.poll() is None:
+                currentSize = os.fstat (outputFile.fileno()).st_size
+                if currentSize != outputSize:
+                    outputSize = currentSize
+                    lastOutputTime = time.time()
+                if timeLimit > 0 and time.time() > endTime:
+                    killedFor = 'time'
+                elif idleLimit > 0 and time.time() - lastOutputTime > idleLimit:
+                    killedFor = 'idle'
+                if killedFor:
+                    killProcessTree (process)
+                    break
+                time.sleep (0.1)
+            exitCode = process.wait()
+        finally:
+            stopCommand (process)
+        outputFile.seek (0)
+        return outputFile.read(), exitCode, killedFor
+        
+
+# These caches keep the answers from vcdb and vcutil for as long as the files
+# behind them are unchanged.  Within one run this avoids repeating queries, and 
+# the automation daemon (startAutomation --command daemon) keeps them warm between commands
+vcdbQueryCache = {}
+cfgOptionCache = {}
+cacheStatistics = {'vcdb-hits':0, 'vcdb-queries':0, 'cfg-hits':0, 'cfg-queries':0}
+
+def fileStamp (fileName):
+    '''
+    This function will return the modification time and size of fileName
+    or None if the file does not exist
+    '''
+    try:
+        fileStat = os.stat (fileName)
+        return [fileStat.st_mtime, fileStat.st_size]
+    except OSError:
+        return None
+        
+
+def runVCDBquery (queryArgs, abortOnError, force=False):
+    '''
+    This function will run a read-only vcdb query, e.g. getfiles or getpaths.
+    The output is cached until the vcshell.db file changes
+    '''
+    command = vcdbCommand (*queryArgs.split(), force=force)
+    dbStamp = fileStamp (os.path.join (vcshellDBlocation, vcshellDBname))
+    # The --db arg can be relative to the current directory
+    cacheKey = (os.getcwd(), tuple (command))
+    cachedValue = vcdbQueryCache.get (cacheKey)
+    if cachedValue and cachedValue[0] == dbStamp:
+        cacheStatistics['vcdb-hits'] += 1
+        return cachedValue[1], cachedValue[2]
+        
+    cacheStatistics['vcdb-queries'] += 1
+    stdOut, exitCode = runVCcommand (command, abortOnError)
+    if exitCode == 0:
+        vcdbQueryCache[cacheKey] = (dbStamp, stdOut, exitCode)
+    return stdOut, exitCode
+
 
 def readCFGoption (optionName):
     '''
     This function will look for optionName in the local directory
     CCAST_.CFG file and return the value.  If the option is not
     found or there is not a CCAST_.CFG file we return ""
+    The values are cached by the contents of the CFG file.
     '''
-    optionValue, exitCode = runVCcommand ('vcutil -lc get_option ' + optionName, globalAbortOnError)
+    cacheKey = None
+    if os.path.isfile (C_CONFIG_FILE):
+        cacheKey = (fileContentHash (C_CONFIG_FILE), optionName)
+        if cacheKey in cfgOptionCache:
+            cacheStatistics['cfg-hits'] += 1
+            return cfgOptionCache[cacheKey]
+            
+    cacheStatistics['cfg-queries'] += 1
+    optionValue, exitCode = runVCcommand (vcutilCommand ('get_option', optionName, lc=True), globalAbortOnError, timeLimit=300)
+    if cacheKey and exitCode == 0:
+        cfgOptionCache[cacheKey] = optionValue.rstrip('\n')
     return optionValue.rstrip('\n')
        
 def readAdaCFGoption (optionName):
@@ -237,21 +751,199 @@ def readAdaCFGoption (optionName):
             return line.split (':')[1].strip()
 
     
-def runPythonScript (scriptLocation, scriptFile, argString):
+# The VectorCAST python helper scripts, EnvCreate.py and UnInstrument.py, are run
+# in this process by default ('inprocess'), which saves starting vpython and loading
+# the vector package for every call.  They can also be run in a vpython worker
+# process that is started early and reused ('worker'), so that a crash in a helper
+# does not stop the run, or in a new vpython for each call ('process')
+validPythonHelperModes = ['inprocess', 'worker', 'process']
+pythonHelperMode = 'inprocess'
+pythonHelperScripts = [pathToEnvCreateScript, pathToUnInstrumentScript]
+pythonHelperWorkerOption = '--python-helper-worker'
+pythonHelperWorker = None
+pythonHelperLock = threading.Lock()
+
+def helperExitCode (code):
     '''
-    This function will dynamically import and call a python script
-    rather than starting vpython.  Hopefully this is faster
-    
-    Leaving this un-used for now.
+    Return the exit code for the argument of a sys.exit call
     '''
-    # Dynamically import the correct python file
-    sys.path.append (scriptLocation)
-    pyFile = __import__(scriptFile)
+    if code is None:
+        return 0
+    elif isinstance (code, int):
+        return code
+    print code
+    return 1
     
-    argList = [scriptFile]
-    argList += argString.split()
-    sys.argv = argList
-    pyFile.main()
+    
+def runHelperInProcess (scriptPath, args, cwd):
+    '''
+    Run a python script in this process as if it was started with vpython.
+    sys.argv, sys.path and the working directory are put back afterwards, and 
+    sys.exit is caught.  The output of the script, and of the commands that it 
+    starts, goes to a temporary file, so this must not run on more than one 
+    thread at a time, see pythonHelperLock.
+    Returns the output and the exit code
+    '''
+    savedArgv = sys.argv
+    savedPath = list (sys.path)
+    savedDirectory = os.getcwd()
+    savedStreams = (sys.stdout, sys.stderr)
+    exitCode = 0
+    with tempfile.TemporaryFile () as outputFile:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        savedStdout = os.dup (1)
+        savedStderr = os.dup (2)
+        os.dup2 (outputFile.fileno(), 1)
+        os.dup2 (outputFile.fileno(), 2)
+        # The daemon replaces sys.stdout, the script output goes to the file
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        try:
+            sys.argv = [scriptPath] + list (args)
+            sys.path.insert (0, os.path.dirname (scriptPath))
+            os.chdir (cwd)
+            try:
+                runpy.run_path (scriptPath, run_name='__main__')
+            except SystemExit, err:
+                exitCode = helperExitCode (err.code)
+            except Exception:
+                traceback.print_exc ()
+                exitCode = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            sys.stdout, sys.stderr = savedStreams
+            os.dup2 (savedStdout, 1)
+            os.dup2 (savedStderr, 2)
+            os.close (savedStdout)
+            os.close (savedStderr)
+            sys.argv = savedArgv
+            sys.path[:] = savedPath
+            os.chdir (savedDirectory)
+        outputFile.seek (0)
+        return outputFile.read(), exitCode
+        
+        
+def prewarmPythonHelpers ():
+    '''
+    Import the modules that the helper scripts import, this loads the parts of
+    the vector package that they use.  The scripts themselves are not imported,
+    because a script without a __main__ check would do its work
+    '''
+    for scriptPath in pythonHelperScripts:
+        if os.path.isfile (scriptPath):
+            savedPath = list (sys.path)
+            sys.path.insert (0, os.path.dirname (scriptPath))
+            try:
+                with open (scriptPath, 'r') as f:
+                    tree = ast.parse (f.read(), scriptPath)
+                for node in tree.body:
+                    if isinstance (node, ast.Import):
+                        moduleNames = [alias.name for alias in node.names]
+                    elif isinstance (node, ast.ImportFrom) and node.module and node.level == 0:
+                        moduleNames = [node.module]
+                    else:
+                        continue
+                    for moduleName in moduleNames:
+                        try:
+                            __import__ (moduleName)
+                        except Exception, err:
+                            print '   could not load ' + moduleName + ' for ' + os.path.basename (scriptPath) + ': ' + str (err)
+            except (IOError, SyntaxError), err:
+                print '   could not read ' + scriptPath + ': ' + str (err)
+            finally:
+                sys.path[:] = savedPath
+                
+                
+def runHelperWorker ():
+    '''
+    This is the main loop of the worker process, which is started with:
+        vpython AutomationController.py --python-helper-worker
+    Each request is one line of json on stdin, and the reply is one line of json
+    on stdout.  Anything else that is written to stdout goes to stderr instead.
+    '''
+    replies = os.fdopen (os.dup (1), 'w')
+    os.dup2 (2, 1)
+    prewarmPythonHelpers ()
+    for line in iter (sys.stdin.readline, ''):
+        request = json.loads (line)
+        output, exitCode = runHelperInProcess (request['script'], request['args'], request['cwd'])
+        replies.write (json.dumps ({'output':output.decode ('utf-8', 'replace'), 'exitCode':exitCode}) + '\n')
+        replies.flush()
+        
+        
+def startPythonHelperWorker ():
+    '''
+    Start the worker process when the helpers run in a worker, we call this early
+    so that the worker is ready by the time it is needed
+    '''
+    global pythonHelperWorker
+    if pythonHelperMode == 'worker' and (pythonHelperWorker is None or pythonHelperWorker.poll() is not None):
+        workerScript = os.path.splitext (os.path.abspath (__file__))[0] + '.py'
+        if not os.path.isfile (workerScript):
+            workerScript = os.path.abspath (__file__)
+        pythonHelperWorker = startCommand (toolCommand (vpythonCommand (workerScript, pythonHelperWorkerOption)), 
+                                           stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                                           
+                                           
+def stopPythonHelperWorker ():
+    '''
+    The worker stops when its stdin is closed
+    '''
+    global pythonHelperWorker
+    if pythonHelperWorker:
+        pythonHelperWorker.stdin.close()
+        pythonHelperWorker.wait()
+        stopCommand (pythonHelperWorker)
+        pythonHelperWorker = None
+        
+        
+def runHelperInWorker (scriptPath, args, cwd):
+    '''
+    Run a python script in the worker process, if the worker crashes the 
+    script fails, and the next script starts a new worker
+    Returns the output and the exit code
+    '''
+    global pythonHelperWorker
+    startPythonHelperWorker ()
+    try:
+        pythonHelperWorker.stdin.write (json.dumps ({'script':scriptPath, 'args':list (args), 'cwd':cwd}) + '\n')
+        pythonHelperWorker.stdin.flush()
+        reply = pythonHelperWorker.stdout.readline()
+    except IOError:
+        reply = ''
+    if not reply:
+        exitCode = pythonHelperWorker.wait()
+        stopCommand (pythonHelperWorker)
+        pythonHelperWorker = None
+        recordCommandEvent ('   python helper worker stopped with exit code ' + str (exitCode) + ': ' + os.path.basename (scriptPath))
+        return '', exitCode or 1
+    reply = json.loads (reply)
+    return reply['output'].encode ('utf-8'), reply['exitCode']
+    
+    
+def runPythonHelper (scriptPath, args, abortOnError):
+    '''
+    Run one of the VectorCAST python helper scripts with args, in the way
+    that pythonHelperMode asks for.  Returns the output and the exit code, 
+    errors are handled in the same way as in runVCcommand
+    '''
+    command = vpythonCommand (scriptPath, *args)
+    if pythonHelperMode == 'process':
+        return runVCcommand (command, abortOnError)
+        
+    def runHelper ():
+        with pythonHelperLock:
+            if pythonHelperMode == 'worker':
+                return runHelperInWorker (scriptPath, args, os.getcwd())
+            return runHelperInProcess (scriptPath, args, os.getcwd())
+            
+    print '   running python helper: ' + commandString ([scriptPath] + list (args))
+    cmdOutput, exitCode = runWithLicense (command, runHelper)
+    if verboseOutput:
+        sys.stdout.write (cmdOutput)
+    checkCommandOutput (cmdOutput, exitCode, abortOnError)
+    return cmdOutput, exitCode
 
 
 def unInstrumentSourceFiles():
@@ -273,50 +965,337 @@ def unInstrumentSourceFiles():
         fileList.close ()
     else:
         # if there is no existing file list, just call un-instrument
-        fullCommand =  'vpython '
-        fullCommand += pathToUnInstrumentScript
-        stdOut, exitCode = runVCcommand (fullCommand, globalAbortOnError)
+        stdOut, exitCode = runPythonHelper (pathToUnInstrumentScript, [], globalAbortOnError)
     
     
-def filterTheFileList (fullFileList):
+class pathStore:
     '''
-    This function takes in the full list of files from the vcshell.db and
-    filters it down to the files of interest for the current run.  The 
-    first filter is to remove any files that already exist in the cover
-    project, the second filter is based on the user-supplied: maximumFilesToSystemTest
+    This class keeps a large number of paths compactly, each directory is stored 
+    one time as (parent directory, name) and each path as (directory, basename).
+    The paths are referred to by small integer handles.
     '''
+    def __init__(self):
+        # Directory 0 is the directory of relative paths with no directory part
+        self.directories = [(-1, '')]
+        self.directoryIndex = {}
+        self.entries = []
+        self.entryIndex = {}
+        
+    def __len__(self):
+        return len (self.entries)
+        
+    def __contains__(self, path):
+        return self.find (path) is not None
+        
+    def directoryHandle (self, parts, create):
+        directory = 0
+        for part in parts:
+            key = (directory, part)
+            nextDirectory = self.directoryIndex.get (key)
+            if nextDirectory is None:
+                if not create:
+                    return None
+                key = (directory, intern (part))
+                nextDirectory = len (self.directories)
+                self.directories.append (key)
+                self.directoryIndex[key] = nextDirectory
+            directory = nextDirectory
+        return directory
+        
+    def add (self, path):
+        '''
+        Return the handle for path, adding it if needed
+        '''
+        parts = path.split (os.sep)
+        key = (self.directoryHandle (parts[:-1], True), parts[-1])
+        handle = self.entryIndex.get (key)
+        if handle is None:
+            key = (key[0], intern (key[1]))
+            handle = len (self.entries)
+            self.entries.append (key)
+            self.entryIndex[key] = handle
+        return handle
+        
+    def find (self, path):
+        '''
+        Return the handle for path, or None if it is not in the store
+        '''
+        parts = path.split (os.sep)
+        directory = self.directoryHandle (parts[:-1], False)
+        if directory is None:
+            return None
+        return self.entryIndex.get ((directory, parts[-1]))
+        
+    def path (self, handle):
+        directory, name = self.entries[handle]
+        parts = [name]
+        while directory != 0:
+            directory, directoryName = self.directories[directory]
+            parts.append (directoryName)
+        return os.sep.join (reversed (parts))
+        
+    def paths (self, handles):
+        return [self.path (handle) for handle in handles]
+        
+    def basename (self, handle):
+        return self.entries[handle][1]
+        
+    def envScriptName (self, handle):
+        return envScriptName (self.basename (handle))
+        
+        
+# All of the paths for the current run
+projectPaths = pathStore()
 
-    global maximumFilesToSystemTest
-    localFileList = fullFileList[:]
-    listItemsToRemove = []
-    fileCount = 0
+def startVCDBstream (command, timeLimit, idleLimit):
+    '''
+    Start one attempt of a streamVCDBquery command and read its first line, so that
+    a query that fails before it has any output can be run again by runWithLicense.
+    Returns the error output, the exit code, the process and the first line, 
+    when there is no first line the query has finished
+    '''
+    # stderr goes to a file, so that a full pipe cannot block the query
+    errorFile = tempfile.TemporaryFile()
+    vcProc = startCommand (command, stdout=subprocess.PIPE, stderr=errorFile, universal_newlines=True)
+    vcProc.errorFile = errorFile
+    vcProc.waitingSince = None
+    vcProc.waitSeconds = 0.0
+    vcProc.killedFor = None
+    vcProc.finished = threading.Event()
+    vcProc.watchdog = threading.Thread (target=watchVCDBstream, args=(vcProc, timeLimit, idleLimit))
+    vcProc.watchdog.daemon = True
+    vcProc.watchdog.start()
+    firstLine = readVCDBline (vcProc)
+    if firstLine:
+        return '', None, vcProc, firstLine
+    errorOutput, exitCode = finishVCDBstream (vcProc)
+    return errorOutput, exitCode, vcProc, firstLine
+    
+    
+def readVCDBline (vcProc):
+    '''
+    Read the next line of a streamVCDBquery command, the time that we wait here
+    is the time that counts for the limits of the command
+    '''
+    vcProc.waitingSince = time.time()
+    try:
+        return vcProc.stdout.readline()
+    finally:
+        vcProc.waitSeconds += time.time() - vcProc.waitingSince
+        vcProc.waitingSince = None
+        
+        
+def watchVCDBstream (vcProc, timeLimit, idleLimit):
+    '''
+    Kill a streamVCDBquery command that is over its limits, this runs on a thread
+    '''
+    while not vcProc.finished.wait (0.5):
+        waitingSince = vcProc.waitingSince
+        waiting = time.time() - waitingSince if waitingSince else 0.0
+        if timeLimit > 0 and vcProc.waitSeconds + waiting > timeLimit:
+            vcProc.killedFor = 'time'
+        elif idleLimit > 0 and waiting > idleLimit:
+            vcProc.killedFor = 'idle'
+        if vcProc.killedFor:
+            killProcessTree (vcProc)
+            return
+            
+            
+def finishVCDBstream (vcProc):
+    '''
+    Wait for a streamVCDBquery command, and return its error output and exit code
+    '''
+    try:
+        vcProc.stdout.close()
+        exitCode = vcProc.wait()
+    finally:
+        vcProc.finished.set()
+        vcProc.watchdog.join()
+        stopCommand (vcProc)
+    vcProc.errorFile.seek (0)
+    errorOutput = vcProc.errorFile.read()
+    vcProc.errorFile.close()
+    return errorOutput, exitCode
+    
+    
+def streamVCDBquery (queryArgs):
+    '''
+    This function will run a vcdb query and yield the output one line at a time,
+    for queries like getfiles that can return millions of lines.  The output
+    is not cached, because that would keep the whole list in memory
+    '''
+    command = toolCommand (vcdbCommand (*queryArgs.split(), force=True))
+    if verboseOutput:
+        print "CWD: " +  os.getcwd() + " => " + commandString (command)
+    print '   running command: ' + commandString (command)
+    
+    timeLimit, idleLimit = commandLimits (command, None, None)
+    errorOutput, exitCode, vcProc, line = runWithLicense (command, lambda: startVCDBstream (command, timeLimit, idleLimit))
+    if line:
+        try:
+            while line:
+                line = line.rstrip('\n')
+                if len (line) > 0:
+                    yield line
+                line = readVCDBline (vcProc)
+        finally:
+            # The caller can stop early, we do not leave the query running
+            if vcProc.poll() is None and line:
+                killProcessTree (vcProc)
+            errorOutput, exitCode = finishVCDBstream (vcProc)
+    if vcProc.killedFor == 'time':
+        recordCommandEvent ('   command stopped after the ' + str (timeLimit) + ' second limit: ' + commandString (command))
+        raise Exception ('VectorCAST command timed out')
+    elif vcProc.killedFor:
+        recordCommandEvent ('   command stopped after ' + str (idleLimit) + ' seconds with no output: ' + commandString (command))
+        raise Exception ('VectorCAST command timed out')
+    elif 'FLEXlm Error:' in errorOutput:
+        print ('FLEXlm Error While Running VectorCAST Command')
+        print (re.search('FLEXlm Error:(.*)\n', errorOutput).group(1))
+        raise Exception ('FLEXlm Error')
+    elif exitCode != 0:
+        print '   command returned a non-zero exit code: ' + str(exitCode)
+        print '   stderr => '
+        print errorOutput
+        raise Exception ('VectorCAST command failed')
+        
+        
+def fileListBatches (records, batchSize):
+    '''
+    Group the records into lists of at most batchSize records
+    '''
+    batch = []
+    for record in records:
+        batch.append (record)
+        if len (batch) == batchSize:
+            yield batch
+            batch = []
+    if len (batch) > 0:
+        yield batch
+        
+        
+class limitedFileList:
+    '''
+    This class collects the handles of the first "limit" files that pass the accept test.
+    The files of interest are kept separately, so that they end up at the start
+    of the list no matter where they are in the DB.  Once the list is full
+    we stop calling accept for the other files.
+    '''
+    def __init__(self, limit, accept):
+        self.limit = limit
+        self.accept = accept
+        self.interestingFiles = []
+        self.otherFiles = []
+        self.truncated = False
+        
+    def add (self, fileName, interesting):
+        if self.truncated and not interesting:
+            return
+        if self.accept (fileName):
+            if interesting:
+                self.interestingFiles.append (projectPaths.add (fileName))
+            elif len (self.otherFiles) < self.limit:
+                self.otherFiles.append (projectPaths.add (fileName))
+            else:
+                self.truncated = True
+                
+    def files (self):
+        if len (self.interestingFiles) + len (self.otherFiles) > self.limit:
+            self.truncated = True
+        return (self.interestingFiles + self.otherFiles)[:self.limit]
+        
+
+def filesAlreadyInProject ():
+    '''
+    Return the set of handles of the files that are already in the coverage project
+    '''
+    existingFiles = os.path.join (originalWorkingDirectory, vcWorkArea, listOfFilesInProject)
+    filesInProject = set()
+    if os.path.isfile (existingFiles):
+        addToSummaryStatus ('   checking the existing project files ... ')
+        with open (existingFiles, 'r') as oldFile:
+            for line in oldFile: 
+                filesInProject.add (projectPaths.add (line.strip()))
+    return filesInProject
     
-    # First step is to remove any files that are already in the coverage project
-    if os.path.isdir (os.path.join (originalWorkingDirectory, vcWorkArea)):
-        existingFiles = os.path.join (originalWorkingDirectory, vcWorkArea, listOfFilesInProject)
-        if os.path.isfile (existingFiles):
-            addToSummaryStatus ('   checking the existing project files ... ')
-            oldFile = open (existingFiles, 'r')
-            lines = oldFile.readlines()
-            for line in lines: 
-                strippedLine = line.strip()
-                if strippedLine in localFileList:
-                    localFileList.remove (strippedLine)
-    
-    # If we have more files than the requested max, then truncate.
-    if len (localFileList) > maximumFilesToSystemTest:
-        # take the first N files
+    
+# The files that were in the DB the last time that buildFileLists read it
+databaseFiles = set()
+
+def buildFileLists (filterFunction, filesOfInterest, knownFiles=None):
+    '''
+    This function streams the files from the DB through the user supplied filter, 
+    and into the list of files to add to the cover project (not already in the project, 
+    up to maximumFilesToSystemTest) and the list of files that need environment scripts
+    (no script yet and not in a work bundle, up to maximumFilesToUnitTest).  
+    The user filter is called once for each batch of fileListBatchSize files.
+    The files of interest go to the start of both lists.  The files in knownFiles
+    are skipped before the filter, watch mode uses this for the files that it has seen.
+    '''
+    global listOfFiles
+    global listOfUnitTestFiles
+    global databaseFiles
+    
+    filesInProject = filesAlreadyInProject()
+    filesInBundles = filesInWorkBundles()
+    scriptsDirectory = os.path.join (originalWorkingDirectory, vcWorkArea, vcScriptsDirectory)
+    systemTestFiles = limitedFileList (maximumFilesToSystemTest, lambda fileName: projectPaths.find (fileName) not in filesInProject)
+    unitTestFiles = limitedFileList (maximumFilesToUnitTest, lambda fileName: fileName not in filesInBundles and \
+                                     not os.path.isfile (os.path.join (scriptsDirectory, envScriptName (fileName))))
+    
+    if filesOfInterest != [parameterNotSetString]:
+        filesNotInDb = set ([normalizePath (file) for file in filesOfInterest])
+    else:
+        filesNotInDb = set()
+    interestingNames = set (filesNotInDb)
+    
+    totalFileCount = 0
+    filteredFileCount = 0
+    filesInDb = set()
+    addToSummaryStatus ('   applying the user-defined filter to the file list ... ')
+    for batch in fileListBatches (streamVCDBquery ('getfiles'), fileListBatchSize):
+        totalFileCount += len (batch)
+        filesInDb.update (batch)
+        if knownFiles:
+            batch = [fileName for fileName in batch if fileName not in knownFiles]
+            if len (batch) == 0:
+                continue
+        # filterFunction is the user supplied callback function
+        batch = filterFunction (batch)
+        filteredFileCount += len (batch)
+        for fileName in batch:
+            interesting = False
+            if len (interestingNames) > 0:
+                for name in [normalizePath (fileName), normalizePath (os.path.basename (fileName))]:
+                    if name in interestingNames:
+                        interesting = True
+                        filesNotInDb.discard (name)
+            systemTestFiles.add (fileName, interesting)
+            unitTestFiles.add (fileName, interesting)
+    
+    if totalFileCount == 0:
+        fatalError ('No files found in vcshell.db (' + vcshellDBname + ')')
+    databaseFiles = filesInDb
+    addToSummaryStatus ('   found ' + str(totalFileCount) + ' total source files')
+    if knownFiles:
+        addToSummaryStatus ('   ' + str (filteredFileCount) + ' new file(s) passed the user filter')
+    elif filteredFileCount < totalFileCount:
+        addToSummaryStatus ('   user filter reduced file count to: ' + str (filteredFileCount))
+    # If the user specified file is not in db. Log the file in summary and continue
+    if filesNotInDb:
+        addToSummaryStatus('   File %s in FILES_OF_INTEREST not found in db' % str(sorted (filesNotInDb)))
+        
+    listOfFiles = systemTestFiles.files()
+    if systemTestFiles.truncated:
         addToSummaryStatus ('   limiting file list to (MAXIMUM_FILES_TO_SYSTEM_TEST)=' + str (maximumFilesToSystemTest))
-        localFileList = localFileList[0:maximumFilesToSystemTest]
-      
-    return localFileList
+    listOfUnitTestFiles = unitTestFiles.files()
 
 
 def writeFileListToFile (list):
     
     global listOfFilenamesFile
     
-    listFile = open (listOfFilenamesFile, 'w')
+    listFile = open (os.path.join (originalWorkingDirectory, vcWorkArea, listOfFilenamesFile), 'w')
     for file in list:
         listFile.write (file + '\n')
     
@@ -334,62 +1313,134 @@ def initializeCFGfile (compilerCFG, vcdbFlagString):
     '''
     
     if os.path.isfile (compilerCFG):
-        # If the user passed in the location of the local CCAST_.CFG 
-        # we don't need to do anything
-        if os.path.isfile (C_CONFIG_FILE) and (os.stat(compilerCFG) == os.stat(C_CONFIG_FILE)):
-            pass
-        else:
-            shutil.copyfile(compilerCFG, C_CONFIG_FILE)
+        # If the user passed in the location of the local CCAST_.CFG, or a 
+        # file with the same contents, we don't need to do anything
+        propagateFile (compilerCFG, C_CONFIG_FILE, link=False)
     else:
-        stdOut, exitCode = runVCcommand ('clicast -lc template ' + compilerCFG, True)
+        stdOut, exitCode = runVCcommand (clicastCommand ('template', compilerCFG, lc=True), True)
         
     # Now setup any command over-rides that are requested by the configuration
     # By doing the option changes here we are setting the value in the base CCAST_.CFG
     # which gets copied everywhere in the vcast-workarea.
-    stdOut, exitCode = runVCcommand ('clicast -lc option vcast_vcdb_flag_string ' + vcdbFlagString, globalAbortOnError)
+    stdOut, exitCode = runVCcommand (clicastCommand ('option', 'vcast_vcdb_flag_string', vcdbFlagString, lc=True), globalAbortOnError)
     
     
-def getCFGfile ():
+def fileContentHash (fileName):
     '''
-    This function will copy the CFG from the orignalWorkingDirectory
-    to the current working directory.  We delete any existing CFG
-    files in the destination area, so that we only have the CCAST
-    or the ADACAST depending on the type of enviro we are adding.
+    This function will return the sha1 digest of the contents of fileName.
+    We use this rather than os.stat to decide if two files are the same,
+    because the stat tuple includes the access time, which changes every
+    time one of the VectorCAST tools reads the file
     '''
-    global cfgFileLocation
-    
-    cfgFile = os.path.join (cfgFileLocation, C_CONFIG_FILE)
-    # if there is a local file, and it is the one we want then do nothing
-    if os.path.isfile(cfgFile):
-        if os.path.isfile (C_CONFIG_FILE) and (os.stat (cfgFile) == os.stat (C_CONFIG_FILE)):
-            pass
-        elif os.path.isfile (cfgFile):
-            shutil.copyfile(cfgFile, C_CONFIG_FILE)
-    cfgFile = os.path.join (cfgFileLocation, ADA_CONFIG_FILE)
-    if os.path.isfile(cfgFile):
-        if os.path.isfile (ADA_CONFIG_FILE) and (os.stat (cfgFile) == os.stat (ADA_CONFIG_FILE)):
-            pass
-        elif os.path.isfile (cfgFile):
-            shutil.copyfile(cfgFile, ADA_CONFIG_FILE)
-    
-    
-    
+    digest = hashlib.sha1()
+    with open (fileName, 'rb') as f:
+        for block in iter (lambda: f.read (65536), b''):
+            digest.update (block)
+    return digest.hexdigest()
 
-def buildWorkarea():
 
-    global vcCoverDirectory
-    global coverageProjectName
-    global vcManageDirectory
-    global manageProjectName
+def isSameFile (firstFile, secondFile):
+    '''
+    os.path.samefile does not exist on windows for python 2, so we 
+    fall back to comparing the normalized paths
+    '''
+    if hasattr (os.path, 'samefile'):
+        return os.path.samefile (firstFile, secondFile)
+    else:
+        return os.path.normcase (os.path.abspath (firstFile)) == os.path.normcase (os.path.abspath (secondFile))
 
-    addToSummaryStatus ('   checking for work area ...')
-    workAreaPath = os.path.join (os.getcwd(), vcWorkArea)
-    
-    # Pre September 2017 we use vc_manage to store the manage project
-    # Now we use vc_project ... to handle this, we check for this case
-    # and delelete the old vcast-workarea if necessary
-    addToSummaryStatus ('Checking for old work-area ...')
-    oldPath = os.path.join (workAreaPath, 'vc_manage')
+
+def linkOrCopyFile (sourceFile, destinationFile):
+    '''
+    This function will hard link sourceFile to destinationFile.  If the 
+    platform or the file system does not support hard links (or the files
+    are on different devices) we fall back to a real copy
+    '''
+    if os.path.lexists (destinationFile):
+        os.remove (destinationFile)
+    try:
+        os.link (sourceFile, destinationFile)
+    except (AttributeError, OSError):
+        shutil.copyfile (sourceFile, destinationFile)
+
+
+def propagateFile (sourceFile, destinationFile, link=True):
+    '''
+    This function will make sure that destinationFile has the same contents
+    as sourceFile.  If the files already have the same contents we do nothing,
+    otherwise we hard link (or copy if link is False) the source into place.
+    The return value is True if the destination was updated.
+    '''
+    if os.path.isfile (destinationFile):
+        if isSameFile (sourceFile, destinationFile):
+            return False
+        if fileContentHash (sourceFile) == fileContentHash (destinationFile):
+            return False
+        
+    if link:
+        linkOrCopyFile (sourceFile, destinationFile)
+    else:
+        shutil.copyfile (sourceFile, destinationFile)
+    return True
+    
+
+def canonicalCFGfile (cfgFileName):
+    '''
+    Each vcast-workarea keeps one canonical copy of the CFG file in its root
+    directory, and the CFG files in vc_coverage, vc_ut_scripts and vc_project 
+    are hard links to this copy.  The canonical copy is refreshed from the 
+    cfgFileLocation by content, so a CFG change is detected (and reported) once
+    per run, rather than being silently copied into each of the sub-directories.
+    
+    If there is no workarea yet, we simply return the file in the cfgFileLocation
+    '''
+    sourceFile = os.path.join (cfgFileLocation, cfgFileName)
+    workAreaPath = os.path.join (originalWorkingDirectory, vcWorkArea)
+    if not os.path.isdir (workAreaPath):
+        return sourceFile
+        
+    canonicalFile = os.path.join (workAreaPath, cfgFileName)
+    if os.path.isfile (canonicalFile) and isSameFile (sourceFile, canonicalFile):
+        return canonicalFile
+        
+    cfgExisted = os.path.isfile (canonicalFile)
+    # We copy rather than link the canonical file, so that an edit of the
+    # original CFG is always seen as a change by this comparison
+    if propagateFile (sourceFile, canonicalFile, link=False) and cfgExisted:
+        addToSummaryStatus ('   compiler configuration changed: ' + cfgFileName + ' updated in the work area')
+    return canonicalFile
+    
+    
+def getCFGfile ():
+    '''
+    This function will link the CFG from the orignalWorkingDirectory
+    to the current working directory, using the canonical workarea copy.
+    We only replace the local file when the contents are different,
+    and we keep only the CCAST or the ADACAST that exist in the 
+    cfgFileLocation.
+    '''
+    for cfgFileName in [C_CONFIG_FILE, ADA_CONFIG_FILE]:
+        # if there is a local file, and it is the one we want then do nothing
+        if os.path.isfile (os.path.join (cfgFileLocation, cfgFileName)):
+            propagateFile (canonicalCFGfile (cfgFileName), cfgFileName)
+    
+    
+
+def buildWorkarea():
+
+    global vcCoverDirectory
+    global coverageProjectName
+    global vcManageDirectory
+    global manageProjectName
+
+    addToSummaryStatus ('   checking for work area ...')
+    workAreaPath = os.path.join (os.getcwd(), vcWorkArea)
+    
+    # Pre September 2017 we use vc_manage to store the manage project
+    # Now we use vc_project ... to handle this, we check for this case
+    # and delelete the old vcast-workarea if necessary
+    addToSummaryStatus ('Checking for old work-area ...')
+    oldPath = os.path.join (workAreaPath, 'vc_manage')
     if os.path.isdir (oldPath):
         addToSummaryStatus ('   removing old work-area instance')
         shutil.rmtree (workAreaPath)
@@ -460,11 +1511,35 @@ def normalizePath (path):
         return path
         
     
+def readDatabasePaths ():
+    '''
+    This function will read the directory paths of the DB into listOfPaths
+    '''
+    global listOfPaths
+    
+    listOfPaths = []
+    stdOut, exitCode = runVCDBquery ('getpaths', True)
+    fullPathList = stdOut.split('\n')
+    
+    for path in fullPathList:
+        # We get some blank lines from the getpaths for some reason
+        if len (path) > 4 and path[0]=='(' and path[2]==')' and path[3]==' ':
+            # The output of the getpaths command looks like
+            # (s) path, so split the (s) part into the second part of a tuple
+            splitText = path.split(' ')
+            listOfPaths.append((projectPaths.add (normalizePath (splitText[1])), splitText[0]))
+            
+    # destroy the temp list
+    del fullPathList[:]
+    if len (listOfPaths) > 0:
+        addToSummaryStatus ('   found ' + str(len (listOfPaths)) + ' source paths')   
+        
+        
 def initialize (compilerCFG, filterFunction, vcdbFlagString, filesOfInterest):
 
     global listOfFiles
-    global listOfAllFiles
     global listOfPaths
+    global projectPaths
     global vcshellDBlocation
     global topLevelMakeCommand
     global topLevelMakeLocation
@@ -474,8 +1549,10 @@ def initialize (compilerCFG, filterFunction, vcdbFlagString, filesOfInterest):
     
     
     projectMode = ''
-    fullFileList = []
     fullPathList = []
+    # We can be called more than once in the same process (automation daemon)
+    listOfPaths = []
+    projectPaths = pathStore()
     sectionBreak ('')
     
     addToSummaryStatus ('Validating vcshell.db ... (' + vcshellDBname + ")")
@@ -485,86 +1562,22 @@ def initialize (compilerCFG, filterFunction, vcdbFlagString, filesOfInterest):
     initializeCFGfile (compilerCFG, vcdbFlagString)
     
     if os.path.isfile (os.path.join (vcshellDBlocation, vcshellDBname)):
-        # Create a global list of all of the files in the DB
-        stdOut, exitCode = runVCcommand ('vcdb ' + vcshellDBarg() + ' getfiles', True)
-        # strip the trailing CR and then split
-        listOfAllFiles = stdOut.rstrip('\n').split('\n')
-        if len (listOfAllFiles) == 0:
-            fatalError ('No files found in vcshell.db (' + vcshellDBname + ')')
-        else:
-            addToSummaryStatus ('   found ' + str(len (listOfAllFiles)) + ' total source files')
-            
-        # Now Call the user supplied filter function to filter the fullFileList
-        addToSummaryStatus ('   applying the user-defined filter to the file list ... ')
-        # filterFunction is the user supplied callback function
-        originalFileListLength = len (listOfAllFiles)
-        listOfAllFiles = filterFunction(listOfAllFiles)
-        if len (listOfAllFiles) < originalFileListLength:
-            addToSummaryStatus ('   user filter reduced file count to: ' + str (len (listOfAllFiles)))
-            
-        # Move the user specified files of interest to the begining in listOfAllFiles
-        if filesOfInterest != [parameterNotSetString]:
-            if os.name == "nt":
-                filesOfInterest = [file.lower() for file in filesOfInterest]
-            sortedListOfAllFiles = list(listOfAllFiles)
-            filesNotInDb = list(filesOfInterest)
-            index = 0
-            for file in listOfAllFiles:
-                fullPath = ''
-                if os.name == "nt":
-                    tempFile = file.lower()
-                else:
-                    tempFile = file
-                # If file matches any entry in filesOfInterest 
-                if tempFile in filesOfInterest or os.path.basename(file) in filesOfInterest:
-                    sortedListOfAllFiles.remove(file)
-                    sortedListOfAllFiles.insert(index, file)
-                    index += 1
-                    if tempFile in filesOfInterest:
-                        filesNotInDb.remove(tempFile)
-                    else:
-                        filesNotInDb.remove(os.path.basename(file))
-                # Exit the loop if all files in files of interest processed
-                if not filesNotInDb:
-                    break
-            # If the user specified file is not in db. Log the file in summary and continue
-            if filesNotInDb:
-               addToSummaryStatus('   File %s in FILES_OF_INTEREST not found in db' % str(filesNotInDb))
-            listOfAllFiles = list(sortedListOfAllFiles)
-        # filter based on: already in project and max size
-        listOfFiles = filterTheFileList (listOfAllFiles)
-        addToSummaryStatus ('   ' + str(len (listOfFiles)) + ' files will be added for system testing ... ')
-
         # Create a global list of all of the directory paths in the DB
-        stdOut, exitCode = runVCcommand ('vcdb ' + vcshellDBarg() + ' getpaths', True)
-        fullPathList = stdOut.split('\n')
-        
-        for path in fullPathList:
-            # We get some blank lines from the getpaths for some reason
-            if len (path) > 4 and path[0]=='(' and path[2]==')' and path[3]==' ':
-                # The output of the getpaths command looks like
-                # (s) path, so split the (s) part into the second part of a tuple
-                splitText = path.split(' ')
-                listOfPaths.append((normalizePath (splitText[1]), splitText[0]))
-                
-        # destroy the temp list
-        del fullPathList[:]
-        if len (listOfPaths) > 0:
-            addToSummaryStatus ('   found ' + str(len (listOfPaths)) + ' source paths')   
+        readDatabasePaths ()
             
         # Read the top level make command and directory from the database
-        cmdOutput, exitCode = runVCcommand ('vcdb ' + vcshellDBarg() + ' gettopdir', globalAbortOnError)
+        cmdOutput, exitCode = runVCDBquery ('gettopdir', globalAbortOnError)
         if exitCode==0:
             topLevelMakeLocation=cmdOutput.strip('\n')
         else:
             topLevelMakeLocation=''
             
-        cmdOutput, exitCode = runVCcommand ('vcdb ' + vcshellDBarg() + ' gettopcmd', globalAbortOnError)
+        cmdOutput, exitCode = runVCDBquery ('gettopcmd', globalAbortOnError)
         if exitCode==0:
             topLevelMakeCommand = cmdOutput.strip('\n')
         else:
             topLevelMakeCommand=''
-        stdOut, exitCode = runVCcommand ('vcdb ' + vcshellDBarg() + ' getapps', globalAbortOnError)
+        stdOut, exitCode = runVCDBquery ('getapps', globalAbortOnError)
         if 'Apps Not found' in stdOut:
             applicationList = []
         else:
@@ -575,11 +1588,16 @@ def initialize (compilerCFG, filterFunction, vcdbFlagString, filesOfInterest):
         fatalError ('Cannot find file: vcshell.db (' + vcshellDBname + ' in directory: ' + vcshellDBlocation + ', please build project with vcshell before running this script\n')  
         
 
-    # Build the workarea directory structure
+    # Build the workarea directory structure, we do this before we read the files
+    # so that the file filters see the scripts that survive a partial work area
     projectMode = buildWorkarea()
         
+    # Stream the files from the DB into the lists for this run
+    buildFileLists (filterFunction, filesOfInterest)
+    addToSummaryStatus ('   ' + str(len (listOfFiles)) + ' files will be added for system testing ... ')
+    
     # Write the new list of files into the vcWorkArea
-    writeFileListToFile (listOfFiles)
+    writeFileListToFile (projectPaths.paths (listOfFiles))
     
     endMS = time.time()*1000.0
     addToSummaryStatus ('   complete (' + getTimeString (endMS-startMS) + ')')
@@ -588,6 +1606,46 @@ def initialize (compilerCFG, filterFunction, vcdbFlagString, filesOfInterest):
 
 
            
+def instrumentationDirectory (coverProjectName):
+    '''
+    The instrumented files go to vcast-inst, each shard project has its own directory
+    in it, because files in different shards can have the same name
+    '''
+    if coverProjectName == coverageProjectName:
+        return 'vcast-inst'
+    return os.path.join ('vcast-inst', coverProjectName)
+    
+    
+def createCoverageProject (coverProjectName, inplace):
+    '''
+    This function will create an empty cover project in the current directory
+    '''
+    stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'env', 'create', coverProjectName), True);
+    
+    # Create the instrumentation directory if we are not instrumenting in place.
+    if not inplace:
+        vcInstDir = instrumentationDirectory (coverProjectName)
+        if not os.path.isdir (vcInstDir):
+            try:
+                os.makedirs (vcInstDir)
+            except OSError:
+                # another shard created vcast-inst
+                if not os.path.isdir (vcInstDir):
+                    raise
+        stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'options', 'set_instrumentation_directory', vcInstDir, environment=coverProjectName), True);
+        stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'options', 'in_place', 'n', environment=coverProjectName), True);
+        
+        
+def addSourceFilesToCoverageProject (coverProjectName, fileListFile):
+    '''
+    This function will add the files listed in fileListFile to the cover project
+    This clicover command will look like:
+        cliccover add_source_vcdb vcshell.db vcast-latest-filelist.txt
+    '''
+    stdOut, exitCode = runVCcommand (clicoverCommand ('add_source_vcdb', coverProjectName, 
+                                     os.path.join (vcshellDBlocation, vcshellDBname), fileListFile), True);       
+        
+
 def buildCoverageProject (projectMode, inplace):
     '''
     This function will build a coverage project, and add all of the files from the vcdb
@@ -613,24 +1671,12 @@ def buildCoverageProject (projectMode, inplace):
             getCFGfile ()
                           
             addToSummaryStatus ('   creating the coverage project ...')
-            stdOut, exitCode = runVCcommand ('clicast cover env create ' + coverageProjectName, True);
-            
-            # Create the instrumentation directory if we are not instrumenting in place.
-            if not inplace:
-                vcInstDir = 'vcast-inst'
-                if not os.path.isdir (vcInstDir):
-                    os.mkdir (vcInstDir)
-                stdOut, exitCode = runVCcommand ('clicast -e ' + coverageProjectName + ' cover options set_instrumentation_directory ' + vcInstDir, True);
-                stdOut, exitCode = runVCcommand ('clicast -e ' + coverageProjectName + ' cover options in_place n', True);
+            createCoverageProject (coverageProjectName, inplace)
                
         if len (listOfFiles) > 0:
             filecountString = str (len (listOfFiles) )
             addToSummaryStatus ('   adding ' + filecountString +' source files  ...')
-            # This clicover command will look like:
-            # cliccover add_source_vcdb vcshell.db vcast-latest-filelist.txt
-            stdOut, exitCode = runVCcommand ('clicover add_source_vcdb ' + coverageProjectName + ' ' + \
-                 os.path.join (vcshellDBlocation, vcshellDBname) + ' ' + \
-                 os.path.join (originalWorkingDirectory, vcWorkArea, listOfFilenamesFile), True);       
+            addSourceFilesToCoverageProject (coverageProjectName, os.path.join (originalWorkingDirectory, vcWorkArea, listOfFilenamesFile))
                  
         globalCoverageProjectExists=True
         endMS = time.time()*1000.0
@@ -641,7 +1687,7 @@ def buildCoverageProject (projectMode, inplace):
         if globalAbortOnError:
             print "AC: raising error: " + str(e)
             raise e
-        elif str(err)=='FLEXlm error' or str(err)=='VectorCAST command failed':
+        elif str(err) in continuableCommandErrors:
             addToSummaryStatus ('   error creating cover project, continuing ...')
             globalCoverageProjectExists = False
         else:
@@ -649,6 +1695,140 @@ def buildCoverageProject (projectMode, inplace):
             raise
             
     
+def restoreCachedCoverageProject (cacheKey, coverageType):
+    '''
+    This function will restore the new cover project, with its lint results and 
+    instrumented files, from the instrumentation cache.  Returns True for a hit.
+    '''
+    global globalCoverageProjectExists
+    
+    sectionBreak('')
+    addToSummaryStatus ('Restoring Coverage Environment ...')
+    startMS = time.time()*1000.0
+    os.chdir (os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory ))
+    getCFGfile ()
+    if not restoreCoverageProject (coverageProjectName, cacheKey):
+        addToSummaryStatus ('   not in the instrumentation cache')
+        return False
+        
+    globalCoverageProjectExists = True
+    recordCoverageTypes (coverageProjectName, projectPaths.paths (listOfFiles), coverageType)
+    saveCoverageTypes ()
+    endMS = time.time()*1000.0
+    addToSummaryStatus ('   ' + str (len (listOfFiles)) + ' instrumented source files restored (' + getTimeString(endMS-startMS) + ')')
+    return True
+    
+    
+def lintCoverageProject (coverProjectName):
+    '''
+    Run the lint analysis for one cover project in the current directory
+    '''
+    stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'tools', 'lint_analyze', environment=coverProjectName), globalAbortOnError, timeLimit=0, idleLimit=0)
+    
+    
+# In the incremental lint mode each unit is analyzed on its own, and the results 
+# are kept per file in vc_lint/<cover project>/ with the hash of the source that was 
+# analyzed.  Only new or changed files are analyzed again, and the vcast_lint.xml of
+# the cover project is merged from the per file results.  Because a cover project 
+# has one vcast_lint.xml, the units are analyzed lintJobs at a time, each worker in 
+# its own scratch copy of the cover project.
+validLintModes = ['project', 'incremental']
+lintMode = 'project'
+lintJobs = 4
+vcLintDirectory = 'vc_lint'
+lintStateFile = 'lint-state.json'
+
+def lintSourceHash (fileName):
+    '''
+    Return the hash of the source that lint sees, for in place instrumentation
+    this is the original source in foo.c.vcast.bak
+    '''
+    if instrumentedInPlace (fileName):
+        return fileContentHash (fileName + '.vcast.bak')
+    return fileContentHash (fileName)
+    
+    
+def lintResultFile (resultsDirectory, fileName):
+    return os.path.join (resultsDirectory, hashlib.sha1 (fileName).hexdigest()[:12] + '-' + os.path.basename (fileName) + '.xml')
+    
+    
+def lintUnitsInScratchProject (lintTask):
+    '''
+    Analyze a list of units in a scratch copy of the cover project, this is called 
+    on a thread pool.  The results are moved to the results directory, and we return
+    the file names and source hashes of the units that have a result.
+    '''
+    coverDirectory, coverProjectName, resultsDirectory, filesToAnalyze = lintTask
+    analyzedFiles = []
+    with make_tempDirectory () as scratchDirectory:
+        shutil.copy (os.path.join (coverDirectory, coverProjectName + '.vcp'), scratchDirectory)
+        shutil.copytree (os.path.join (coverDirectory, coverProjectName), os.path.join (scratchDirectory, coverProjectName))
+        scratchLintFile = os.path.join (scratchDirectory, coverProjectName, 'vcast_lint.xml')
+        for fileName, sourceHash in filesToAnalyze:
+            if os.path.isfile (scratchLintFile):
+                os.remove (scratchLintFile)
+            command = clicastCommand ('cover', 'tools', 'lint_analyze', environment=coverProjectName, unit=os.path.basename (fileName))
+            timeLimit, idleLimit = commandLimits (command, None, None)
+            stdOut, exitCode, killedFor = runWithTimeLimit (command, timeLimit, cwd=scratchDirectory, idleLimit=idleLimit)
+            if killedFor:
+                recordCommandEvent ('   lint of ' + os.path.basename (fileName) + ' stopped at the ' + killedFor + ' limit')
+                if globalAbortOnError:
+                    raise Exception ('VectorCAST command timed out')
+                continue
+            checkCommandOutput (stdOut, exitCode, globalAbortOnError)
+            if exitCode == 0 and os.path.isfile (scratchLintFile):
+                shutil.move (scratchLintFile, lintResultFile (resultsDirectory, fileName))
+                analyzedFiles.append ((fileName, sourceHash))
+    return analyzedFiles
+    
+    
+def lintFilesIncrementally (coverProjectName, files):
+    '''
+    This function will run the lint analysis for the files of a cover project that
+    do not have current results, and then merge the results of all of the files into
+    the vcast_lint.xml of the project.  It runs in the cover directory, and returns 
+    the number of files that were analyzed with a result.
+    '''
+    resultsDirectory = os.path.join (originalWorkingDirectory, vcWorkArea, vcLintDirectory, coverProjectName)
+    if not os.path.isdir (resultsDirectory):
+        os.makedirs (resultsDirectory)
+    lintState = {}
+    if os.path.isfile (os.path.join (resultsDirectory, lintStateFile)):
+        with open (os.path.join (resultsDirectory, lintStateFile), 'r') as f:
+            lintState = json.load (f)
+            
+    projectLintFile = os.path.join (coverProjectName, 'vcast_lint.xml')
+    filesToAnalyze = []
+    for fileName in sorted (files):
+        if not os.path.isfile (fileName):
+            continue
+        sourceHash = lintSourceHash (fileName)
+        if lintState.get (fileName) == sourceHash and os.path.isfile (lintResultFile (resultsDirectory, fileName)):
+            continue
+        filesToAnalyze.append ((fileName, sourceHash))
+        
+    # The units are dealt out to the workers, each worker has one copy of the project
+    analyzedFiles = 0
+    if len (filesToAnalyze) > 0:
+        workers = max (1, min (lintJobs, len (filesToAnalyze)))
+        lintTasks = [(os.getcwd(), coverProjectName, resultsDirectory, filesToAnalyze[index::workers]) for index in range (workers)]
+        pool = ThreadPool (workers)
+        try:
+            results = mapOnPool (pool, lintUnitsInScratchProject, lintTasks)
+        finally:
+            pool.close()
+            pool.join()
+        for fileName, sourceHash in [result for workerResults in results for result in workerResults]:
+            lintState[fileName] = sourceHash
+            analyzedFiles += 1
+        
+    with open (os.path.join (resultsDirectory, lintStateFile), 'w') as f:
+        json.dump (lintState, f, indent=1, sort_keys=True)
+    mergeLintResults ([lintResultFile (resultsDirectory, fileName) for fileName in sorted (lintState) if fileName in files], projectLintFile)
+    return analyzedFiles
+    
+    
+    
 def runLintAnalysis ():
     '''
     This will do the Lint analysis
@@ -662,14 +1842,19 @@ def runLintAnalysis ():
     
     try:      
         os.chdir (os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory ))
-        stdOut, exitCode = runVCcommand ('clicast -e ' + coverageProjectName + ' cover tools lint_analyze', globalAbortOnError)
+        if lintMode == 'incremental':
+            projectFiles = set (filesInProject()) | set (projectPaths.paths (listOfFiles))
+            analyzedFiles = lintFilesIncrementally (coverageProjectName, projectFiles)
+            addToSummaryStatus ('   ' + str (analyzedFiles) + ' of ' + str (len (projectFiles)) + ' file(s) analyzed')
+        else:
+            lintCoverageProject (coverageProjectName)
         
         endMS = time.time()*1000.0
         addToSummaryStatus ('   complete (' + getTimeString(endMS-startMS) + ')')
         
     except Exception, err:
         # If we get a flex or command error, we continue
-        if str(err)=='FLEXlm error' or str(err)=='VectorCAST command failed':
+        if str(err) in continuableCommandErrors:
             addToSummaryStatus ('   error running lint analysis, continuing ...')
             globalCoverageProjectExists = False
         else:
@@ -677,6 +1862,124 @@ def runLintAnalysis ():
     
    
     
+# The coverage type map assigns a coverage type to the files below a path prefix, or
+# the files that match a glob pattern.  The first entry that matches is used, and the 
+# other files get the VCAST_COVERAGE_TYPE.  The type that each file was instrumented
+# with is saved per cover project, so that when the map changes, only the files whose
+# type changed are re-instrumented.
+coverageTypeMap = []
+coverageTypeFile = 'vcast-coverage-types.json'
+coverageTypeState = None
+coverageTypeLock = threading.Lock()
+
+def effectiveCoverageType (fileName, coverageType):
+    '''
+    Return the coverage type for fileName from the coverage type map
+    '''
+    fileName = normalizePath (fileName)
+    for pattern, mappedType in coverageTypeMap:
+        prefix = os.path.join (pattern.rstrip ('/\\'), '')
+        if fileName.startswith (prefix) or fnmatch.fnmatch (fileName, pattern):
+            return mappedType
+    return coverageType
+    
+    
+def loadCoverageTypes ():
+    '''
+    Return the dictionary of cover project to {file: coverage type} for the files
+    that were instrumented, this is read from the work area the first time
+    '''
+    global coverageTypeState
+    with coverageTypeLock:
+        if coverageTypeState is None:
+            coverageTypeState = {}
+            typesFile = os.path.join (originalWorkingDirectory, vcWorkArea, coverageTypeFile)
+            if os.path.isfile (typesFile):
+                with open (typesFile, 'r') as f:
+                    coverageTypeState = json.load (f)
+        return coverageTypeState
+        
+        
+def saveCoverageTypes ():
+    if coverageTypeState is not None:
+        with coverageTypeLock:
+            with open (os.path.join (originalWorkingDirectory, vcWorkArea, coverageTypeFile), 'w') as f:
+                json.dump (coverageTypeState, f, indent=1, sort_keys=True)
+                
+                
+def recordCoverageTypes (coverProjectName, files, coverageType):
+    '''
+    Record the coverage types that files were instrumented with in a cover project
+    '''
+    typesByProject = loadCoverageTypes()
+    with coverageTypeLock:
+        projectTypes = typesByProject.setdefault (coverProjectName, {})
+        for fileName in files:
+            projectTypes[fileName] = effectiveCoverageType (fileName, coverageType)
+            
+            
+def filesWithChangedCoverageType (coverProjectName, coverageType):
+    '''
+    Return the files in the cover project whose coverage type in the map is not 
+    the type that they were instrumented with
+    '''
+    projectTypes = loadCoverageTypes().get (coverProjectName, {})
+    return sorted ([fileName for fileName, instrumentedType in projectTypes.items() 
+                    if effectiveCoverageType (fileName, coverageType) != instrumentedType])
+    
+    
+def instrumentCoverageProject (coverProjectName, coverageType, listOfMainFiles, newFiles):
+    '''
+    This function will instrument the newFiles in one cover project, and the files 
+    whose coverage type changed, one batch for each coverage type.  Then it will 
+    re-instrument any files that have changed.  It runs in the cover directory
+    '''
+    # The instrumented files need functions that are defined in the
+    # VectorCAST coverage library file: c_cover_io.c.  The easiest way
+    # to get this code into an application is to #include the file 
+    # c_cover_io.c into each of the main files of an application.
+    # We now use a clicast command to do this.  
+    # Previously we used a py function: appendCoverIOfileToMainFiles
+    for file in listOfMainFiles:
+        stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'append_cover_io', 'true', environment=coverProjectName, unit=file), globalAbortOnError)
+    
+           
+    # Group the new files, and the files whose coverage type changed, by coverage type
+    changedFiles = filesWithChangedCoverageType (coverProjectName, coverageType)
+    filesByType = {}
+    for file in list (newFiles) + changedFiles:
+        filesByType.setdefault (effectiveCoverageType (file, coverageType), []).append (file)
+    if len (changedFiles) > 0:
+        addToSummaryStatus ('   ' + coverProjectName + ': ' + str (len (changedFiles)) + ' file(s) changed coverage type')
+        
+    # Files that the map sets to none are not instrumented, we cannot remove the 
+    # instrumentation of a file that was instrumented before
+    for file in filesByType.pop ('none', []):
+        if file in changedFiles:
+            addToSummaryStatus ('   ' + file + ' is still instrumented, disable coverage to remove it')
+            changedFiles.remove (file)
+            
+    # Call the instrumentor for any new files
+    listOfFilesString = ''
+    for file in newFiles:
+        fileNameOnly = os.path.basename(file)
+        listOfFilesString += fileNameOnly + ' '
+    
+    # We don't want to overwhelm the command line if we have 10k files for example
+    if len (listOfFilesString) > 1000 and len (coverageTypeMap) == 0:
+       stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'instrument', coverageType, environment=coverProjectName), globalAbortOnError, timeLimit=0, idleLimit=0)
+    else:
+        # Run instrumentation on the new files, in batches that keep the command line short
+        for batchType, files in sorted (filesByType.items()):
+            for command in commandBatches (clicoverCommand ('instrument_' + batchType.replace ('+', '_'), coverProjectName), 
+                                           [os.path.basename (file) for file in files]):
+                stdOut, exitCode = runVCcommand (command, globalAbortOnError, timeLimit=0, idleLimit=0)
+        # Run incremental re-instrument to pick up any source changes
+        stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'source', 'incremental_reinstrument', environment=coverProjectName), globalAbortOnError, timeLimit=0, idleLimit=0)
+        
+    recordCoverageTypes (coverProjectName, list (newFiles) + changedFiles, coverageType)
+        
+    
 def instrumentFiles (coverageType, listOfMainFiles):
     '''
     This function will instrument all of the files in the cover project
@@ -696,52 +1999,313 @@ def instrumentFiles (coverageType, listOfMainFiles):
         locationOfCoverageProject = os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory )
         os.chdir (locationOfCoverageProject)
         
-        # The instrumented files need functions that are defined in the
-        # VectorCAST coverage library file: c_cover_io.c.  The easiest way
-        # to get this code into an application is to #include the file 
-        # c_cover_io.c into each of the main files of an application.
-        # We now use a clicast command to do this.  
-        # Previously we used a py function: appendCoverIOfileToMainFiles
-        for file in listOfMainFiles:
-            stdOut, exitCode = runVCcommand ('clicast -e' + coverageProjectName + ' cover append_cover_io true -u' + file, globalAbortOnError)
-        
-               
-        # Call the instrumentor for any new files
-        listOfFilesString = ''
-        for file in listOfFiles:
-            fileNameOnly = os.path.basename(file)
-            listOfFilesString += fileNameOnly + ' '
-        
-        # We don't want to overwhelm the command line if we have 10k files for example
-        if len (listOfFilesString) > 1000:
-           stdOut, exitCode = runVCcommand ('clicast -e' + coverageProjectName + ' cover instrument ' + coverageType, globalAbortOnError)
-        else:
-            # Run instrumentation on the new files ...
-            stdOut, exitCode = runVCcommand ('clicover instrument_' + coverageType.replace ('+', '_') + ' ' + coverageProjectName + ' ' + listOfFilesString, globalAbortOnError)
-            # Run incremental re-instrument to pick up any source changes
-            stdOut, exitCode = runVCcommand ('clicast -e' + coverageProjectName + ' cover source incremental_reinstrument', globalAbortOnError)
-            
+        instrumentCoverageProject (coverageProjectName, coverageType, listOfMainFiles, projectPaths.paths (listOfFiles))
+        saveCoverageTypes ()
             
         endMS = time.time()*1000.0
         addToSummaryStatus ('   complete (' + getTimeString(endMS-startMS) + ')')
         
     except Exception, err:
         # If we get a flex error, we continue
-        if str(err)=='FLEXlm error' or str(err)=='VectorCAST command failed':
+        if str(err) in continuableCommandErrors:
             addToSummaryStatus ('   error instrumenting files, continuing ...')
             globalCoverageProjectExists = False
         else:
             raise   
 
 
-def envCoverArgString (coverageType):
+# Sharding splits the system test files into several cover projects, one per
+# application or per directory, which are built and instrumented in parallel
+# and are all added to the ST-Group of the manage project
+validShardModes = ['none', 'application', 'directory']
+coverageShardMode = 'none'
+coverageShardFile = 'vcast-coverage-shards.json'
+# Number of shards that are built at the same time
+coverageShardJobs = 4
+
+def coverageProjectForShard (shardName):
+    '''
+    The shard projects are named: <project>_<shard>_coverage
+    '''
+    return coverageProjectName[:-len('_coverage')] + '_' + shardName + '_coverage'
+    
+    
+def shardNameFromKey (key):
+    '''
+    Manage node names can only contain simple characters
+    '''
+    return re.sub ('[^A-Za-z0-9]+', '_', key).strip ('_') or 'root'
+    
+    
+def directoryShardKey (fileName, shardDepth):
+    '''
+    The directory shard is the first shardDepth directories of the file path, relative to
+    the directory where the top level make was run, when the file is below that directory
+    '''
+    directory = os.path.dirname (normalizePath (fileName))
+    topDirectory = normalizePath (topLevelMakeLocation)
+    if topDirectory and directory.startswith (os.path.join (topDirectory, '')):
+        directory = directory[len (os.path.join (topDirectory, '')):]
+    components = [part for part in re.split (r'[\\/]', directory) if part and part != '.' and not part.endswith (':')]
+    return '_'.join (components[:shardDepth])
+    
+    
+def applicationShardKeys ():
+    '''
+    This function will return a dictionary mapping each file in the vcshell.db to
+    the first application that uses it
+    '''
+    fileToApplication = {}
+    for app in applicationList:
+        if len (app.strip()) == 0:
+            continue
+        stdOut, exitCode = runVCDBquery ('--app=' + app + ' getappfiles', globalAbortOnError, force=True)
+        for appFile in stdOut.rstrip('\n').split('\n'):
+            fileToApplication.setdefault (normalizePath (appFile), os.path.splitext (os.path.basename (app))[0])
+    return fileToApplication
+    
+
+def loadCoverageShards ():
+    '''
+    The shard file in the workarea records which shard each file belongs to,
+    and the stamp of each file when its shard was last instrumented
+    '''
+    shardFile = os.path.join (originalWorkingDirectory, vcWorkArea, coverageShardFile)
+    if os.path.isfile (shardFile):
+        with open (shardFile, 'r') as f:
+            return json.load (f)
+    else:
+        return {'shards':{}}
+        
+
+def saveCoverageShards (shardState):
+    shardFile = os.path.join (originalWorkingDirectory, vcWorkArea, coverageShardFile)
+    with open (shardFile, 'w') as f:
+        json.dump (shardState, f, indent=1, sort_keys=True)
+
+
+def shardForFile (shardState, fileName):
+    '''
+    Return the name of the shard that contains fileName, or None
+    '''
+    for shardName, shard in shardState['shards'].items():
+        if fileName in shard['files']:
+            return shardName
+    return None
+    
+    
+def buildOneCoverageShard (shardTask):
+    '''
+    This function will create (if needed), add files to, lint and instrument the cover project
+    for one shard.  It is called on a thread pool, so it does not change the working 
+    directory, all of the shards are in the vc_coverage directory.
+    '''
+    coverProjectName = shardTask['project']
+    startMS = time.time()*1000.0
+    newProject = not os.path.isfile (coverProjectName + '.vcp')
+    try:
+        # A new shard can be restored from the instrumentation cache
+        cacheKey = None
+        if environmentCacheDirectory and not os.path.isfile (coverProjectName + '.vcp') and \
+           shardTask['coverageType'] != 'none' and len (shardTask['newFiles']) > 0:
+            cacheKey = instrumentationCacheKey (coverProjectName, shardTask['newFiles'], shardTask['coverageType'], 
+                                                shardTask['inplace'], shardTask['mainFiles'], shardTask['runLint'])
+        if cacheKey and restoreCoverageProject (coverProjectName, cacheKey):
+            recordCoverageTypes (coverProjectName, shardTask['newFiles'], shardTask['coverageType'])
+            shardTask['cache'] = 'hit'
+            endMS = time.time()*1000.0
+            addToSummaryStatus ('   shard ' + coverProjectName + ': ' + str (len (shardTask['newFiles'])) + ' new file(s) restored (' + getTimeString(endMS-startMS) + ')')
+            return True
+        elif cacheKey:
+            shardTask['cache'] = 'miss'
+            
+        if not os.path.isfile (coverProjectName + '.vcp'):
+            createCoverageProject (coverProjectName, shardTask['inplace'])
+            
+        if len (shardTask['newFiles']) > 0:
+            addSourceFilesToCoverageProject (coverProjectName, shardTask['fileListFile'])
+            
+        if shardTask['runLint'] and lintMode == 'incremental':
+            lintFilesIncrementally (coverProjectName, shardTask['files'])
+        elif shardTask['runLint']:
+            lintCoverageProject (coverProjectName)
+            
+        if shardTask['coverageType'] != 'none':
+            if len (shardTask['newFiles']) > 0 or len (filesWithChangedCoverageType (coverProjectName, shardTask['coverageType'])) > 0:
+                instrumentCoverageProject (coverProjectName, shardTask['coverageType'], shardTask['mainFiles'], shardTask['newFiles'])
+            else:
+                # Only edited files, so the incremental re-instrument is enough
+                stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'source', 'incremental_reinstrument', environment=coverProjectName), globalAbortOnError, timeLimit=0, idleLimit=0)
+                
+        if cacheKey and storeCoverageProject (coverProjectName, cacheKey, shardTask['newFiles'], shardTask['inplace']):
+            shardTask['cache'] = 'stored'
+            
+        endMS = time.time()*1000.0
+        addToSummaryStatus ('   shard ' + coverProjectName + ': ' + str (len (shardTask['newFiles'])) + ' new file(s) complete (' + getTimeString(endMS-startMS) + ')')
+        return True
+        
+    except Exception, err:
+        # If we get a flex or command error, we continue with the other shards
+        if str(err) in continuableCommandErrors:
+            addToSummaryStatus ('   error building shard ' + coverProjectName + ', continuing ...')
+            # The new files are added again on the next run, so a new project starts 
+            # again from nothing.  Sources instrumented in place are left alone.
+            if newProject and not shardTask['inplace']:
+                shutil.rmtree (coverProjectName, ignore_errors=True)
+                shutil.rmtree (instrumentationDirectory (coverProjectName), ignore_errors=True)
+                if os.path.isfile (coverProjectName + '.vcp'):
+                    os.remove (coverProjectName + '.vcp')
+            return False
+        else:
+            raise
+            
+    
+def buildShardedCoverageProjects (inplace, coverageType, listOfMainFiles, runLint, shardDepth):
+    '''
+    This function will split the new files into shards, and then build the cover project
+    for each shard that has new files or files that changed since the last run.  
+    The other shards are not touched.
+    '''
+    global globalCoverageProjectExists
+    
+    sectionBreak('')
+    addToSummaryStatus ('Building Coverage Environment Shards (by ' + coverageShardMode + ') ...')
+    startMS = time.time()*1000.0
+    os.chdir (os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory ))
+    getCFGfile ()
+    
+    shardState = loadCoverageShards()
+    if coverageShardMode == 'application':
+        fileToApplication = applicationShardKeys()
+        
+    # Assign the new files to shards
+    newFilesByShard = {}
+    for fileName in projectPaths.paths (listOfFiles):
+        shardName = shardForFile (shardState, fileName)
+        if not shardName:
+            if coverageShardMode == 'application':
+                shardName = shardNameFromKey (fileToApplication.get (normalizePath (fileName), 'other'))
+            else:
+                shardName = shardNameFromKey (directoryShardKey (fileName, shardDepth))
+        newFilesByShard.setdefault (shardName, []).append (fileName)
+        
+    # Find the existing shards that have edited source files, or files whose coverage type changed
+    changedShards = set()
+    for shardName, shard in shardState['shards'].items():
+        for fileName, stamp in shard['files'].items():
+            if fileStamp (fileName) != stamp:
+                changedShards.add (shardName)
+                break
+        if coverageType != 'none' and len (filesWithChangedCoverageType (shard['project'], coverageType)) > 0:
+            changedShards.add (shardName)
+                
+    shardTasks = []
+    for shardName in sorted (set (newFilesByShard) | changedShards):
+        newFiles = newFilesByShard.get (shardName, [])
+        fileListFile = os.path.join (originalWorkingDirectory, vcWorkArea, 'vcast-latest-filelist-' + shardName + '.txt')
+        with open (fileListFile, 'w') as f:
+            for fileName in newFiles:
+                f.write (fileName + '\n')
+        shardFiles = set (shardState['shards'].get (shardName, {}).get ('files', {}).keys()) | set (newFiles)
+        shardBaseNames = set ([os.path.basename (fileName) for fileName in shardFiles])
+        shardTasks.append ({'name':shardName, 'project':coverageProjectForShard (shardName), 'newFiles':newFiles, 'files':shardFiles,
+                            'fileListFile':fileListFile, 'inplace':inplace, 'coverageType':coverageType, 'runLint':runLint,
+                            'mainFiles':[mainFile for mainFile in listOfMainFiles if os.path.basename (mainFile) in shardBaseNames]})
+                            
+    addToSummaryStatus ('   ' + str (len (shardTasks)) + ' of ' + str (len (set (shardState['shards']) | set (newFilesByShard))) + ' shard(s) need work')
+    
+    if len (shardTasks) > 0:
+        pool = ThreadPool (max (1, min (coverageShardJobs, len (shardTasks))))
+        try:
+            results = mapOnPool (pool, buildOneCoverageShard, shardTasks)
+        finally:
+            pool.close()
+            pool.join()
+    
+        for shardTask in shardTasks:
+            if shardTask.get ('cache') == 'hit':
+                instrumentationCacheStatistics['hits'] += 1
+            elif shardTask.get ('cache') in ['miss', 'stored']:
+                instrumentationCacheStatistics['misses'] += 1
+                if shardTask['cache'] == 'stored':
+                    instrumentationCacheStatistics['stored'] += 1
+        reportInstrumentationCache ()
+        saveCoverageTypes ()
+                    
+        # Record the files and their stamps for the shards that were built
+        failedFiles = set()
+        for shardTask, result in zip (shardTasks, results):
+            if result:
+                shard = shardState['shards'].setdefault (shardTask['name'], {'project':shardTask['project'], 'files':{}})
+                for fileName in list (shard['files'].keys()) + shardTask['newFiles']:
+                    shard['files'][fileName] = fileStamp (fileName)
+            else:
+                failedFiles |= set (shardTask['newFiles'])
+        saveCoverageShards (shardState)
+        
+        # The new files of the failed shards are kept out of the project file list, 
+        # so that they are new again, and are retried, on the next run
+        if len (failedFiles) > 0:
+            writeFileListToFile ([fileName for fileName in projectPaths.paths (listOfFiles) if fileName not in failedFiles])
+            addToSummaryStatus ('   ' + str (len (failedFiles)) + ' new file(s) of the failed shard(s) will be retried on the next run')
+        
+    globalCoverageProjectExists = len (shardState['shards']) > 0
+    endMS = time.time()*1000.0
+    addToSummaryStatus ('   complete (' + getTimeString(endMS-startMS) + ')')
+
+
+def coverageShardProjects ():
+    '''
+    Return the names of the cover projects for all of the shards
+    '''
+    shardState = loadCoverageShards()
+    return sorted ([shard['project'] for shard in shardState['shards'].values()])
+    
+    
+def commandsToImportCoverageShards ():
+    '''
+    This function will return the manage commands needed to add any shard
+    cover projects that are not yet in the manage project to the ST-Group
+    '''
+    manageCommands = []
+    registry = getEnvironmentRegistry()
+    for shardProject in coverageShardProjects():
+        if not registry.get (shardProject, {}).get ('imported'):
+            manageCommands.append('--import ' + os.path.join ('..', vcCoverDirectory, shardProject + '.vcp'))
+            manageCommands.append('--group ST-Group --add ' + shardProject)
+            recordInProjectModel ('environments', shardProject)
+    return manageCommands
+    
+    
+def mergeLintResults (lintFiles, mergedFile):
+    '''
+    Lint results are xml files with one message element per finding below the 
+    document element, so we merge several results by appending the children
+    '''
+    import xml.etree.ElementTree as ElementTree
+    mergedTree = None
+    for lintFile in lintFiles:
+        try:
+            lintTree = ElementTree.parse (lintFile)
+        except (IOError, ElementTree.ParseError):
+            addToSummaryStatus ('   could not read lint results: ' + lintFile)
+            continue
+        if mergedTree is None:
+            mergedTree = lintTree
+        else:
+            mergedTree.getroot().extend (list (lintTree.getroot()))
+    if mergedTree is not None:
+        mergedTree.write (mergedFile)
+        
+    
+def envCoverArgs (coverageType):
     '''
     This function will return the correct flag for coverage to the EnvCreate.py call
     '''
     if coverageType=='none':
-        return ''
+        return []
     else:
-        return ' --coverage=' + coverageType
+        return ['--coverage=' + coverageType]
         
 
 def splitIncludeList (includeList):
@@ -769,38 +2333,22 @@ def pathArgs (includeList, excludeList):
     to EnvCreate.py.  The includeList contains tuples with the path as the
     first element, and LIB TYPE or SEARCH as the second.
     '''
-    argString = ' '
+    args = []
     includes, types, libs = splitIncludeList(includeList)
 
     if len (includes) > 0:
-        argString += '--includepath='
-        for dir in includes:
-            argString += dir + ','
-        # get rid of the "extra" ,
-        argString = argString[:-1] + ' '
+        args.append ('--includepath=' + ','.join (includes))
         
     if len (types) > 0:      
-        argString += '--type_handled_list='
-        for dir in types:
-            argString += dir + ','
-        # get rid of the "extra" ,
-        argString = argString[:-1] + ' '        
+        args.append ('--type_handled_list=' + ','.join (types))
         
     if len (libs) > 0:      
-        argString += '--library_list='
-        for dir in libs:
-            argString += dir + ','
-        # get rid of the "extra" ,
-        argString = argString[:-1] + ' '   
+        args.append ('--library_list=' + ','.join (libs))
         
     if len (excludeList) > 0:
-        argString += '--excludepath='
-        for I in excludeList:
-            argString += I + ','
-        # get rid of the "extra" ,
-        argString = argString[:-1] + ' '
+        args.append ('--excludepath=' + ','.join (excludeList))
         
-    return argString
+    return args
             
 typesToHandle={} 
 typesToHandle['LIB'] = '(L)'
@@ -812,17 +2360,18 @@ def setTypeCommandNeeded (path):
     to change the path type in vcshell.db.  
     The 'path' parameter is a tuple that looks like: (/home/path, path-type)
         where type can be: TYPE, LIB, SEARCH, NONE
-    The listOfPaths is a tuple that looks like: (/home/path, path-type)
+    The listOfPaths is a tuple that looks like: (handle of /home/path in projectPaths, path-type)
         where type can be: (T), (L), or (S)
     If the path is already in the database and the type matches
     no work is needed.
     '''
     global listOfPaths
     
+    pathHandle = projectPaths.find (normalizePath(path[0]))
     # for all the paths that are in the database
     for libPath in listOfPaths:
         # if the path we are processing is in the database
-        if libPath[0]==normalizePath(path[0]):
+        if libPath[0]==pathHandle:
             # If the new type is one we care about
             if path[1] in typesToHandle:
                 if typesToHandle[path[1]] == libPath[1]:
@@ -840,10 +2389,11 @@ def vcdbArgsOption (vcdbFlagString):
     '''
     '''
     if len (vcdbFlagString) == 0:
-        return ''
+        return []
     else:
+        # This is one argument, there is no shell to remove quotes
         defineFlag = readCFGoption ('C_DEFINE_FLAG') + '=1'
-        return ' --vcdbOpt=--flags="' + defineFlag + ',' + vcdbFlagString + '"'
+        return ['--vcdbOpt=--flags=' + defineFlag + ',' + vcdbFlagString]
         
         
 def inListOfPaths (path):
@@ -852,78 +2402,112 @@ def inListOfPaths (path):
     '''
     global listOfPaths
     
+    pathHandle = projectPaths.find (path)
     for listItem in listOfPaths:
-        if path == listItem[0]:
+        if pathHandle == listItem[0]:
             return True
             
     return False
 
  
             
+def envCreatePathLists (includePathOverRide):
+    '''
+    Use the include path over-ride parameter to ensure that the directory types 
+    are set properly in the db, and return the lists of paths to include 
+    and exclude that are passed on to EnvCreate.py
+    '''
+    excludeList = []
+    includeList = []
+    
+    for dir in includePathOverRide:
+    
+        # Any paths with the NONE qualifier should be omitted
+        pathType = dir[1].upper()
+        if pathType=='NONE':
+            # Only need to exlude if it is in the DB
+            currentPath = normalizePath (dir[0])
+            if inListOfPaths (currentPath):
+                excludeList.append(currentPath)
+            
+        # Only modify the directories that are in the database.
+        # Some of the directories in the includePathOverRide list might be "adds"
+        # in this case, this function call with return false
+        elif setTypeCommandNeeded(dir):
+            stdOut, exitCode = runVCcommand (vcdbCommand ('setpathtype', dir[0], dir[1].upper(), force=True), globalAbortOnError)
+
+        else:
+            # if we get here then this is a new directory so save it to the list along with the type
+            currentPath = normalizePath (dir[0])
+            # Use a tuple so that we maintain the path type
+            includeList.append((currentPath, pathType))
+            
+    return includeList, excludeList
+    
+    
+def envScriptName (fileName):
+    '''
+    fileName is the full path, so strip path, strip extension, and force upper case
+    '''
+    return 'ENV_' + os.path.basename(fileName).split('.')[0].upper() + '.env'
+    
+    
+def filesNeedingEnvScripts (excludedFiles=()):
+    '''
+    Prune the list of unit test files to remove any files whose .env file already exists
+    in the scripts directory, or that are in excludedFiles
+    '''
+    scriptsDirectory = os.path.join (originalWorkingDirectory, vcWorkArea, vcScriptsDirectory)
+    prunedList = []
+    for handle in listOfUnitTestFiles:
+        fileName = projectPaths.path (handle)
+        if fileName not in excludedFiles and not os.path.isfile (os.path.join (scriptsDirectory, projectPaths.envScriptName (handle))):
+            prunedList.append (fileName)
+            if len (prunedList) == maximumFilesToUnitTest:
+                break                   
+    return prunedList
+    
+    
+def envCreateArgs (coverageType, includeList, excludeList, dbArg, fileListName, vcdbFlagString, envFilesUseVcdb):
+    '''
+    This function will return the command line args for EnvCreate.py
+    '''
+    commandArgs =  [dbArg] + envCoverArgs(coverageType) 
+    commandArgs += pathArgs (includeList, excludeList)
+    commandArgs += ['--filelist=' + fileListName]
+    commandArgs += vcdbArgsOption(vcdbFlagString)
+    # This will constuct the .env files with the path to the vcshell, rather than the search paths and unit options
+    if envFilesUseVcdb:
+        commandArgs += ['--add_db_name']
+    return commandArgs
+    
+    
 def buildEnvScripts (coverageType, includePathOverRide, envFileEditor, vcdbFlagString, envFilesUseVcdb):
     '''
     This function will use the IDC EnvCreate.py script to build environment scripts for all files.
     '''
 
-    # This has all files not just the ones added to the cover project
-    global listOfAllFiles
-    # the listOfPaths is a tuple that looks like: (/home/path, path-type)
+    # This has the files that need scripts, not just the ones added to the cover project
+    global listOfUnitTestFiles
+    # the listOfPaths is a tuple that looks like: (handle of /home/path in projectPaths, path-type)
     global listOfPaths
     global maximumFilesToUnitTest
     
-    excludeList = []
-    includeList = []
-    
     sectionBreak('')
     addToSummaryStatus ('Building Environment Scripts ...')
     startMS = time.time()*1000.0
     
     try:
-        if len (listOfAllFiles) > 0:
+        if len (listOfUnitTestFiles) > 0:
         
             os.chdir (os.path.join (originalWorkingDirectory, vcWorkArea, vcScriptsDirectory ))
             
             # Get the compiler configuration file ...
             getCFGfile ()
             
-            # Use the include path over-ride parameter to 
-            # ensure that the directory types are set properly in the db
-            for dir in includePathOverRide:
-            
-                # Any paths with the NONE qualifier should be omitted
-                pathType = dir[1].upper()
-                if pathType=='NONE':
-                    # Only need to exlude if it is in the DB
-                    currentPath = normalizePath (dir[0])
-                    if inListOfPaths (currentPath):
-                        excludeList.append(currentPath)
-                    
-                # Only modify the directories that are in the database.
-                # Some of the directories in the includePathOverRide list might be "adds"
-                # in this case, this function call with return false
-                elif setTypeCommandNeeded(dir):
-                    fullCommand =  'vcdb ' + vcshellDBarg(force=True) + ' setpathtype ' + dir[0] + ' ' + dir[1].upper()
-                    stdOut, exitCode = runVCcommand (fullCommand, globalAbortOnError)
+            includeList, excludeList = envCreatePathLists (includePathOverRide)
 
-                else:
-                    # if we get here then this is a new directory so save it to the list along with the type
-                    currentPath = normalizePath (dir[0])
-                    # Use a tuple so that we maintain the path type
-                    includeList.append((currentPath, pathType))
-                    
-
-            # Prune the list of all files to remove any .env files that already exist
-            prunedList = []
-            count = 0
-            for fileName in listOfAllFiles:
-                # fileName is the full path, so strip path,
-                # strip extension, and force upper case
-                filePart = os.path.basename(fileName).split('.')[0].upper()
-                if not os.path.isfile ('ENV_' + filePart + '.env'):
-                    prunedList.append (fileName)
-                    count = count + 1
-                    if count == maximumFilesToUnitTest:
-                        break                   
+            prunedList = filesNeedingEnvScripts ()
                     
             if len (prunedList) > 0:
                 
@@ -937,34 +2521,32 @@ def buildEnvScripts (coverageType, includePathOverRide, envFileEditor, vcdbFlagS
                 addToSummaryStatus ('   building ' + str(len(prunedList)) + ' environment scripts ...') 
                 
                 # Call the EnvCreate.py script to build the env files.
-                commandArgs =  ' ' + vcshellDBarg(force=True) + ' ' + envCoverArgString(coverageType) 
-                commandArgs += pathArgs (includeList, excludeList)
-                commandArgs += ' --filelist=' + os.path.join (originalWorkingDirectory, vcWorkArea, tempFileName)
-                commandArgs += vcdbArgsOption(vcdbFlagString)
-                # This will constuct the .env files with the path to the vcshell, rather than the search paths and unit options
-                if envFilesUseVcdb:
-                    commandArgs += ' --add_db_name'
+                commandArgs = envCreateArgs (coverageType, includeList, excludeList, vcshellDBarg(force=True), 
+                                             os.path.join (originalWorkingDirectory, vcWorkArea, tempFileName), 
+                                             vcdbFlagString, envFilesUseVcdb)
                     
-                fullCommand =  'vpython '
-                fullCommand += pathToEnvCreateScript + commandArgs
-                stdOut, exitCode = runVCcommand (fullCommand, globalAbortOnError)
+                stdOut, exitCode = runPythonHelper (pathToEnvCreateScript, commandArgs, globalAbortOnError)
                 
                 # delete the temp-file
                 os.remove (tempFileName)
                 
+                # The cost model uses the source file of each script
+                for fileName in prunedList:
+                    if os.path.isfile (envScriptName (fileName)):
+                        registerEnvironment (os.path.abspath (envScriptName (fileName)), sourceFile=fileName)
+                saveEnvironmentRegistry()
+                
                 # Now for each environment script, call the user-supplied editor function
                 addToSummaryStatus ('   calling the user-supplied environment script editor ...')
-                for filePath in listOfAllFiles:
-                    fileName = os.path.basename(filePath)
-                    envFileName = 'ENV_' + fileName.split('.')[0].upper() + '.env'
-                    envFileEditor (envFileName)             
+                for filePath in prunedList:
+                    envFileEditor (envScriptName (filePath))             
     
         endMS = time.time()*1000.0
         addToSummaryStatus ('   complete (' + getTimeString(endMS-startMS) + ')')
     
     except Exception, err:
         # If we get a flex error, we continue
-        if str(err)=='FLEXlm error' or str(err)=='VectorCAST command failed':
+        if str(err) in continuableCommandErrors:
             addToSummaryStatus ('   error creating environment scripts, continuing ...')
         else:
             raise
@@ -972,24 +2554,233 @@ def buildEnvScripts (coverageType, includePathOverRide, envFileEditor, vcdbFlagS
 
 
 
-def runManageCommands(project, commands):
+def runManageCommands(project, commands, outputCallback=None, abortOnError=None):
     '''
     This function  takes a project name and a list of commands, builds a temp file
-    containing the commands, and then invokes manage 1 time.
+    containing the commands, and then invokes manage 1 time.  abortOnError defaults 
+    to globalAbortOnError
     '''
+    if abortOnError is None:
+        abortOnError = globalAbortOnError
+
     manageScriptName='script.msh'
 
     with open(manageScriptName, "w") as f:
         f.write("\n".join(commands))
         
     # We do not make any of the manage commands fatal ... the project create is done
-    # by using runVCcommand directly
-    stdOut, exitCode = runVCcommand('manage -p %s --script %s' % (project, manageScriptName), globalAbortOnError)  
+    # by using runManageCommand directly
+    stdOut, exitCode = runVCcommand(manageCommand (project, '--script', manageScriptName), abortOnError, outputCallback)  
     os.remove (manageScriptName) 
     
-    return stdOut 
+    # Keep the project model in step with the .vcm file that manage just updated
+    if exitCode == 0:
+        saveProjectModel (project)
+    else:
+        discardProjectModel (project)
+    
+    return stdOut, exitCode
 
 
+def runManageCommand (project, args, abortOnError=None):
+    '''
+    This function will invoke manage with a single command rather than a script,
+    and keep the project model in step with the .vcm file like runManageCommands.
+    If the model is not loaded, we re-stamp the saved one when it was current 
+    before the command.  abortOnError defaults to globalAbortOnError
+    '''
+    if abortOnError is None:
+        abortOnError = globalAbortOnError
+    savedModel = readSavedProjectModel (project)
+    savedModelIsCurrent = savedModel.get ('vcmTimestamp') and savedModel.get ('vcmTimestamp') == vcmTimestamp (project)
+    
+    stdOut, exitCode = runVCcommand (manageCommand (project, *args), abortOnError)
+    
+    if exitCode != 0:
+        discardProjectModel (project)
+    elif projectModel.get ('project') == project:
+        saveProjectModel (project)
+    elif savedModelIsCurrent:
+        savedModel['vcmTimestamp'] = vcmTimestamp (project)
+        with open (projectModelFileName (project), 'w') as f:
+            json.dump (savedModel, f, indent=2, sort_keys=True)
+    
+    return stdOut, exitCode
+    
+    
+class manageSession:
+    '''
+    This class gathers the manage commands for one project as named steps, and runs
+    all of the pending steps with a single manage --script call when flush is called.
+    Manage echoes each command as it runs it, we note the time when the first 
+    command of each step shows up, so that we can still report the time of each step.
+    '''
+    def __init__(self, project):
+        self.project = project
+        self.steps = []
+        self.stepResults = {}
+        # The seconds each command of the last flush took, when manage echoed it
+        self.commandDurations = {}
+        
+    def add (self, stepName, commands):
+        if len (commands) > 0:
+            self.steps.append ((stepName, list (commands)))
+            
+    def succeeded (self, stepName):
+        return self.stepResults.get (stepName) == 0
+        
+    def flush (self, abortOnError=None):
+        '''
+        Run the pending steps, and return the stdout and exit code of manage.
+        abortOnError is passed to runManageCommands
+        '''
+        if len (self.steps) == 0:
+            return '', 0
+        steps = self.steps
+        self.steps = []
+        
+        allCommands = []
+        firstCommands = []
+        for stepName, commands in steps:
+            firstCommands.append (len (allCommands))
+            allCommands += commands
+            
+        # The commands are echoed in order, so we only look for the next one
+        commandTimes = {}
+        nextCommand = [0]
+        def noteCommand (line):
+            if nextCommand[0] < len (allCommands) and allCommands[nextCommand[0]].strip() in line:
+                commandTimes[nextCommand[0]] = time.time()
+                nextCommand[0] += 1
+                
+        startTime = time.time()
+        stdOut, exitCode = runManageCommands (self.project, allCommands, noteCommand, abortOnError)
+        endTime = time.time()
+        
+        self.commandDurations = {}
+        for index in commandTimes:
+            self.commandDurations[allCommands[index]] = commandTimes.get (index + 1, endTime) - commandTimes[index]
+        
+        for index, (stepName, commands) in enumerate (steps):
+            self.stepResults[stepName] = exitCode
+            stepStart = commandTimes.get (firstCommands[index])
+            if index + 1 < len (steps):
+                stepEnd = commandTimes.get (firstCommands[index + 1])
+            else:
+                stepEnd = endTime
+            if stepStart and stepEnd:
+                addToSummaryStatus ('   ' + stepName + ': ' + str (len (commands)) + ' command(s) (' + getTimeString ((stepEnd-stepStart)*1000.0) + ')')
+            else:
+                addToSummaryStatus ('   ' + stepName + ': ' + str (len (commands)) + ' command(s)')
+        if 0 in commandTimes:
+            addToSummaryStatus ('   manage start up: ' + getTimeString ((commandTimes[0]-startTime)*1000.0))
+        addToSummaryStatus ('   ' + str (len (steps)) + ' step(s) in one manage call (' + getTimeString ((endTime-startTime)*1000.0) + ')')
+        return stdOut, exitCode
+        
+        
+# The project model is a small record of the nodes that the controller has created
+# in the manage project: compiler nodes, test suites, groups and environments.
+# It is stored beside the .vcm file and is only trusted if the .vcm has not changed
+# since we last wrote it, so that incremental runs do not need to ask manage.
+projectModelSuffix = '-automation-model.json'
+projectModel = {}
+
+def projectModelFileName (project):
+    return os.path.join (os.getcwd(), project + projectModelSuffix)
+
+
+def vcmTimestamp (project):
+    '''
+    This function will return the modification time and size of the .vcm file
+    or None if the project does not exist yet
+    '''
+    return fileStamp (os.path.join (os.getcwd(), project + '.vcm'))
+
+
+def emptyProjectModel (project, knownCompilerNodes=None):
+    '''
+    compilerNodes is None when we do not know what is in the project and 
+    need to ask manage.
+    '''
+    return {'project':project, 'vcmTimestamp':None, 'vcInstallDir':vcInstallDir, 'clicastVersion':'',
+            'compilerNodeNames':{}, 'compilerNodes':knownCompilerNodes, 'testSuites':[], 'groups':[], 'environments':[]}
+
+
+def readSavedProjectModel (project):
+    '''
+    Return the project model saved beside the .vcm, or {} if there is not a usable one
+    '''
+    modelFile = projectModelFileName (project)
+    if os.path.isfile (modelFile):
+        try:
+            with open (modelFile, 'r') as f:
+                return json.load (f)
+        except ValueError:
+            pass
+    return {}
+    
+    
+def loadProjectModel (project, projectMode):
+    '''
+    This function will read the project model for project from the current directory.
+    For a new project we start with an empty model, for an existing project we
+    discard the saved model if the .vcm was changed by someone else.
+    '''
+    global projectModel
+    global clicastVersion
+    
+    savedModel = readSavedProjectModel (project)
+    if projectMode == 'new':
+        projectModel = emptyProjectModel (project, knownCompilerNodes=[])
+    elif savedModel.get ('vcmTimestamp') and savedModel.get ('vcmTimestamp') == vcmTimestamp (project):
+        projectModel = savedModel
+    else:
+        if savedModel:
+            addToSummaryStatus ('   project was changed outside of the automation controller, re-reading the project structure')
+        projectModel = emptyProjectModel (project)
+    
+    # The clicast version does not depend on the project, only on the installation
+    if savedModel.get ('vcInstallDir') == vcInstallDir:
+        projectModel['clicastVersion'] = savedModel.get ('clicastVersion', '')
+        projectModel['compilerNodeNames'] = savedModel.get ('compilerNodeNames', {})
+    if not clicastVersion:
+        clicastVersion = projectModel['clicastVersion']
+    
+    
+def saveProjectModel (project):
+    '''
+    Write the project model back beside the .vcm, stamped with the current .vcm time
+    '''
+    if projectModel.get ('project') != project:
+        return
+    projectModel['vcmTimestamp'] = vcmTimestamp (project)
+    projectModel['clicastVersion'] = clicastVersion
+    with open (projectModelFileName (project), 'w') as f:
+        json.dump (projectModel, f, indent=2, sort_keys=True)
+
+
+def discardProjectModel (project):
+    '''
+    If a manage command fails, we no longer know what is in the project,
+    so we throw away the model and let the next run re-read the project.
+    '''
+    global projectModel
+    if projectModel.get ('project') == project:
+        projectModel = emptyProjectModel (project)
+    modelFile = projectModelFileName (project)
+    if os.path.isfile (modelFile):
+        os.remove (modelFile)
+    
+    
+def recordInProjectModel (category, name):
+    '''
+    Add name to one of the lists in the project model: 
+        compilerNodes, testSuites, groups, or environments
+    '''
+    if projectModel.get (category) is not None and name not in projectModel[category]:
+        projectModel[category].append (name)
+    
+
 def platformLevelString ():
     '''
     This will return the string that should be used for the Platform level
@@ -997,7 +2788,8 @@ def platformLevelString ():
     '''
     global clicastVersion
     if not clicastVersion:
-        clicastVersion, exitCode = runVCcommand('clicast --version', globalAbortOnError)
+        clicastVersion, exitCode = runVCcommand(clicastCommand ('--version'), globalAbortOnError, timeLimit=300)
+        projectModel['clicastVersion'] = clicastVersion
     if 'Version 6.' in clicastVersion:
         if platform.system()=='Windows':
             return '--level Source/Windows'
@@ -1017,11 +2809,19 @@ def platformLevelStringWithSlash ():
 def getListOfCompilerNodes ():
     '''
     This function will interrogate an existing manage project and return the list
-    of compiler nodes that are already defined.
+    of compiler nodes that are already defined.  If the project model is current
+    we use that rather than starting manage.
     '''
+    if projectModel.get ('project') == manageProjectName and projectModel.get ('compilerNodes') is not None:
+        return projectModel['compilerNodes']
+        
     command = ['--list-compilers']
-    stdOut = runManageCommands (manageProjectName, command)
-    return [i for i in stdOut.splitlines() if i and not i.startswith('Running')]
+    stdOut, exitCode = runManageCommands (manageProjectName, command)
+    compilerNodes = [i for i in stdOut.splitlines() if i and not i.startswith('Running')]
+    if projectModel.get ('project') == manageProjectName:
+        projectModel['compilerNodes'] = compilerNodes
+        saveProjectModel (manageProjectName)
+    return compilerNodes
 
 
 def computeCompilerNodeName ():
@@ -1034,7 +2834,13 @@ def computeCompilerNodeName ():
     global currentLanguage
     
     if os.path.isfile (C_CONFIG_FILE):
-        compilerNodeName = readCFGoption ('C_COMPILER_HIERARCHY_STRING').replace (' ', '_')
+        # The node name only depends on the contents of the CFG file, so the
+        # project model remembers it by the CFG hash
+        cfgHash = fileContentHash (C_CONFIG_FILE)
+        compilerNodeNames = projectModel.setdefault ('compilerNodeNames', {})
+        if cfgHash not in compilerNodeNames:
+            compilerNodeNames[cfgHash] = readCFGoption ('C_COMPILER_HIERARCHY_STRING').replace (' ', '_')
+        compilerNodeName = compilerNodeNames[cfgHash]
         currentLanguage = 'c'
         
     elif os.path.isfile (ADA_CONFIG_FILE):
@@ -1104,10 +2910,17 @@ def buildCompilerNode ():
         manageCommands.append('--group ' + unitTestGroupName() + ' --create')
         manageCommands.append(platformLevelStringWithSlash() + compilerNodeName + '/' + unitTestTestSuiteName() + ' --add ' + unitTestGroupName())
         
+        recordInProjectModel ('compilerNodes', compilerNodeName)
+        recordInProjectModel ('testSuites', unitTestTestSuiteName())
+        recordInProjectModel ('groups', unitTestGroupName())
+        
     return manageCommands
    
 
 
+# The compiler node and test suite that hold the system testing group
+systeTestCompilerNodeName = 'SystemTestingCompilerNode'
+
 def commandsToBuildProjectTree (coverageProjectName, coverageType, tcTimeOut):
     '''
     This function will create the basic structure of the manage project
@@ -1117,7 +2930,6 @@ def commandsToBuildProjectTree (coverageProjectName, coverageType, tcTimeOut):
     if platformLevelString():
         manageCommands.append(platformLevelString() + ' --create')
 
-    systeTestCompilerNodeName = 'SystemTestingCompilerNode'
     lanaguage='none'
     manageCommands.append(platformLevelString() + ' --config="VCDB_FILENAME=%s"' % (os.path.join (vcshellDBlocation, 'vcshell.db')))
     manageCommands.append(platformLevelString() + ' --coverage-type="%s"' % (coverageType))
@@ -1126,10 +2938,14 @@ def commandsToBuildProjectTree (coverageProjectName, coverageType, tcTimeOut):
     manageCommands.append(platformLevelStringWithSlash() + systeTestCompilerNodeName + '/SystemTesting --create')
     manageCommands.append('--group ST-Group --create')
     manageCommands.append(platformLevelStringWithSlash() + systeTestCompilerNodeName + '/SystemTesting --add ST-Group')
-    if globalCoverageProjectExists and len (coverageProjectName) > 0:
+    recordInProjectModel ('compilerNodes', systeTestCompilerNodeName)
+    recordInProjectModel ('testSuites', 'SystemTesting')
+    recordInProjectModel ('groups', 'ST-Group')
+    if globalCoverageProjectExists and len (coverageProjectName) > 0 and coverageShardMode == 'none':
         addToSummaryStatus ('   adding the coverage project for system testing')
         manageCommands.append('--import ' + os.path.join ('..', vcCoverDirectory, coverageProjectName + '.vcp'))
         manageCommands.append('--group ST-Group --add ' + coverageProjectName)
+        recordInProjectModel ('environments', coverageProjectName)
     
     # Make sure that we got a number for this option
     if type (tcTimeOut)==int:
@@ -1151,62 +2967,204 @@ def make_tempDirectory():
     shutil.rmtree(tempDirectory)
 
         
+# How the environment scripts are given to manage:
+#     auto: manage imports the script from where it is, unless the path contains white 
+#           space, which the manage command script cannot handle, then it is linked
+#     link: the script is staged in the temp directory as a hard link, or a symbolic 
+#           link, or if neither works, as a copy
+#     copy: the script is staged in the temp directory as a copy
+validStagingModes = ['auto', 'link', 'copy']
+envScriptStaging = 'auto'
+# The number of scripts that are copied at the same time
+stagingJobs = 8
+
 class scriptFiles:
     '''
     This class Is used to create to keeep track of the script files for one file
     '''
     def __init__(self, tempDirectory, envFile):
         self.baseFilename = os.path.splitext (os.path.basename (envFile))[0]
-        self.envFilename = os.path.join(tempDirectory, self.baseFilename + '.env')
         self.originalScriptFile = envFile
+        # The built environment (.vce) restored from the environment cache
+        self.cachedEnvironment = None
+        self.cacheKey = None
+        if envScriptStaging == 'auto' and not re.search (r'\s', envFile):
+            self.envFilename = envFile
+        else:
+            self.envFilename = os.path.join(tempDirectory, self.baseFilename + '.env')
 
-    def generate_files(self):
+    def generate_files(self, allowCopy=True):
+        '''
+        Stage the script, and return how it was done: direct, link, symlink or copy.
+        If allowCopy is False and the script cannot be linked we return pending.
+        '''
         if not os.path.isfile(self.originalScriptFile):
-            return
+            return None
+        elif self.envFilename == self.originalScriptFile:
+            return 'direct'
         
+        if envScriptStaging != 'copy':
+            for method, linkFunction in [('link', getattr (os, 'link', None)), ('symlink', getattr (os, 'symlink', None))]:
+                if linkFunction:
+                    try:
+                        linkFunction (os.path.abspath (self.originalScriptFile), self.envFilename)
+                        return method
+                    except OSError:
+                        pass
+                        
+        if not allowCopy:
+            return 'pending'
         shutil.copyfile(self.originalScriptFile, self.envFilename)
+        return 'copy'
+        
+        
+def stageScriptFiles (fileClassList):
+    '''
+    This function will stage the scripts in fileClassList for the manage import.
+    The links are made one at a time, because they are cheap, and the scripts 
+    that have to be copied are copied in parallel.
+    '''
+    methods = [fileClass.generate_files (allowCopy=False) for fileClass in fileClassList]
+    pendingFiles = [fileClass for fileClass, method in zip (fileClassList, methods) if method == 'pending']
+    if len (pendingFiles) > 0:
+        pool = ThreadPool (max (1, min (stagingJobs, len (pendingFiles))))
+        try:
+            mapOnPool (pool, lambda fileClass: fileClass.generate_files(), pendingFiles)
+        finally:
+            pool.close()
+            pool.join()
+            
+    counts = {}
+    for method in methods:
+        if method == 'pending':
+            method = 'copy'
+        counts[method] = counts.get (method, 0) + 1
+    if len (fileClassList) > 0:
+        addToSummaryStatus ('   ' + str (counts.get ('direct', 0)) + ' script(s) imported in place, ' + 
+                            str (counts.get ('link', 0) + counts.get ('symlink', 0)) + ' linked, ' + str (counts.get ('copy', 0)) + ' copied')
+        
+
+# The environment registry maps each environment name to a dictionary with:
+#     source:      the path to the .env script, or the .vce/.vcp file
+#     scriptStamp: the modification time and size of the .env script
+#     scriptHash:  the sha1 of the .env script
+#     imported:    True once the environment has been added to the manage project
+#     built:       True once the environment has been built
+environmentRegistry = {}
+environmentRegistryLocation = ''
+environmentRegistryStamp = None
+
+def environmentName (enviroPath):
+    '''
+    Manage uses the file name without the extension as the environment name
+    '''
+    return os.path.splitext (os.path.basename (enviroPath))[0]
+
+
+def getEnvironmentRegistry ():
+    '''
+    This function will return the registry for the current vcWorkArea, reading it
+    from disk the first time it is needed, or when someone else has changed the file.
+    If we find an old work-area that only has the listOfEnvironmentsInProject file, 
+    we convert that list.
+    '''
+    global environmentRegistry
+    global environmentRegistryLocation
+    global environmentRegistryStamp
+    
+    registryLocation = os.path.join (originalWorkingDirectory, vcWorkArea, environmentRegistryFile)
+    if registryLocation == environmentRegistryLocation and fileStamp (registryLocation) == environmentRegistryStamp:
+        return environmentRegistry
+        
+    environmentRegistry = {}
+    environmentRegistryLocation = registryLocation
+    environmentRegistryStamp = fileStamp (registryLocation)
+    oldEnvironmentList = os.path.join (originalWorkingDirectory, vcWorkArea, listOfEnvironmentsInProject)
+    if os.path.isfile (registryLocation):
+        with open (registryLocation, 'r') as f:
+            environmentRegistry = json.load (f)
+    elif os.path.isfile (oldEnvironmentList):
+        addToSummaryStatus ('   converting the existing environments file ... ')
+        with open (oldEnvironmentList, 'r') as f:
+            for line in f:
+                if line.strip():
+                    registerEnvironment (line.strip(), imported=True)
+    return environmentRegistry
+    
+
+def saveEnvironmentRegistry ():
+    '''
+    Write the registry back to the vcWorkArea, if there is one
+    '''
+    global environmentRegistryStamp
+    
+    registry = getEnvironmentRegistry()
+    if os.path.isdir (os.path.dirname (environmentRegistryLocation)):
+        with open (environmentRegistryLocation, 'w') as f:
+            json.dump (registry, f, indent=1, sort_keys=True)
+        environmentRegistryStamp = fileStamp (environmentRegistryLocation)
+
+
+def registerEnvironment (enviroPath, **state):
+    '''
+    This function will add or update the registry entry for one environment.
+    The keyword arguments are the state values to set, e.g. imported=True
+    '''
+    registry = getEnvironmentRegistry()
+    entry = registry.setdefault (environmentName (enviroPath), {'source':enviroPath, 'scriptStamp':None,
+                                                          'scriptHash':None, 'imported':False, 'built':False})
+    entry['source'] = enviroPath
+    entry.update (state)
+    return entry
+
+
+def environmentScriptState (envFile, entry):
+    '''
+    Return the stamp and hash of an .env file, we only re-hash the
+    script if the stamp is different from the one in the registry entry
+    '''
+    scriptStamp = fileStamp (envFile)
+    if entry and entry.get ('scriptStamp') == scriptStamp and entry.get ('scriptHash'):
+        return scriptStamp, entry['scriptHash']
+    else:
+        return scriptStamp, fileContentHash (envFile)
         
 
 def filterEnviroList(enviroList):
     '''
     Remove any environments form the environment list that are already in the Manage project
 
-    We check if the vcWorkArea exists and has a list of files already in the project.  
-    If it does, it will remove those files from the list that was passed in.
-    Initially, we were checking the full path to the vce ... but that was wrong
-    because manage does not allow two enivornments with the same name!  
-    So now, the firest thing we do is to strip the directory prefix from enviroList
+    We use the environment registry in the vcWorkArea to decide what is already in
+    the project, and remove those environments from the list that was passed in.
+    Manage does not allow two environments with the same name, so the registry is
+    indexed by the environment name, not the full path.  Duplicate names in the 
+    list that is passed in are removed as well.
     '''
         
     if os.path.isdir (os.path.join (originalWorkingDirectory, vcWorkArea)):
-        existingEnviroments = os.path.join (originalWorkingDirectory, vcWorkArea, listOfEnvironmentsInProject)
-        if os.path.isfile (existingEnviroments):
-            addToSummaryStatus ('   checking the existing environments file ... ')
-            oldFile = open (existingEnviroments, 'r')
-            lines = oldFile.readlines()
-            # Build a list of the enviro names currently in the project
-            bareEnviroNames = []
-            for line in lines:
-                bareEnviroNames.append (os.path.basename (line.strip()))
-            # If any of the new enviros have that same name, remove them
-            listCopy = enviroList[:]
-            for enviro in listCopy:
-                strippedName = os.path.basename(enviro)
-                if strippedName in bareEnviroNames:
-                    addToSummaryStatus ('   environment name: ' + strippedName + ' already exists in this project ...')
-                    enviroList.remove (enviro)
+        registry = getEnvironmentRegistry()
+        if len (registry) > 0:
+            addToSummaryStatus ('   checking the existing environments registry ... ')
+        namesSeen = set()
+        uniqueList = []
+        for enviro in enviroList:
+            strippedName = environmentName (enviro)
+            if strippedName in registry and registry[strippedName]['imported']:
+                addToSummaryStatus ('   environment name: ' + strippedName + ' already exists in this project ...')
+            elif strippedName not in namesSeen:
+                namesSeen.add (strippedName)
+                uniqueList.append (enviro)
+        # The callers expect the list to be filtered in place
+        enviroList[:] = uniqueList
 
                     
-                    
-def saveEnvironmentsInProject (enviroList):
+def saveEnvironmentsInProject (enviroList, built=False):
     '''
-    Append the new enviro list to the list of enviros in the project
+    Record that the environments in enviroList are now in the project
     '''
-    fullEnvironmentList = os.path.join (originalWorkingDirectory, vcWorkArea, listOfEnvironmentsInProject);
-    oldFile = open (fullEnvironmentList, 'a')
-    for file in enviroList:
-        oldFile.write (file + '\n')
-    oldFile.close() 
+    for enviro in enviroList:
+        registerEnvironment (enviro, imported=True, built=built)
+    saveEnvironmentRegistry()
     
         
 def createFileClassList (tempDirectory):
@@ -1217,24 +3175,38 @@ def createFileClassList (tempDirectory):
     The files get generated in a temporary directory
     '''
 
-    global listOfAllFiles
     global maximumUnitTestsToBuild
     
     # First we find the list of all .env files that exist in 
     pathToEnvFiles = os.path.join (originalWorkingDirectory, vcWorkArea, vcScriptsDirectory)
     envFileList = glob.glob (os.path.join (pathToEnvFiles, '*.env'))
+    
+    # Report any scripts that were edited after the environment was imported,
+    # manage does not allow us to re-import an environment with the same name
+    registry = getEnvironmentRegistry()
+    for envFile in envFileList:
+        entry = registry.get (environmentName (envFile))
+        if entry and entry['imported']:
+            scriptStamp, scriptHash = environmentScriptState (envFile, entry)
+            if entry.get ('scriptHash') and scriptHash != entry['scriptHash']:
+                addToSummaryStatus ('   environment script: ' + os.path.basename (envFile) + ' has changed since it was added to the project')
+            registerEnvironment (envFile, scriptStamp=scriptStamp, scriptHash=scriptHash)
+            
     filterEnviroList (envFileList)
-    saveEnvironmentsInProject (envFileList)
+    
+    # Choose the environments to build this time
+    envFileList = selectUnitTestBuilds (envFileList, maximumUnitTestsToBuild, unitTestBuildBudget)
         
+    # Only the environments that we are going to import go into the registry,
+    # the rest are picked up by a later run
     out = []
-    for enviroCount, envFile in enumerate (envFileList):
-        if enviroCount==maximumUnitTestsToBuild:
-            break
-        else:
-            out.append(scriptFiles(tempDirectory, os.path.join (pathToEnvFiles, envFile)))
+    for envFile in envFileList:
+        out.append(scriptFiles(tempDirectory, os.path.join (pathToEnvFiles, envFile)))
+        scriptStamp, scriptHash = environmentScriptState (envFile, registry.get (environmentName (envFile)))
+        registerEnvironment (envFile, scriptStamp=scriptStamp, scriptHash=scriptHash, imported=False, built=False)
+    saveEnvironmentRegistry()
 
-    for i in out:
-        i.generate_files()
+    stageScriptFiles (out)
 
     return out
 
@@ -1246,8 +3218,12 @@ def commandsToAddOneEnvironment (fileClass):
     
     levelArg = platformLevelStringWithSlash() + compilerNodeName + '/' + unitTestTestSuiteName() + '/' + fileClass.baseFilename
 
+    recordInProjectModel ('environments', fileClass.baseFilename)
+    registerEnvironment (fileClass.originalScriptFile, level=levelArg.replace ('--level ', '', 1))
+    
     out = []      
-    out.append ('--import ' + fileClass.envFilename)
+    # Environments restored from the environment cache are imported already built
+    out.append ('--import ' + (fileClass.cachedEnvironment or fileClass.envFilename))
     out.append ('--group ' + unitTestGroupName() + ' --add ' + fileClass.baseFilename)
     out.append ('--migrate ' + levelArg)
     return out
@@ -1261,9 +3237,6 @@ def commandsToBuildOneEnvironment (fileClass):
     
     out = []   
     out.append(levelArg + ' --build')
-    out.append(levelArg + ' --clicast-args tools auto_test temp.tst')
-    out.append(levelArg + ' --clicast-args test script run temp.tst')
-    out.append(levelArg + ' --apply-changes --force')
     return out
 
 
@@ -1271,7 +3244,7 @@ def commandsToExecuteOneEnvironment (fileClass):
     '''
     Not currently used.
     This function will return the commands needed to execute one environment in the manage project
-    We don't use this yet, because execute could hang on a test etc.
+    We don't use this, because execute could hang on a test etc, see executeEnvironments
     '''
     levelArg = platformLevelStringWithSlash() + compilerNodeName + '/' + unitTestTestSuiteName() + '/' + fileClass.baseFilename
     
@@ -1291,45 +3264,1321 @@ def commandsToAddAndBuildEnvironments (fileClassList):
     for enviroCount, fileClass in enumerate(fileClassList):
         addCommands += commandsToAddOneEnvironment (fileClass)
         # To make this quicker, we only build maximumUnitTestsToBuild environment
-        if enviroCount < maximumUnitTestsToBuild:
+        if enviroCount < maximumUnitTestsToBuild and not fileClass.cachedEnvironment:
              buildCommands += commandsToBuildOneEnvironment (fileClass)
 
     return addCommands, buildCommands
     
  
  
-def addEnvFilesToManageProject ():
+# The cost model estimates how many seconds it takes to build and test a unit test environment.
+# When an environment was built before, we use the time that the build took.  Otherwise 
+# we estimate it from the size of the source file, the number of #include lines in it 
+# and the number of stub commands in the script.  The estimates are scaled by the ratio
+# of the recorded times to the estimates of the environments that have a recorded time.
+baseBuildCost = 10.0
+costPerSourceKB = 0.05
+costPerInclude = 0.5
+costPerStub = 0.2
+# If this is not 0, only the environments whose estimated build times fit in this
+# many seconds are built during a run, the rest are picked up by later runs
+unitTestBuildBudget = 0
+# How the environments to build are chosen when there are more than maximumUnitTestsToBuild
+# or than fit in the budget:
+#     order:    the environments are taken in the order of the scripts, as before
+#     quickest: the environments with the smallest estimates are taken first
+validBuildSelections = ['order', 'quickest']
+unitTestBuildSelection = 'order'
+
+# The environment script name of each unit test file, indexed once for each file list
+unitTestSourceIndex = {'files':None, 'sources':{}}
+
+def sourceFileForEnvironment (envFile):
+    '''
+    Return the source file that the environment script was created for, 
+    from the registry, or from the file list if it was created before we recorded it
+    '''
+    entry = getEnvironmentRegistry().get (environmentName (envFile), {})
+    if entry.get ('sourceFile'):
+        return entry['sourceFile']
+    if unitTestSourceIndex['files'] is not listOfUnitTestFiles:
+        unitTestSourceIndex['files'] = listOfUnitTestFiles
+        unitTestSourceIndex['sources'] = dict ([(projectPaths.envScriptName (handle), projectPaths.path (handle)) for handle in reversed (listOfUnitTestFiles)])
+    return unitTestSourceIndex['sources'].get (os.path.basename (envFile))
+    
+    
+def environmentCostInputs (envFile):
+    '''
+    This function will return the values that the cost model uses for one environment
+    '''
+    inputs = {'sourceKB':0.0, 'includes':0, 'stubs':0, 'history':None}
+    inputs['history'] = getEnvironmentRegistry().get (environmentName (envFile), {}).get ('buildSeconds')
+    
+    sourceFile = sourceFileForEnvironment (envFile)
+    if sourceFile and os.path.isfile (sourceFile):
+        inputs['sourceKB'] = os.path.getsize (sourceFile) / 1024.0
+        with open (sourceFile, 'r') as f:
+            inputs['includes'] = len ([line for line in f if re.match (r'\s*#\s*include', line)])
+            
+    if os.path.isfile (envFile):
+        with open (envFile, 'r') as f:
+            inputs['stubs'] = len ([line for line in f if line.startswith ('ENVIRO.STUB')])
+    return inputs
+    
+
+def estimateBuildCosts (envFiles):
+    '''
+    This function will return a list of (envFile, estimated seconds, cost inputs) 
+    '''
+    estimates = []
+    recordedTotal = 0.0
+    estimatedTotal = 0.0
+    for envFile in envFiles:
+        inputs = environmentCostInputs (envFile)
+        estimate = baseBuildCost + costPerSourceKB * inputs['sourceKB'] + costPerInclude * inputs['includes'] + costPerStub * inputs['stubs']
+        if inputs['history']:
+            recordedTotal += inputs['history']
+            estimatedTotal += estimate
+        estimates.append ((envFile, estimate, inputs))
+        
+    # Calibrate the estimates against the builds that we have timed
+    if recordedTotal > 0 and estimatedTotal > 0:
+        scale = recordedTotal / estimatedTotal
+    else:
+        scale = 1.0
+    return [(envFile, inputs['history'] or estimate * scale, inputs) for envFile, estimate, inputs in estimates]
+    
+    
+def scheduleBuilds (costs, workers):
+    '''
+    This function will order the (envFile, cost) list longest processing time first,
+    and give each build to the worker with the least work.  It returns the order, 
+    the list of builds for each worker, and the estimated wall time.
+    '''
+    order = sorted (costs, key=lambda item: item[1], reverse=True)
+    workerLoads = [0.0] * max (1, workers)
+    workerBuilds = [[] for load in workerLoads]
+    for envFile, cost in order:
+        worker = workerLoads.index (min (workerLoads))
+        workerLoads[worker] += cost
+        workerBuilds[worker].append (envFile)
+    return [envFile for envFile, cost in order], workerBuilds, max (workerLoads)
+    
+
+def selectUnitTestBuilds (envFiles, maximumToBuild, budget=0):
+    '''
+    This function will choose the environments to build: all of the candidates are
+    estimated, and maximumToBuild of them are chosen, and if there is a budget, the
+    ones that fit in it.  unitTestBuildSelection decides which ones are taken first.
+    The builds run one after another in one manage call, so we keep the order
+    of the scripts, the order of the builds does not change the wall time.
+    '''
+    if len (envFiles) == 0 or maximumToBuild <= 0:
+        return []
+    costs = [(envFile, cost) for envFile, cost, inputs in estimateBuildCosts (envFiles)]
+    if unitTestBuildSelection == 'quickest':
+        candidates = sorted (costs, key=lambda item: item[1])
+    else:
+        candidates = costs
+    if len (candidates) > maximumToBuild:
+        if unitTestBuildSelection == 'quickest':
+            addToSummaryStatus ('   the ' + str (maximumToBuild) + ' quickest of ' + str (len (candidates)) + ' environment(s) will be built')
+        else:
+            addToSummaryStatus ('   the first ' + str (maximumToBuild) + ' of ' + str (len (candidates)) + ' environment(s) will be built')
+        candidates = candidates[:maximumToBuild]
+    
+    if budget > 0:
+        chosen = []
+        total = 0.0
+        for envFile, cost in candidates:
+            if total + cost > budget and len (chosen) > 0:
+                break
+            chosen.append ((envFile, cost))
+            total += cost
+        if len (chosen) < len (candidates):
+            addToSummaryStatus ('   ' + str (len (chosen)) + ' of ' + str (len (candidates)) + ' environment(s) fit in the build budget of ' + str (budget) + ' seconds')
+        candidates = chosen
+        
+    chosenFiles = set ([envFile for envFile, cost in candidates])
+    order = [envFile for envFile, cost in costs if envFile in chosenFiles]
+    totalTime = sum ([cost for envFile, cost in candidates])
+    addToSummaryStatus ('   estimated build time for ' + str (len (order)) + ' environment(s): ' + getTimeString (totalTime*1000.0) + 
+                        ', built one after another in one manage call')
+    return order
+    
+    
+def recordBuildTimes (fileClassList, commandDurations):
+    '''
+    Save the time that the build commands for each environment took, for the cost model
+    '''
+    for fileClass in fileClassList:
+        durations = [commandDurations.get (command) for command in commandsToBuildOneEnvironment (fileClass)]
+        if len (durations) > 0 and None not in durations:
+            registerEnvironment (fileClass.originalScriptFile, buildSeconds=sum (durations))
+            
+            
+def estimateUnitTestBuilds (projectName, workers, statusfile, verbose, vcast_workarea='vcast-workarea'):
+    '''
+    This function will report the estimated build time of all of the environment 
+    scripts in the work area, and the wall time with the given number of workers,
+    without building anything.  The estimates are also written to a json file
+    '''
+    global summaryStatusFileHandle
+    global verboseOutput
+    global vcWorkArea
+    
+    vcWorkArea = vcast_workarea
+    verboseOutput = verbose
+    summaryStatusFileHandle = open (statusfile, 'w', 1)
+    sectionBreak('')
+    addToSummaryStatus ('Estimating Unit Test Environment Build Times ...')
+    
+    envFiles = sorted (glob.glob (os.path.join (originalWorkingDirectory, vcWorkArea, vcScriptsDirectory, '*.env')))
+    estimates = estimateBuildCosts (envFiles)
+    order, workerBuilds, wallTime = scheduleBuilds ([(envFile, cost) for envFile, cost, inputs in estimates], workers)
+    
+    estimateTable = {}
+    for envFile, cost, inputs in estimates:
+        estimateTable[environmentName (envFile)] = dict (inputs, seconds=cost)
+    for envFile in order:
+        entry = estimateTable[environmentName (envFile)]
+        addToSummaryStatus ('   %-40s %8.1f s %s' % (environmentName (envFile), entry['seconds'], '(measured)' if entry['history'] else ''))
+    totalTime = sum ([entry['seconds'] for entry in estimateTable.values()])
+    addToSummaryStatus ('   total build time: ' + getTimeString (totalTime*1000.0) + ' for ' + str (len (envFiles)) + ' environment(s)')
+    addToSummaryStatus ('   estimated wall time with ' + str (workers) + ' worker(s): ' + getTimeString (wallTime*1000.0))
+    
+    estimateFile = os.path.join (originalWorkingDirectory, projectName + '-build-estimates.json')
+    with open (estimateFile, 'w') as f:
+        json.dump ({'environments':estimateTable, 'workers':workers, 'totalSeconds':totalTime, 'wallSeconds':wallTime,
+                    'schedule':[[environmentName (envFile) for envFile in builds] for builds in workerBuilds]}, f, indent=1, sort_keys=True)
+    addToSummaryStatus ('   estimates saved in: ' + estimateFile)
+    summaryStatusFileHandle.close()
+    
+    
+# The environment cache keeps built unit test environments outside of the work area,
+# so that a new work area (or another branch) with the same environment script, 
+# CFG file, VectorCAST version and sources can import the built environment rather
+# than building it again.  The instrumented cover projects are kept in the same cache.
+# The cache can be shared by the jobs on one machine:
+#     <cache>/entries/<key>/         one built environment: <ENV>.vce, <ENV>/ and entry.json, 
+#                                    or one instrumented cover project
+#     <cache>/tmp-*                  entries that are being stored
+#     <cache>/lock                   flock'd shared to restore, and exclusive to store or evict
+# New entries are copied into a tmp- directory and renamed into place, so a reader never
+# sees half of an entry.  The modification time of entry.json is the last use, and the 
+# least recently used entries are removed when the cache is bigger than the size limit.
+environmentCacheDirectory = ''
+environmentCacheSizeMB = 4096
+environmentCacheEntries = 'entries'
+environmentCacheEntryFile = 'entry.json'
+environmentCacheLockFile = 'lock'
+environmentCacheStatistics = {'hits':0, 'misses':0, 'stored':0, 'evicted':0}
+# tmp- directories older than this were left by a job that did not finish
+staleCacheSeconds = 3600
+
+@contextlib.contextmanager
+def environmentCacheLock (exclusive):
+    '''
+    Hold the environment cache lock while the with block runs.  Where we do not
+    have flock, a lock directory is used, and the shared lock is exclusive too
+    '''
+    lockFile = os.path.join (environmentCacheDirectory, environmentCacheLockFile)
+    if fcntl:
+        with open (lockFile, 'a') as f:
+            fcntl.flock (f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock (f.fileno(), fcntl.LOCK_UN)
+    else:
+        lockDirectory = lockFile + '.d'
+        while True:
+            try:
+                os.mkdir (lockDirectory)
+                break
+            except OSError:
+                # A lock that is held this long was left by a job that was killed
+                try:
+                    if time.time() - os.path.getmtime (lockDirectory) > staleCacheSeconds:
+                        os.rmdir (lockDirectory)
+                except OSError:
+                    pass
+                time.sleep (0.1)
+        try:
+            yield
+        finally:
+            os.rmdir (lockDirectory)
+            
+            
+def includedFileNames (fileName):
+    '''
+    Return the file names in the #include lines of fileName
+    '''
+    with open (fileName, 'r') as f:
+        return re.findall (r'^\s*#\s*include\s*[<"]([^>"]+)[>"]', f.read(), re.MULTILINE)
+        
+    
+def transitiveSources (sourceFile):
+    '''
+    This function will return the source file and all of the files that it includes, 
+    directly or indirectly, that can be found in the directory of the including file
+    or in the source paths from the vcshell.db.  System headers are not found this way,
+    they are covered by the VectorCAST version and the CFG file in the cache key.
+    '''
+    searchPaths = [projectPaths.path (handle) for handle, pathType in listOfPaths]
+    found = [sourceFile]
+    seen = set (found)
+    for fileName in found:
+        for includeName in includedFileNames (fileName):
+            for directory in [os.path.dirname (fileName)] + searchPaths:
+                candidate = os.path.normpath (os.path.join (directory, includeName))
+                if os.path.isfile (candidate):
+                    if candidate not in seen:
+                        seen.add (candidate)
+                        found.append (candidate)
+                    break
+    return sorted (found)
+    
+
+def environmentCacheKey (fileClass):
+    '''
+    This function will return the cache key of an environment: the sha1 of the environment
+    script, the CFG file, the VectorCAST version and the contents of the transitive sources.
+    If we do not know the source file of the environment we return None, and it is not cached.
+    '''
+    sourceFile = sourceFileForEnvironment (fileClass.originalScriptFile)
+    if not sourceFile or not os.path.isfile (sourceFile):
+        return None
+    digest = hashlib.sha1()
+    digest.update ('script:' + fileContentHash (fileClass.originalScriptFile) + '\n')
+    updateDigestWithToolchain (digest)
+    for fileName in transitiveSources (sourceFile):
+        digest.update ('source:' + fileName + ':' + fileContentHash (fileName) + '\n')
+    return digest.hexdigest()
+    
+    
+def cacheEntriesDirectory ():
+    '''
+    Return the directory of the cache entries, creating it if needed
+    '''
+    entriesDirectory = os.path.join (environmentCacheDirectory, environmentCacheEntries)
+    try:
+        os.makedirs (entriesDirectory)
+    except OSError:
+        # It exists, or another job created it
+        pass
+    return entriesDirectory
+    
+    
+def updateDigestWithToolchain (digest):
+    '''
+    Add the CFG file and the VectorCAST version to a cache key
+    '''
+    for cfgFileName in [C_CONFIG_FILE, ADA_CONFIG_FILE]:
+        if os.path.isfile (os.path.join (cfgFileLocation, cfgFileName)):
+            digest.update ('cfg:' + fileContentHash (os.path.join (cfgFileLocation, cfgFileName)) + '\n')
+    # platformLevelString reads the clicast version if we do not have it yet
+    platformLevelString()
+    digest.update ('version:' + clicastVersion.strip() + '\n')
+    
+    
+def restoreCacheEntry (key, restoreFunction):
+    '''
+    If the cache has an entry for key, call restoreFunction with the entry directory 
+    and the entry.json contents, and mark the entry as used.  Returns True for a hit.
+    '''
+    entryDirectory = os.path.join (cacheEntriesDirectory(), key)
+    with environmentCacheLock (exclusive=False):
+        if not os.path.isdir (entryDirectory):
+            return False
+        entryFile = os.path.join (entryDirectory, environmentCacheEntryFile)
+        try:
+            with open (entryFile, 'r') as f:
+                restoreFunction (entryDirectory, json.load (f))
+        except (IOError, OSError, ValueError), err:
+            addToSummaryStatus ('   could not restore an entry from the cache: ' + str (err))
+            return False
+        os.utime (entryFile, None)
+    return True
+    
+    
+def storeCacheEntry (key, description, populateFunction):
+    '''
+    This function will add an entry to the cache: populateFunction is called with a 
+    new directory to copy the files into, and description is saved in the entry.json.
+    If another job stored the same entry first, we keep that one.  Returns True if 
+    the entry was added.
+    '''
+    entriesDirectory = cacheEntriesDirectory()
+    newEntry = tempfile.mkdtemp (prefix='tmp-', dir=environmentCacheDirectory)
+    try:
+        populateFunction (newEntry)
+        entrySize = sum ([os.path.getsize (os.path.join (directory, fileName)) 
+                          for directory, subDirectories, files in os.walk (newEntry) for fileName in files])
+        with open (os.path.join (newEntry, environmentCacheEntryFile), 'w') as f:
+            json.dump (dict (description, size=entrySize, host=platform.node()), f, indent=1, sort_keys=True)
+        with environmentCacheLock (exclusive=True):
+            if not os.path.isdir (os.path.join (entriesDirectory, key)):
+                os.rename (newEntry, os.path.join (entriesDirectory, key))
+                return True
+    except (IOError, OSError), err:
+        addToSummaryStatus ('   could not add an entry to the cache: ' + str (err))
+    finally:
+        shutil.rmtree (newEntry, ignore_errors=True)
+    return False
+    
+    
+def restoreCachedEnvironments (fileClassList, tempDirectory):
+    '''
+    This function will copy the built environments that are in the environment cache
+    into tempDirectory, and point the fileClass at the .vce, so that the environment 
+    is imported rather than built
+    '''
+    if not environmentCacheDirectory or len (fileClassList) == 0:
+        return
+        
+    for fileClass in fileClassList:
+        fileClass.cacheKey = environmentCacheKey (fileClass)
+        if fileClass.cacheKey is None:
+            continue
+        restoreDirectory = os.path.join (tempDirectory, 'cache-' + fileClass.baseFilename)
+        if restoreCacheEntry (fileClass.cacheKey, lambda entryDirectory, entry: shutil.copytree (entryDirectory, restoreDirectory)):
+            fileClass.cachedEnvironment = os.path.join (restoreDirectory, fileClass.baseFilename + '.vce')
+            environmentCacheStatistics['hits'] += 1
+        else:
+            environmentCacheStatistics['misses'] += 1
+            
+    hits = environmentCacheStatistics['hits']
+    lookups = hits + environmentCacheStatistics['misses']
+    if lookups > 0:
+        addToSummaryStatus ('   environment cache: ' + str (hits) + ' of ' + str (lookups) + ' built environment(s) restored')
+        
+        
+def builtEnvironmentLocations ():
+    '''
+    This function will return a dictionary of environment name to the directory 
+    that holds the built environment (<ENV>.vce and <ENV>/) in the manage project
+    '''
+    locations = {}
+    for directory, subDirectories, files in os.walk (os.path.abspath (manageProjectName)):
+        for fileName in files:
+            enviroName, extension = os.path.splitext (fileName)
+            if extension.lower() == '.vce' and enviroName in subDirectories:
+                locations[enviroName] = directory
+        # We do not look inside of the environments
+        subDirectories[:] = [name for name in subDirectories if name + '.vce' not in files]
+    return locations
+    
+    
+def storeBuiltEnvironments (fileClassList):
+    '''
+    This function will add the environments that were built in the manage project to the
+    environment cache
+    '''
+    fileClassList = [fileClass for fileClass in fileClassList if fileClass.cacheKey]
+    if not environmentCacheDirectory or len (fileClassList) == 0:
+        return
+    locations = builtEnvironmentLocations ()
+    for fileClass in fileClassList:
+        if fileClass.baseFilename not in locations:
+            continue
+        builtDirectory = locations[fileClass.baseFilename]
+        def copyEnvironment (newEntry):
+            shutil.copy (os.path.join (builtDirectory, fileClass.baseFilename + '.vce'), newEntry)
+            shutil.copytree (os.path.join (builtDirectory, fileClass.baseFilename), os.path.join (newEntry, fileClass.baseFilename))
+        if storeCacheEntry (fileClass.cacheKey, {'environment':fileClass.baseFilename, 
+                            'source':sourceFileForEnvironment (fileClass.originalScriptFile)}, copyEnvironment):
+            environmentCacheStatistics['stored'] += 1
+            
+    evictEnvironmentCache ()
+    if environmentCacheStatistics['stored'] > 0 or environmentCacheStatistics['evicted'] > 0:
+        addToSummaryStatus ('   environment cache: ' + str (environmentCacheStatistics['stored']) + ' environment(s) stored, ' +
+                            str (environmentCacheStatistics['evicted']) + ' removed')
+        
+        
+def evictEnvironmentCache ():
+    '''
+    This function will remove the least recently used cache entries until 
+    the cache fits in environmentCacheSizeMB, and any stale tmp- directories
+    '''
+    entriesDirectory = os.path.join (environmentCacheDirectory, environmentCacheEntries)
+    with environmentCacheLock (exclusive=True):
+        for name in os.listdir (environmentCacheDirectory):
+            path = os.path.join (environmentCacheDirectory, name)
+            if name.startswith ('tmp-') and time.time() - os.path.getmtime (path) > staleCacheSeconds:
+                shutil.rmtree (path, ignore_errors=True)
+                
+        entries = []
+        for key in os.listdir (entriesDirectory):
+            entryFile = os.path.join (entriesDirectory, key, environmentCacheEntryFile)
+            try:
+                with open (entryFile, 'r') as f:
+                    entries.append ((os.path.getmtime (entryFile), json.load (f)['size'], key))
+            except (IOError, OSError, ValueError, KeyError):
+                # An entry without a readable entry.json cannot be used
+                entries.append ((0, 0, key))
+        
+        totalSize = sum ([size for lastUsed, size, key in entries])
+        for lastUsed, size, key in sorted (entries):
+            if totalSize <= environmentCacheSizeMB * 1024 * 1024 and lastUsed > 0:
+                break
+            shutil.rmtree (os.path.join (entriesDirectory, key), ignore_errors=True)
+            totalSize -= size
+            environmentCacheStatistics['evicted'] += 1
+            
+            
+# An instrumentation cache entry is one cover project (or one shard): the project
+# directory, the .vcp, and the instrumented files, from vcast-inst or, for in place
+# instrumentation, the instrumented sources with their .vcast.bak originals, so that
+# the instrumentation can still be removed.  An in place entry is only restored over
+# sources that are the same as the originals.  The cover project data for a single file
+# cannot be restored with the clicast commands, so the files of a project are cached 
+# together.  For parallel instrumentation, an entry is the vcutil destination directory,
+# vcutil instrumentation in place is not cached.
+instrumentationCacheStatistics = {'hits':0, 'misses':0, 'stored':0}
+
+def instrumentationCacheKey (coverProjectName, files, coverageType, inplace, mainFiles, runLint):
+    '''
+    This function will return the cache key for instrumenting files in a cover project: the 
+    sha1 of the project settings, the CFG file, the VectorCAST version and the contents of
+    the files.  If one of the files is missing we return None, and it is not cached.
+    '''
+    digest = hashlib.sha1()
+    digest.update ('coverage:' + coverProjectName + ':' + coverageType + ':' + str (bool (inplace)) + ':' + str (bool (runLint)) + '\n')
+    updateDigestWithToolchain (digest)
+    for mainFile in sorted (mainFiles):
+        digest.update ('main:' + mainFile + '\n')
+    for fileName in sorted (files):
+        if not os.path.isfile (fileName):
+            return None
+        digest.update ('source:' + fileName + ':' + effectiveCoverageType (fileName, coverageType) + ':' + fileContentHash (fileName) + '\n')
+    return digest.hexdigest()
+    
+    
+def copyTreeInto (sourceDirectory, destinationDirectory):
+    '''
+    Copy the files below sourceDirectory into destinationDirectory, which may exist
+    '''
+    for directory, subDirectories, files in os.walk (sourceDirectory):
+        targetDirectory = os.path.join (destinationDirectory, os.path.relpath (directory, sourceDirectory))
+        if not os.path.isdir (targetDirectory):
+            os.makedirs (targetDirectory)
+        for fileName in files:
+            shutil.copy2 (os.path.join (directory, fileName), targetDirectory)
+            
+            
+def instrumentedFilesOfProject (coverProjectName, files, inplace):
+    '''
+    Return the instrumented versions of files, relative to the cover directory: the 
+    sources themselves for in place instrumentation, or the files in vcast-inst
+    '''
+    if inplace:
+        return sorted (files)
+    baseNames = set ([os.path.basename (fileName) for fileName in files])
+    instrumented = []
+    for directory, subDirectories, fileNames in os.walk (instrumentationDirectory (coverProjectName)):
+        instrumented += [os.path.join (directory, fileName) for fileName in fileNames if fileName in baseNames]
+    return sorted (instrumented)
+    
+    
+def restoreCoverageProject (coverProjectName, cacheKey):
+    '''
+    This function will restore an instrumented cover project into the current directory
+    from the cache.  Returns True for a hit.
+    '''
+    def restoreProject (entryDirectory, entry):
+        originals = entry.get ('originals', {})
+        for fileName, originalHash in originals.items():
+            if os.path.exists (fileName + '.vcast.bak') or fileContentHash (fileName) != originalHash:
+                raise IOError ('the source is not the one that was cached: ' + fileName)
+        shutil.copytree (os.path.join (entryDirectory, coverProjectName), coverProjectName)
+        shutil.copy (os.path.join (entryDirectory, coverProjectName + '.vcp'), '.')
+        for index, fileName in enumerate (entry['instrumented']):
+            if os.path.dirname (fileName) and not os.path.isdir (os.path.dirname (fileName)):
+                os.makedirs (os.path.dirname (fileName))
+            # The original goes back first, so that an in place source is never lost
+            if fileName in originals:
+                shutil.copy (os.path.join (entryDirectory, 'originals', str (index)), fileName + '.vcast.bak')
+            shutil.copy (os.path.join (entryDirectory, 'instrumented', str (index)), fileName)
+            
+    if restoreCacheEntry (cacheKey, restoreProject):
+        return True
+    # Remove anything that a failed restore left behind
+    if os.path.isdir (coverProjectName):
+        shutil.rmtree (coverProjectName, ignore_errors=True)
+    if os.path.isfile (coverProjectName + '.vcp'):
+        os.remove (coverProjectName + '.vcp')
+    return False
+    
+    
+def storeCoverageProject (coverProjectName, cacheKey, files, inplace):
+    '''
+    This function will add the instrumented cover project in the current directory to the cache
+    '''
+    instrumented = instrumentedFilesOfProject (coverProjectName, files, inplace)
+    originals = {}
+    if inplace:
+        for fileName in instrumented:
+            if not os.path.isfile (fileName + '.vcast.bak'):
+                # Without the original the instrumentation could not be removed
+                return False
+            originals[fileName] = fileContentHash (fileName + '.vcast.bak')
+    def copyProject (newEntry):
+        shutil.copytree (coverProjectName, os.path.join (newEntry, coverProjectName))
+        shutil.copy (coverProjectName + '.vcp', newEntry)
+        os.mkdir (os.path.join (newEntry, 'instrumented'))
+        os.mkdir (os.path.join (newEntry, 'originals'))
+        for index, fileName in enumerate (instrumented):
+            shutil.copy (fileName, os.path.join (newEntry, 'instrumented', str (index)))
+            if fileName in originals:
+                shutil.copy (fileName + '.vcast.bak', os.path.join (newEntry, 'originals', str (index)))
+    return storeCacheEntry (cacheKey, {'coverProject':coverProjectName, 'instrumented':instrumented, 'originals':originals}, copyProject)
+    
+    
+def restoreInstrumentationDirectory (destinationDirectory, cacheKey):
+    '''
+    This function will restore the output of a parallel (vcutil) instrumentation
+    into destinationDirectory from the cache.  Returns True for a hit.
+    '''
+    return restoreCacheEntry (cacheKey, lambda entryDirectory, entry: 
+                              copyTreeInto (os.path.join (entryDirectory, 'destination'), destinationDirectory))
+    
+    
+def storeInstrumentationDirectory (destinationDirectory, cacheKey):
+    '''
+    This function will add the output of a parallel (vcutil) instrumentation to the cache
+    '''
+    return storeCacheEntry (cacheKey, {'destination':destinationDirectory}, 
+                            lambda newEntry: shutil.copytree (destinationDirectory, os.path.join (newEntry, 'destination')))
+    
+    
+def reportInstrumentationCache ():
+    '''
+    Add the instrumentation cache hit ratio to the summary status, and keep the cache in its size limit
+    '''
+    hits = instrumentationCacheStatistics['hits']
+    lookups = hits + instrumentationCacheStatistics['misses']
+    if lookups > 0:
+        addToSummaryStatus ('   instrumentation cache: ' + str (hits) + ' of ' + str (lookups) + ' cover project(s) restored (' + 
+                            str (int (round (100.0 * hits / lookups))) + '% hit ratio)')
+    if instrumentationCacheStatistics['stored'] > 0:
+        evictEnvironmentCache ()
+        addToSummaryStatus ('   instrumentation cache: ' + str (instrumentationCacheStatistics['stored']) + ' cover project(s) stored')
+        
+        
+# The basis path tests are generated after the environments are built, by running
+# clicast tools auto_test directly in the built environments of the manage project,
+# basisPathJobs at a time.  Each environment gets basisPathTimeLimit seconds, and is
+# killed if it runs over, so one unit cannot hold up the others.  The generated .tst 
+# files are kept in the work area by the environment hash (see environmentCacheKey), and
+# when there is an environment cache, each one is also a cache entry, so that it is shared
+# and evicted with the environments.  The tests are then run in one manage session.
+basisPathJobs = 4
+basisPathTimeLimit = 600
+vcTestsDirectory = 'vc_tests'
+basisPathTestFile = 'basis-path.tst'
+
+def basisPathTestDirectory ():
+    testDirectory = os.path.join (originalWorkingDirectory, vcWorkArea, vcTestsDirectory)
+    try:
+        os.makedirs (testDirectory)
+    except OSError:
+        # It exists, or another job created it
+        pass
+    return testDirectory
+    
+    
+def basisPathTestKey (fileClass):
+    '''
+    Return the hash of the environment that the tests are generated for, this is the
+    environment cache key, or if we do not know the sources, the script and the toolchain
+    '''
+    if not fileClass.cacheKey:
+        fileClass.cacheKey = environmentCacheKey (fileClass)
+    if fileClass.cacheKey:
+        return fileClass.cacheKey
+    digest = hashlib.sha1()
+    digest.update ('script:' + fileContentHash (fileClass.originalScriptFile) + '\n')
+    updateDigestWithToolchain (digest)
+    return digest.hexdigest()
+    
+    
+def basisPathCacheKey (testKey):
+    '''
+    Return the cache key of the basis path tests of an environment, it must not be
+    the same as the key of the built environment
+    '''
+    return hashlib.sha1 ('basis-path:' + testKey).hexdigest()
+    
+    
+def restoreBasisPathTests (testKey, testScript):
+    '''
+    Copy the basis path tests for testKey from the environment cache to testScript.
+    Returns True for a hit.
+    '''
+    def copyTests (entryDirectory, entry):
+        shutil.copy (os.path.join (entryDirectory, basisPathTestFile), testScript + '.tmp')
+        os.rename (testScript + '.tmp', testScript)
+    return restoreCacheEntry (basisPathCacheKey (testKey), copyTests)
+    
+    
+def storeBasisPathTests (fileClass, testKey, testScript):
+    '''
+    Add the generated basis path tests of an environment to the environment cache
+    '''
+    return storeCacheEntry (basisPathCacheKey (testKey), {'tests':fileClass.baseFilename}, 
+                            lambda newEntry: shutil.copy (testScript, os.path.join (newEntry, basisPathTestFile)))
+    
+    
+def generateOneTestScript (testTask):
+    '''
+    Run auto_test for one built environment, this is called on a thread pool.
+    The test script is written to a temporary name in the test directory, and 
+    renamed into place when it is complete.
+    '''
+    fileClass, builtDirectory, testScript = testTask
+    partialScript = testScript + '.' + str (os.getpid()) + '-' + str (threading.current_thread().ident) + '.tmp'
+    startTime = time.time()
+    stdOut, exitCode, killedFor = runWithTimeLimit (clicastCommand ('tools', 'auto_test', partialScript, environment=fileClass.baseFilename), 
+                                                    basisPathTimeLimit, cwd=builtDirectory)
+    if killedFor:
+        status = 'timeout'
+    elif exitCode == 0 and os.path.isfile (partialScript):
+        os.rename (partialScript, testScript)
+        status = 'generated'
+    else:
+        status = 'failed'
+        if 'FLEXlm Error:' in stdOut:
+            status = 'license'
+    if os.path.isfile (partialScript):
+        os.remove (partialScript)
+    return fileClass, status, time.time() - startTime
+    
+    
+def generateBasisPathTests (fileClassList, session):
+    '''
+    This function will generate (or take from the cache) the basis path tests for the
+    built environments in fileClassList, and run them in the manage project
+    '''
+    if len (fileClassList) == 0:
+        return
+    startMS = time.time()*1000.0
+    testDirectory = basisPathTestDirectory ()
+    locations = builtEnvironmentLocations ()
+    
+    testScripts = {}
+    testTasks = []
+    testKeys = {}
+    for fileClass in fileClassList:
+        testKey = basisPathTestKey (fileClass)
+        testKeys[fileClass.baseFilename] = testKey
+        testScript = os.path.join (testDirectory, testKey + '.tst')
+        if os.path.isfile (testScript) or (environmentCacheDirectory and restoreBasisPathTests (testKey, testScript)):
+            testScripts[fileClass.baseFilename] = testScript
+        elif fileClass.baseFilename in locations:
+            testTasks.append ((fileClass, locations[fileClass.baseFilename], testScript))
+    cachedScripts = len (testScripts)
+            
+    results = []
+    if len (testTasks) > 0:
+        pool = ThreadPool (max (1, min (basisPathJobs, len (testTasks))))
+        try:
+            results = mapOnPool (pool, generateOneTestScript, testTasks)
+        finally:
+            pool.close()
+            pool.join()
+            
+    statusCounts = {}
+    for (fileClass, builtDirectory, testScript), (fileClass, status, seconds) in zip (testTasks, results):
+        statusCounts[status] = statusCounts.get (status, 0) + 1
+        if status == 'generated':
+            testScripts[fileClass.baseFilename] = testScript
+            if environmentCacheDirectory:
+                storeBasisPathTests (fileClass, testKeys[fileClass.baseFilename], testScript)
+        elif status == 'timeout':
+            addToSummaryStatus ('   ' + fileClass.baseFilename + ': basis path test generation stopped after ' + getTimeString (seconds*1000.0))
+        else:
+            addToSummaryStatus ('   ' + fileClass.baseFilename + ': basis path test generation failed' + (' (license)' if status == 'license' else ''))
+    if environmentCacheDirectory and statusCounts.get ('generated', 0) > 0:
+        evictEnvironmentCache ()
+            
+    testCommands = []
+    for fileClass in fileClassList:
+        levelArg = platformLevelStringWithSlash() + compilerNodeName + '/' + unitTestTestSuiteName() + '/' + fileClass.baseFilename
+        if fileClass.baseFilename in testScripts:
+            testCommands.append (levelArg + ' --clicast-args test script run ' + testScripts[fileClass.baseFilename])
+        testCommands.append (levelArg + ' --apply-changes --force')
+    session.add ('basis path tests', testCommands)
+    stdOut, exitCode = session.flush ()
+    
+    endMS = time.time()*1000.0
+    addToSummaryStatus ('   basis path tests: ' + str (statusCounts.get ('generated', 0)) + ' generated, ' + str (cachedScripts) + ' from the cache, ' + 
+                        str (statusCounts.get ('timeout', 0)) + ' over the time limit (' + getTimeString(endMS-startMS) + ')')
+    
+    
+# The tests of the built environments are executed by running clicast execute batch 
+# directly in the built environments of the manage project, executionJobs at a time,
+# the environments that took longest last time are started first.  An environment 
+# is killed when it runs for more than executionTimeLimit seconds, or has no output
+# for longer than the TEST_TIMEOUT plus executionIdleMargin seconds, which is how a
+# hung test looks.  A TEST_TIMEOUT of 0 is no test timeout, a test can then be silent
+# for as long as it runs, so only executionTimeLimit applies.  The results of the environments that finished are applied to the
+# manage project in one manage session, and the status and time of each environment
+# are saved in the registry and in vcast-execution-results.json
+executeAfterBuild = False
+executionJobs = 4
+executionTimeLimit = 1800
+executionIdleMargin = 60
+testCaseTimeout = 0
+executionResultsFile = 'vcast-execution-results.json'
+
+def executeOneEnvironment (executionTask):
+    '''
+    Execute the tests of one built environment, this is called on a thread pool
+    '''
+    enviroName, builtDirectory = executionTask
+    startTime = time.time()
+    idleLimit = testCaseTimeout + executionIdleMargin if testCaseTimeout > 0 else 0
+    stdOut, exitCode, killedFor = runWithTimeLimit (clicastCommand ('execute', 'batch', environment=enviroName), executionTimeLimit, 
+                                                    cwd=builtDirectory, idleLimit=idleLimit)
+    if killedFor == 'idle':
+        status = 'hung'
+    elif killedFor:
+        status = 'timeout'
+    elif 'FLEXlm Error:' in stdOut:
+        status = 'license'
+    elif exitCode != 0 or re.search (r'\bFAIL(ED)?\b', stdOut):
+        status = 'failed'
+    else:
+        status = 'passed'
+    return enviroName, status, time.time() - startTime
+    
+    
+def executeEnvironments (enviroNames, session):
+    '''
+    This function will execute the tests of the built environments in enviroNames,
+    and apply the results of the ones that finished to the manage project.  It runs
+    in the manage directory.
+    '''
+    if len (enviroNames) == 0:
+        return
+    startMS = time.time()*1000.0
+    registry = getEnvironmentRegistry()
+    locations = builtEnvironmentLocations ()
+    for enviroName in enviroNames:
+        if enviroName not in locations:
+            addToSummaryStatus ('   ' + enviroName + ' is not built')
+    executionTasks = [(enviroName, locations[enviroName]) for enviroName in enviroNames if enviroName in locations]
+    executionTasks.sort (key=lambda task: registry.get (task[0], {}).get ('execution', {}).get ('seconds', 0), reverse=True)
+    addToSummaryStatus ('   executing ' + str (len (executionTasks)) + ' environment(s), ' + str (executionJobs) + ' at a time')
+    
+    results = []
+    if len (executionTasks) > 0:
+        pool = ThreadPool (max (1, min (executionJobs, len (executionTasks))))
+        try:
+            results = mapOnPool (pool, executeOneEnvironment, executionTasks)
+        finally:
+            pool.close()
+            pool.join()
+            
+    statusCounts = {}
+    resultCommands = []
+    for enviroName, status, seconds in results:
+        statusCounts[status] = statusCounts.get (status, 0) + 1
+        entry = registry.get (enviroName)
+        if entry:
+            entry['execution'] = {'status':status, 'seconds':seconds, 'time':time.time()}
+        if status in ['hung', 'timeout', 'license']:
+            addToSummaryStatus ('   ' + enviroName + ': ' + status + ' after ' + getTimeString (seconds*1000.0))
+        else:
+            if entry and entry.get ('level'):
+                resultCommands.append ('--level ' + entry['level'] + ' --apply-changes --force')
+            else:
+                resultCommands.append ('-e ' + enviroName + ' --apply-changes --force')
+    saveEnvironmentRegistry()
+    
+    with open (os.path.join (originalWorkingDirectory, vcWorkArea, executionResultsFile), 'w') as f:
+        json.dump (dict ([(enviroName, {'status':status, 'seconds':seconds}) for enviroName, status, seconds in results]), 
+                   f, indent=1, sort_keys=True)
+                   
+    session.add ('test results', resultCommands)
+    stdOut, exitCode = session.flush ()
+    
+    endMS = time.time()*1000.0
+    addToSummaryStatus ('   test execution: ' + ', '.join ([str (count) + ' ' + status for status, count in sorted (statusCounts.items())]) + 
+                        ' (' + getTimeString(endMS-startMS) + ')')
+    
+    
+def executeUnitTests (projectName, statusfile, verbose, vcast_workarea='vcast-workarea', tcTimeOut=0):
+    '''
+    This function will execute the tests of all of the built environments in the 
+    manage project, see executeEnvironments
+    '''
+    global summaryStatusFileHandle
+    global verboseOutput
+    global vcWorkArea
+    global manageProjectName
+    global testCaseTimeout
+    
+    vcWorkArea = vcast_workarea
+    verboseOutput = verbose
+    manageProjectName = projectName.replace (' ', '_') + '_project'
+    if type (tcTimeOut)==int:
+        testCaseTimeout = tcTimeOut
+    
+    summaryStatusFileHandle = open (statusfile, 'w', 1)
+    sectionBreak('')
+    addToSummaryStatus ('Executing Unit Tests ...')
+    
+    manageDirectory = os.path.join (originalWorkingDirectory, vcWorkArea, vcManageDirectory)
+    if not os.path.isfile (os.path.join (manageDirectory, manageProjectName + '.vcm')):
+        fatalError ('Cannot find the project: ' + manageProjectName + ', run build-db before executing the tests')
+    os.chdir (manageDirectory)
+    enviroNames = sorted ([name for name, entry in getEnvironmentRegistry().items() if entry.get ('built')])
+    executeEnvironments (enviroNames, manageSession (manageProjectName))
+    reportLicenseWaits ()
+    os.chdir (originalWorkingDirectory)
+    summaryStatusFileHandle.close()
+    
+    
+def addEnvFilesToManageProject (session=None):
     '''
     We will loop over all of the .env files and add those environments
-    to the Manage project
+    to the Manage project.  The add commands are run together with any 
+    commands that are pending in session.
     '''   
+    if session is None:
+        session = manageSession (manageProjectName)
         
     sectionBreak('')
     addToSummaryStatus ('Adding Unit Test Scripts to Manage Project ...')
-    startMS = time.time()*1000.0
     
     with make_tempDirectory () as tempDirectory:
         fileClassList = createFileClassList(tempDirectory)
+        restoreCachedEnvironments (fileClassList[:maximumUnitTestsToBuild], tempDirectory)
         
         # Get the commands needed to do the work
         addCommands, buildCommands = commandsToAddAndBuildEnvironments (fileClassList)        
         
-        # I do this in two pieces so that we can have times for each piece.
-        # Run the 'add' commands
+        # The builds are run as a second manage call, so that a failed build
+        # does not stop us from recording the environments that were added
         if len (addCommands) > 0:
-            stdOut = runManageCommands(manageProjectName, addCommands )
-            endMS = time.time()*1000.0
-            addToSummaryStatus ('   ' + str (len (addCommands)/3) + ' environment script(s) added (' + getTimeString(endMS-startMS) + ')')
+            addToSummaryStatus ('   adding ' + str (len (fileClassList)) + ' environment script(s)')
+        session.add ('environment scripts', addCommands)
+        stdOut, exitCode = session.flush ()
+        if len (addCommands) > 0 and session.succeeded ('environment scripts'):
+            for fileClass in fileClassList:
+                registerEnvironment (fileClass.originalScriptFile, imported=True, built=bool (fileClass.cachedEnvironment))
+            saveEnvironmentRegistry()
         
-        # Run the 'build' commands
+        environmentsToBuild = [fileClass for fileClass in fileClassList[:maximumUnitTestsToBuild] if not fileClass.cachedEnvironment]
         if len (buildCommands) > 0:
-            startMS = time.time()*1000.0
-            stdOut = runManageCommands(manageProjectName, buildCommands )
-            endMS = time.time()*1000.0
-            addToSummaryStatus ('   ' + str (len (buildCommands)/3) + ' environment node(s) built (' + getTimeString(endMS-startMS) + ')')
+            addToSummaryStatus ('   building ' + str (len (environmentsToBuild)) + ' environment node(s)')
+            session.add ('environment builds', buildCommands)
+            # One failed build fails the whole manage call, so we do not stop here,
+            # we look for each built environment and carry on with those
+            stdOut, exitCode = session.flush (abortOnError=False)
+            locations = builtEnvironmentLocations ()
+            builtEnvironments = [fileClass for fileClass in environmentsToBuild if fileClass.baseFilename in locations]
+            for fileClass in builtEnvironments:
+                registerEnvironment (fileClass.originalScriptFile, built=True)
+            if len (builtEnvironments) < len (environmentsToBuild):
+                addToSummaryStatus ('   ' + str (len (environmentsToBuild) - len (builtEnvironments)) + ' environment(s) did not build')
+            recordBuildTimes (environmentsToBuild, session.commandDurations)
+            saveEnvironmentRegistry()
+            
+            generateBasisPathTests (builtEnvironments, session)
+            storeBuiltEnvironments (builtEnvironments)
+                
+        if executeAfterBuild:
+            executeEnvironments ([fileClass.baseFilename for fileClass in fileClassList[:maximumUnitTestsToBuild]], session)
+
+
+            
+# Work bundles let the expensive unit test steps run on other machines: the
+# environment script generation, the environment builds and the basis path
+# test generation.  Each bundle is a self-contained directory with a file list,
+# the CFG file, a snapshot of the vcshell.db, the user configuration and a runner 
+# script that is started with: $VECTORCAST_DIR/vpython runBundle.py [--scratch dir]
+# The runner leaves the finished environments in the results directory of the 
+# bundle, with the path of the db that it used, and the merge step points them 
+# at the project's vcshell.db and imports them into the manage project.
+vcBundlesDirectory = 'vc_bundles'
+workBundleManifest = 'bundle.json'
+workBundleRunner = 'runBundle.py'
+workBundleResults = 'results'
+workBundleStatus = 'status.json'
+workBundlePrefix = 'bundle-'
+
+workBundleRunnerScript = """'''
+This script is generated by the VectorCAST Automation Controller, it builds 
+the environment scripts, environments and basis path tests for one work bundle
+    $VECTORCAST_DIR/vpython runBundle.py [--scratch directory]
+'''
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+bundleDirectory = os.path.dirname (os.path.abspath (__file__))
+vcInstallDir = os.environ['VECTORCAST_DIR']
+
+
+def runCommand (command):
+    '''
+    command is an argv list, the first element is the tool name in VECTORCAST_DIR
+    '''
+    command = [os.path.join (vcInstallDir, command[0])] + command[1:]
+    print '   running command: ' + ' '.join (command)
+    process = subprocess.Popen (command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        print output
+    return process.returncode == 0
+    
+    
+def main ():
+    with open (os.path.join (bundleDirectory, '%(manifest)s'), 'r') as f:
+        manifest = json.load (f)
+        
+    if '--scratch' in sys.argv:
+        workDirectory = sys.argv[sys.argv.index ('--scratch') + 1]
+        if not os.path.isdir (workDirectory):
+            os.makedirs (workDirectory)
+    else:
+        workDirectory = tempfile.mkdtemp (prefix='vcast-bundle-')
+    os.chdir (workDirectory)
+    for fileName in manifest['inputs']:
+        shutil.copy (os.path.join (bundleDirectory, fileName), fileName)
+    
+    # The environment scripts
+    envCreateArgs = [arg.replace ('%%(db)s', os.path.join (workDirectory, manifest['db'])) for arg in manifest['envCreateArgs']]
+    envCreateArgs = [arg.replace ('%%(filelist)s', os.path.join (workDirectory, manifest['fileList'])) for arg in envCreateArgs]
+    runCommand (['vpython', os.path.join (vcInstallDir, *manifest['envCreateScript'])] + envCreateArgs)
+    
+    # The user-supplied environment script editor from the project configuration
+    envFileEditor = None
+    if manifest.get ('configuration'):
+        try:
+            sys.path.insert (0, workDirectory)
+            envFileEditor = __import__ (os.path.splitext (manifest['configuration'])[0]).envFileEditor
+        except Exception, err:
+            print '   could not load the environment script editor: ' + str (err)
+    
+    status = {'bundle':os.path.basename (bundleDirectory), 'host':platform.node(), 'db':os.path.join (workDirectory, manifest['db']), 'environments':{}}
+    resultsDirectory = os.path.join (bundleDirectory, '%(results)s')
+    if os.path.isdir (resultsDirectory):
+        shutil.rmtree (resultsDirectory)
+    os.mkdir (resultsDirectory)
+    
+    for envFile in sorted (glob.glob ('ENV_*.env')):
+        enviroName = os.path.splitext (envFile)[0]
+        startTime = time.time()
+        if envFileEditor:
+            envFileEditor (envFile)
+        built = manifest['build'] and runCommand (['clicast', '-lc', 'environment', 'script', 'run', envFile])
+        tested = built and manifest['basisPaths'] and \\
+                 runCommand (['clicast', '-e', enviroName, 'tools', 'auto_test', enviroName + '.tst']) and \\
+                 runCommand (['clicast', '-e', enviroName, 'test', 'script', 'run', enviroName + '.tst'])
+        for output in [envFile, enviroName + '.tst', enviroName + '.vce', enviroName]:
+            if os.path.exists (output):
+                shutil.move (output, os.path.join (resultsDirectory, output))
+        status['environments'][enviroName] = {'built':bool (built), 'tested':bool (tested), 'seconds':time.time()-startTime}
+        
+    # The status file is written last, it tells the merge that the bundle is complete
+    with open (os.path.join (resultsDirectory, '%(status)s'), 'w') as f:
+        json.dump (status, f, indent=1, sort_keys=True)
+    os.chdir (bundleDirectory)
+    shutil.rmtree (workDirectory, ignore_errors=True)
+    
+    
+if __name__ == '__main__':
+    main()
+""" % {'manifest':workBundleManifest, 'results':workBundleResults, 'status':workBundleStatus}
 
 
+def workBundleDirectories ():
+    '''
+    Return the full paths of the work bundles in the workarea
+    '''
+    bundlesDirectory = os.path.join (originalWorkingDirectory, vcWorkArea, vcBundlesDirectory)
+    if not os.path.isdir (bundlesDirectory):
+        return []
+    return [os.path.join (bundlesDirectory, name) for name in sorted (os.listdir (bundlesDirectory)) if name.startswith (workBundlePrefix)]
+    
+    
+def filesInWorkBundles ():
+    '''
+    Return the set of the files that are in bundles that have not been merged yet
+    '''
+    bundleFiles = set()
+    for bundleDirectory in workBundleDirectories():
+        with open (os.path.join (bundleDirectory, workBundleManifest), 'r') as f:
+            bundleFiles.update (json.load (f)['files'])
+    return bundleFiles
+    
+    
+def exportWorkBundles (bundleCount, coverageType, includePathOverRide, envFileEditor, vcdbFlagString, envFilesUseVcdb):
+    '''
+    This function will split the files that need unit test environments into 
+    bundleCount work bundles rather than building the environment scripts here.
+    Files that are in bundles that have not been merged yet are not exported again.
+    '''
+    sectionBreak('')
+    addToSummaryStatus ('Exporting Unit Test Work Bundles ...')
+    startMS = time.time()*1000.0
+    
+    bundlesDirectory = os.path.join (originalWorkingDirectory, vcWorkArea, vcBundlesDirectory)
+    if not os.path.isdir (bundlesDirectory):
+        os.mkdir (bundlesDirectory)
+    os.chdir (os.path.join (originalWorkingDirectory, vcWorkArea, vcScriptsDirectory ))
+    getCFGfile ()
+    
+    includeList, excludeList = envCreatePathLists (includePathOverRide)
+    prunedList = filesNeedingEnvScripts (filesInWorkBundles())
+    bundleCount = max (1, min (bundleCount, len (prunedList)))
+    
+    # The user configuration is shipped so that the bundle can call the same envFileEditor
+    try:
+        configurationFile = inspect.getsourcefile (envFileEditor)
+    except TypeError:
+        configurationFile = None
+    
+    # The bundles get a snapshot of the vcshell.db, taken one time for this export,
+    # so that a build that writes to the vcshell.db while they wait does not change them.
+    # vcdb cannot write out the part of the db for some files, so the snapshot is the whole db.
+    dbSnapshot = os.path.join (bundlesDirectory, vcshellDBname + '.snapshot')
+    if len (prunedList) > 0:
+        shutil.copyfile (os.path.join (vcshellDBlocation, vcshellDBname), dbSnapshot)
+    
+    nextBundle = len (workBundleDirectories())
+    for bundleIndex in range (bundleCount if len (prunedList) > 0 else 0):
+        bundleFiles = prunedList[bundleIndex::bundleCount]
+        bundleDirectory = os.path.join (bundlesDirectory, workBundlePrefix + '%03d' % (nextBundle + bundleIndex))
+        while os.path.isdir (bundleDirectory):
+            bundleDirectory += '_'
+        os.mkdir (bundleDirectory)
+        
+        with open (os.path.join (bundleDirectory, 'filelist.txt'), 'w') as f:
+            for fileName in bundleFiles:
+                f.write (fileName + '\n')
+        inputs = ['filelist.txt', vcshellDBname]
+        linkOrCopyFile (dbSnapshot, os.path.join (bundleDirectory, vcshellDBname))
+        for cfgFile in [C_CONFIG_FILE, ADA_CONFIG_FILE]:
+            if os.path.isfile (cfgFile):
+                shutil.copy (cfgFile, bundleDirectory)
+                inputs.append (cfgFile)
+        if configurationFile and os.path.isfile (configurationFile):
+            shutil.copy (configurationFile, bundleDirectory)
+            inputs.append (os.path.basename (configurationFile))
+            
+        manifest = {'files':bundleFiles, 'fileList':'filelist.txt', 'db':vcshellDBname, 'inputs':inputs,
+                    'configuration':os.path.basename (configurationFile) if configurationFile else '',
+                    'envCreateScript':os.path.relpath (pathToEnvCreateScript, vcInstallDir).split (os.sep),
+                    'envCreateArgs':envCreateArgs (coverageType, includeList, excludeList, '--db=%(db)s', '%(filelist)s', vcdbFlagString, envFilesUseVcdb),
+                    'build':maximumUnitTestsToBuild > 0, 'basisPaths':maximumUnitTestsToBuild > 0}
+        with open (os.path.join (bundleDirectory, workBundleManifest), 'w') as f:
+            json.dump (manifest, f, indent=1, sort_keys=True)
+        with open (os.path.join (bundleDirectory, workBundleRunner), 'w') as f:
+            f.write (workBundleRunnerScript)
+        addToSummaryStatus ('   ' + os.path.basename (bundleDirectory) + ': ' + str (len (bundleFiles)) + ' file(s)')
+            
+    if os.path.isfile (dbSnapshot):
+        os.remove (dbSnapshot)
+    endMS = time.time()*1000.0
+    addToSummaryStatus ('   ' + str (len (prunedList)) + ' file(s) exported to: ' + bundlesDirectory + ' (' + getTimeString(endMS-startMS) + ')')
+    
+    
+def runOneWorkBundle (bundleDirectory):
+    '''
+    Run one bundle in its own scratch directory, just like a remote worker would
+    '''
+    scratchDirectory = tempfile.mkdtemp (prefix='vcast-bundle-')
+    try:
+        stdOut, exitCode = runVCcommand (vpythonCommand (os.path.join (bundleDirectory, workBundleRunner), '--scratch', scratchDirectory), False)
+    finally:
+        shutil.rmtree (scratchDirectory, ignore_errors=True)
+    return os.path.isfile (os.path.join (bundleDirectory, workBundleResults, workBundleStatus))
+    
+    
+def runWorkBundles (jobs, statusfile, verbose, vcast_workarea='vcast-workarea'):
+    '''
+    This function will run the bundles that do not have results yet
+    using jobs worker processes on this machine
+    '''
+    global summaryStatusFileHandle
+    global verboseOutput
+    global vcWorkArea
+    
+    vcWorkArea = vcast_workarea
+    verboseOutput = verbose
+    summaryStatusFileHandle = open (statusfile, 'w', 1)
+    sectionBreak('')
+    addToSummaryStatus ('Running Unit Test Work Bundles ...')
+    startMS = time.time()*1000.0
+    
+    pendingBundles = [bundleDirectory for bundleDirectory in workBundleDirectories() 
+                      if not os.path.isfile (os.path.join (bundleDirectory, workBundleResults, workBundleStatus))]
+    if len (pendingBundles) > 0:
+        pool = ThreadPool (max (1, min (jobs, len (pendingBundles))))
+        try:
+            results = mapOnPool (pool, runOneWorkBundle, pendingBundles)
+        finally:
+            pool.close()
+            pool.join()
+        for bundleDirectory, result in zip (pendingBundles, results):
+            addToSummaryStatus ('   ' + os.path.basename (bundleDirectory) + (' complete' if result else ' failed'))
+            
+    endMS = time.time()*1000.0
+    addToSummaryStatus ('   ' + str (len (pendingBundles)) + ' bundle(s) run (' + getTimeString(endMS-startMS) + ')')
+    summaryStatusFileHandle.close()
+    
+    
+def relocateBuiltEnvironment (resultsDirectory, enviroName, targetDirectory, oldPath, newPath):
+    '''
+    This function will copy an environment that was built by a worker (<ENV>.vce and 
+    <ENV>/) to targetDirectory, and replace oldPath with newPath in the text files of 
+    the copy, the binary files are left alone.  Returns the copied .vce file
+    '''
+    shutil.copy (os.path.join (resultsDirectory, enviroName + '.vce'), targetDirectory)
+    shutil.copytree (os.path.join (resultsDirectory, enviroName), os.path.join (targetDirectory, enviroName))
+    relocatedFiles = [os.path.join (targetDirectory, enviroName + '.vce')]
+    for directory, subDirectories, files in os.walk (os.path.join (targetDirectory, enviroName)):
+        relocatedFiles += [os.path.join (directory, fileName) for fileName in files]
+    for fileName in relocatedFiles:
+        with open (fileName, 'rb') as f:
+            content = f.read()
+        if oldPath in content and '\0' not in content:
+            with open (fileName, 'wb') as f:
+                f.write (content.replace (oldPath, newPath))
+    return relocatedFiles[0]
+    
+    
+def mergeWorkBundles (projectName, statusfile, verbose, vcast_workarea='vcast-workarea', vcshellLocation='', vcDbName='vcshell.db'):
+    '''
+    This function will add the results of the finished work bundles to the project:
+    the environment scripts are copied into the scripts directory, and the environments
+    that the worker built and tested are imported into the unit test node of the manage
+    project.  The worker used its own copy of the vcshell.db, so the scripts and the 
+    built environments are pointed at our vcshell.db first.  A bundle is removed once
+    its built environments are in the project, the others are left for a later merge.
+    '''
+    global summaryStatusFileHandle
+    global verboseOutput
+    global vcWorkArea
+    global manageProjectName
+    global coverageProjectName
+    
+    vcWorkArea = vcast_workarea
+    verboseOutput = verbose
+    projectName = projectName.replace (' ', '_')
+    manageProjectName = projectName + '_project'
+    coverageProjectName = projectName + '_coverage'
+    vcshellDB = os.path.join (vcshellLocation or originalWorkingDirectory, vcDbName)
+    
+    summaryStatusFileHandle = open (statusfile, 'w', 1)
+    sectionBreak('')
+    addToSummaryStatus ('Merging Unit Test Work Bundles ...')
+    startMS = time.time()*1000.0
+    
+    manageDirectory = os.path.join (originalWorkingDirectory, vcWorkArea, vcManageDirectory)
+    if not os.path.isfile (os.path.join (manageDirectory, manageProjectName + '.vcm')):
+        fatalError ('Cannot find the project: ' + manageProjectName + ', run build-db before merging work bundles')
+    os.chdir (manageDirectory)
+    getCFGfile ()
+    loadProjectModel (manageProjectName, 'update')
+    manageCommands = buildCompilerNode ()
+    
+    scriptsDirectory = os.path.join (originalWorkingDirectory, vcWorkArea, vcScriptsDirectory)
+    testDirectory = basisPathTestDirectory ()
+    registry = getEnvironmentRegistry()
+    mergedBundles = []
+    bundleEnvironments = {}
+    environmentsToImport = []
+    workerSeconds = {}
+    with make_tempDirectory () as tempDirectory:
+        for bundleDirectory in workBundleDirectories():
+            resultsDirectory = os.path.join (bundleDirectory, workBundleResults)
+            if not os.path.isfile (os.path.join (resultsDirectory, workBundleStatus)):
+                addToSummaryStatus ('   ' + os.path.basename (bundleDirectory) + ' is not finished')
+                continue
+            with open (os.path.join (resultsDirectory, workBundleStatus), 'r') as f:
+                status = json.load (f)
             
+            bundleEnvironments[bundleDirectory] = []
+            for enviroName, result in sorted (status['environments'].items()):
+                # The scripts point at the copy of the vcshell.db that the worker used
+                envFile = os.path.join (scriptsDirectory, enviroName + '.env')
+                with open (os.path.join (resultsDirectory, enviroName + '.env'), 'r') as f:
+                    scriptText = f.read().replace (status['db'], vcshellDB)
+                with open (envFile, 'w') as f:
+                    f.write (scriptText)
+                fileClass = scriptFiles (tempDirectory, envFile)
+                scriptStamp, scriptHash = environmentScriptState (envFile, None)
+                registerEnvironment (envFile, scriptStamp=scriptStamp, scriptHash=scriptHash)
+                    
+                # The worker's basis path tests are kept, so that they are not generated again
+                testScript = os.path.join (resultsDirectory, enviroName + '.tst')
+                if os.path.isfile (testScript):
+                    shutil.copy (testScript, os.path.join (testDirectory, basisPathTestKey (fileClass) + '.tst'))
+                    
+                if result['built'] and os.path.isfile (os.path.join (resultsDirectory, enviroName + '.vce')):
+                    # A bundle that was kept by an earlier merge can have environments that are imported already
+                    fileClass.imported = registry.get (enviroName, {}).get ('imported', False)
+                    if not fileClass.imported:
+                        relocateDirectory = os.path.join (tempDirectory, 'bundle-' + enviroName)
+                        os.mkdir (relocateDirectory)
+                        fileClass.cachedEnvironment = relocateBuiltEnvironment (resultsDirectory, enviroName, relocateDirectory, status['db'], vcshellDB)
+                    workerSeconds[enviroName] = result.get ('seconds')
+                    environmentsToImport.append (fileClass)
+                    bundleEnvironments[bundleDirectory].append (fileClass)
+                else:
+                    # The next build-db run adds and builds it like any other script
+                    registerEnvironment (envFile, imported=False, built=False)
+            mergedBundles.append (bundleDirectory)
+            addToSummaryStatus ('   ' + os.path.basename (bundleDirectory) + ' from ' + status['host'] + ': ' + 
+                                str (len (status['environments'])) + ' environment script(s), ' + 
+                                str (len (bundleEnvironments[bundleDirectory])) + ' built')
+                                
+        # The built environments are imported like the ones from the environment cache
+        session = manageSession (manageProjectName)
+        session.add ('compiler node', manageCommands)
+        addCommands = []
+        for fileClass in environmentsToImport:
+            if not fileClass.imported:
+                addCommands += commandsToAddOneEnvironment (fileClass)
+        session.add ('built environments', addCommands)
+        session.flush ()
+        
+        locations = builtEnvironmentLocations ()
+        importedEnvironments = [fileClass for fileClass in environmentsToImport if fileClass.baseFilename in locations]
+        for fileClass in importedEnvironments:
+            # The time that the worker took is kept for the cost model
+            registerEnvironment (fileClass.originalScriptFile, imported=True, built=True)
+            if workerSeconds.get (fileClass.baseFilename):
+                registerEnvironment (fileClass.originalScriptFile, buildSeconds=workerSeconds[fileClass.baseFilename])
+        saveEnvironmentRegistry()
+    
+    # A bundle can go once all of its built environments are in the project, 
+    # the others are kept, so that the next merge can try again
+    for bundleDirectory in mergedBundles:
+        if all ([fileClass in importedEnvironments for fileClass in bundleEnvironments[bundleDirectory]]):
+            shutil.rmtree (bundleDirectory)
+        else:
+            addToSummaryStatus ('   ' + os.path.basename (bundleDirectory) + ' is kept, not all of its built environments are in the project')
+    
+    endMS = time.time()*1000.0
+    addToSummaryStatus ('   ' + str (len (importedEnvironments)) + ' built environment(s) from ' + str (len (mergedBundles)) + 
+                        ' bundle(s) merged (' + getTimeString(endMS-startMS) + ')')
+    os.chdir (originalWorkingDirectory)
+    summaryStatusFileHandle.close()
+
+
 def convertOneLine (originalLine, flagText, newValue):
     '''
     Common code to simply replace the "end" of the line with the flagText with the new value
@@ -1434,30 +4683,51 @@ def buildEnterpriseProject (projectMode, coverageType, tcTimeOut):
     # Think about one that had Ada, and now we are adding C
     getCFGfile ()
     
+    # To make this fast, the manage commands for the project structure, the compiler 
+    # node, the coverage shards and the environment scripts are gathered in a session
+    # and manage.exe is called one time for all of them.
+    session = manageSession (manageProjectName)
+    
     if projectMode == 'new':
 
         # Create the empty manage project    
-        stdOut, exitCode = runVCcommand ('manage -p' + manageProjectName + ' --create ', True )
-        
-        addToSummaryStatus ('   building project structure nodes')
-        
-        # To make this fast, we write all of the manage commands to build the 
-        # basic project structure, into a command file and then call manage.exe 
-        # one time with this file.
-        commands = commandsToBuildProjectTree(coverageProjectName, coverageType, tcTimeOut)
-        stdOut = runManageCommands(manageProjectName, commands)
-        
-        # Auto-configure the system_test.py file
-        autoConfigureSystemTest ()
+        loadProjectModel (manageProjectName, projectMode)
+        stdOut, exitCode = runManageCommand (manageProjectName, ['--create'], True)
         
+    else:
+        # Read what we know about the existing project, so that we 
+        # do not have to ask manage for the compiler nodes etc.
+        loadProjectModel (manageProjectName, projectMode)
 
     # Determine the name of the compiler node, and if we need to build a new one ... 
+    # We do this before we add any commands, because it might have to ask manage
     nodeCommands =  buildCompilerNode ()
-    stdOut = runManageCommands(manageProjectName, nodeCommands)
+    
+    if projectMode == 'new':
+        addToSummaryStatus ('   building project structure nodes')
+        session.add ('project structure', commandsToBuildProjectTree(coverageProjectName, coverageType, tcTimeOut))
+    session.add ('compiler node', nodeCommands)
+    
+    # Add any new coverage shards to the system testing group
+    shardCommands = commandsToImportCoverageShards ()
+    if len (shardCommands) > 0:
+        addToSummaryStatus ('   adding ' + str (len (shardCommands)/2) + ' coverage shard(s) for system testing')
+    session.add ('coverage shards', shardCommands)
         
     # Now spin though all of the Env files and add those nodes to the manage project
     if maximumUnitTestsToBuild>0:
-        addEnvFilesToManageProject ()
+        addEnvFilesToManageProject (session)
+    else:
+        session.flush ()
+        
+    if len (shardCommands) > 0 and session.succeeded ('coverage shards'):
+        for shardProject in coverageShardProjects():
+            registerEnvironment (os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory, shardProject + '.vcp'), imported=True, built=True)
+        saveEnvironmentRegistry()
+        
+    # Auto-configure the system_test.py file, once the project structure is there
+    if projectMode == 'new':
+        autoConfigureSystemTest ()
     
     endMS = time.time()*1000.0
     addToSummaryStatus ('   complete (' + getTimeString(endMS-startMS) + ')')
@@ -1506,6 +4776,21 @@ def findCoverProject():
     return coverProjectName
     
 
+def findCoverProjects():
+    '''
+    This helper function will return the names (without .vcp) of all of the cover 
+    projects in the workarea, there is more than one when the project is sharded.
+    It does not change the working directory.
+    '''
+    coverDirectory = os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory )
+    coverProjectNames = []
+    if os.path.isdir (coverDirectory):
+        for file in sorted (os.listdir (coverDirectory)):
+            if file.endswith ('_coverage.vcp'):
+                coverProjectNames.append (file[:-len('.vcp')])
+    return coverProjectNames
+    
+    
 def startManageGUI():
     '''
     This function will simply start VC for the manage project
@@ -1513,9 +4798,9 @@ def startManageGUI():
     manageProjectName = findManageProject()
     if manageProjectName!=manageProjectNotFound:
         print ('Opening VC Project ...')
-        commandToRun = os.path.join (vcInstallDir,'vcastqt') + ' -e ' + manageProjectName
-        print '   ' + commandToRun
-        subprocess.call (commandToRun, shell=True)
+        commandToRun = toolCommand (['vcastqt', '-e', manageProjectName])
+        print '   ' + commandString (commandToRun)
+        subprocess.call (commandToRun)
         # Change back to original dir
         os.chdir (originalWorkingDirectory)
     
@@ -1544,48 +4829,466 @@ def startAnalytics(vcshellLocation):
     print ('   pointing your broswer at URL: http://localhost:8128/')
     
     print ('Starting VC/Analytics Server ...')
-    commandToRun = os.path.join (vcInstallDir,'vcdash ') + projectArgument
-    print '   ' + commandToRun
+    commandToRun = toolCommand (['vcdash', projectArgument])
+    print '   ' + commandString (commandToRun)
     try:
         # user needs to hit ctrl-c to exit vcdash, so handle exception
-        subprocess.call (commandToRun, shell=True)
+        subprocess.call (commandToRun)
     except:
         pass
     # Change back to original dir
     os.chdir (originalWorkingDirectory)
         
 
-def enableCoverage():
+def coverageFilesForPaths (paths):
+    '''
+    This function will return a dictionary of cover project name to the files in that
+    project that are named by paths.  Each path can be a file, or a directory for all of
+    the files below it.  Relative paths are from the original working directory.
+    '''
+    projectFiles = filesInProject()
+    shardState = loadCoverageShards()
+    coverProjectNames = findCoverProjects()
+    filesByProject = {}
+    for path in paths:
+        path = normalizePath (os.path.abspath (os.path.join (originalWorkingDirectory, path)))
+        prefix = os.path.join (path, '')
+        matches = [fileName for fileName in projectFiles if normalizePath (fileName) == path or normalizePath (fileName).startswith (prefix)]
+        if len (matches) == 0:
+            print '   ' + path + ' is not in the cover project'
+        for fileName in matches:
+            if len (shardState['shards']) > 0:
+                shardName = shardForFile (shardState, fileName)
+                coverProjectName = shardName and shardState['shards'][shardName]['project']
+            else:
+                coverProjectName = coverProjectNames and coverProjectNames[0]
+            if coverProjectName:
+                filesByProject.setdefault (coverProjectName, set()).add (fileName)
+    return filesByProject
+    
+    
+def instrumentedInPlace (fileName):
     '''
-    Enable coverage for the Coverage Project
+    Files that are instrumented in place have the original source in foo.c.vcast.bak
     '''
+    return os.path.isfile (fileName + '.vcast.bak')
+    
+    
+# The in place files whose coverage is disabled are kept in the work area, because
+# a disabled source that was edited is no longer the same as its foo.c.vcast.bak, 
+# and cannot be told from an instrumented one
+disabledFilesFile = 'vcast-disabled-files.json'
 
+def loadDisabledFiles ():
+    disabledFile = os.path.join (originalWorkingDirectory, vcWorkArea, disabledFilesFile)
+    if os.path.isfile (disabledFile):
+        with open (disabledFile, 'r') as f:
+            return set (json.load (f))
+    return set()
+    
+    
+def saveDisabledFiles (disabledFiles):
+    with open (os.path.join (originalWorkingDirectory, vcWorkArea, disabledFilesFile), 'w') as f:
+        json.dump (sorted (disabledFiles), f, indent=1)
+        
+        
+def coverageDisabled (fileName, disabledFiles):
+    '''
+    Return True if the in place file has its original source, a file that is
+    the same as its foo.c.vcast.bak was disabled before we kept the list
+    '''
+    return fileName in disabledFiles or fileContentHash (fileName) == fileContentHash (fileName + '.vcast.bak')
+    
+    
+def disableCoverageForFiles (paths):
+    '''
+    This function will disable coverage for the files named by paths, by putting 
+    back the original source that the in place instrumentation saved.  The other
+    files in the cover project are not touched.
+    '''
+    startMS = time.time()*1000.0
+    disabledFiles = 0
+    alreadyDisabled = loadDisabledFiles()
+    for coverProjectName, files in sorted (coverageFilesForPaths (paths).items()):
+        for fileName in sorted (files):
+            if not instrumentedInPlace (fileName):
+                print '   ' + fileName + ' is not instrumented in place'
+            elif not coverageDisabled (fileName, alreadyDisabled):
+                shutil.copyfile (fileName + '.vcast.bak', fileName)
+                alreadyDisabled.add (fileName)
+                disabledFiles += 1
+    saveDisabledFiles (alreadyDisabled)
+    endMS = time.time()*1000.0
+    print '   coverage disabled for ' + str (disabledFiles) + ' file(s) (' + getTimeString(endMS-startMS) + ')'
+    
+    
+def enableCoverageForFiles (paths, coverageType):
+    '''
+    This function will enable coverage for the files named by paths, by instrumenting
+    only those files again, with the coverage type that they were instrumented with 
+    before (or coverageType).  The other files in the cover project are not touched,
+    and we do not run an incremental_reinstrument over the project.  Like the enable 
+    of the whole project, the current source of an in place file is copied onto its 
+    foo.c.vcast.bak first, so that the edits made while coverage was disabled are 
+    the ones that are instrumented.
+    '''
+    global coverageTypeState
+    
+    startMS = time.time()*1000.0
+    coverageTypeState = None
+    instrumentedTypes = loadCoverageTypes()
+    disabledFiles = loadDisabledFiles()
+    enabledFiles = 0
+    os.chdir (os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory ))
+    for coverProjectName, files in sorted (coverageFilesForPaths (paths).items()):
+        # Only the files whose coverage is disabled
+        filesByType = {}
+        for fileName in sorted (files):
+            if instrumentedInPlace (fileName):
+                if not coverageDisabled (fileName, disabledFiles):
+                    continue
+                shutil.copyfile (fileName, fileName + '.vcast.bak')
+            fileType = instrumentedTypes.get (coverProjectName, {}).get (fileName, coverageType)
+            if fileType != 'none':
+                filesByType.setdefault (fileType, []).append (fileName)
+                
+        for fileType, typeFiles in sorted (filesByType.items()):
+            for command in commandBatches (clicoverCommand ('instrument_' + fileType.replace ('+', '_'), coverProjectName), 
+                                           [os.path.basename (fileName) for fileName in typeFiles]):
+                stdOut, exitCode = runVCcommand (command, globalAbortOnError, timeLimit=0, idleLimit=0)
+            enabledFiles += len (typeFiles)
+            disabledFiles -= set (typeFiles)
+    saveDisabledFiles (disabledFiles)
+    os.chdir (originalWorkingDirectory)
+    endMS = time.time()*1000.0
+    print '   coverage enabled for ' + str (enabledFiles) + ' file(s) (' + getTimeString(endMS-startMS) + ')'
+    
+    
+def enableCoverage(files=None, coverageType='statement'):
+    '''
+    Enable coverage for the Coverage Project, or only for the files 
+    and directories in files
+    '''
+    if files:
+        enableCoverageForFiles (files, coverageType)
+        return
+        
     manageProjectName = findManageProject()
     if manageProjectName!=manageProjectNotFound:
-        coverProjectName = manageProjectName.split ('_')[0] + '_coverage'
-        stdOut, exitCode = runVCcommand ('manage -p' + manageProjectName + ' -e ' + coverProjectName + ' --enable-instrument-in-place', globalAbortOnError)
+        coverProjectNames = findCoverProjects()
+        for coverProjectName in coverProjectNames:
+            stdOut, exitCode = runManageCommand (os.path.splitext (manageProjectName)[0], ['-e', coverProjectName, '--enable-instrument-in-place'])
 
         # We have to do a reinstrument action to pick up the changes, because the enable simply
         # copies the new foo.c file onto the foo.c.vcast.bak, and relies on the incremental_reinstrument to
         # compare the files and decide what needs to be re-instrumented.
-        coverProjectName = findCoverProject()
-        stdOut, exitCode = runVCcommand ('clicast -e ' + coverProjectName + ' cover source incremental_reinstrument', globalAbortOnError)
+        os.chdir (os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory ))
+        for coverProjectName in coverProjectNames:
+            stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'source', 'incremental_reinstrument', environment=coverProjectName), globalAbortOnError, timeLimit=0, idleLimit=0)
         # Change back to original dir
         os.chdir (originalWorkingDirectory)
+        saveDisabledFiles (set())
     
 
-def disableCoverage():
+def disableCoverage(files=None):
     '''
-    Disable coverage for the Coverage Project
+    Disable coverage for the Coverage Project, or only for the files 
+    and directories in files
     '''
+    if files:
+        disableCoverageForFiles (files)
+        return
+        
     manageProjectName = findManageProject()
     if manageProjectName!=manageProjectNotFound:
-        coverProjectName = manageProjectName.split ('_')[0] + '_coverage'
-        stdOut, exitCode = runVCcommand ('manage -p' + manageProjectName + ' -e' + coverProjectName + ' --disable-instrument-in-place', globalAbortOnError)
+        for coverProjectName in findCoverProjects():
+            stdOut, exitCode = runManageCommand (os.path.splitext (manageProjectName)[0], ['-e', coverProjectName, '--disable-instrument-in-place'])
         # Change back to original dir
         os.chdir (originalWorkingDirectory)
+        saveDisabledFiles (set ([fileName for fileName in filesInProject() if instrumentedInPlace (fileName)]))
 
                    
+
+def filesInProject ():
+    '''
+    This function will return the list of source files that are in the cover project
+    '''
+    existingFiles = os.path.join (originalWorkingDirectory, vcWorkArea, listOfFilesInProject)
+    fileList = []
+    if os.path.isfile (existingFiles):
+        with open (existingFiles, 'r') as f:
+            fileList = [line.strip() for line in f if line.strip()]
+    return fileList
+    
+
+def reinstrumentChangedSources (changedFiles):
+    '''
+    This function will bring the cover project up to date after some of the 
+    source files in the project were edited.  incremental_reinstrument compares
+    the files, and only re-instruments the ones that changed.
+    '''
+    coverProjectNames = findCoverProjects()
+    shardState = loadCoverageShards()
+    if len (shardState['shards']) > 0:
+        # Only the shards that contain the changed files
+        coverProjectNames = sorted (set ([shardState['shards'][shardName]['project'] for shardName in 
+                                          [shardForFile (shardState, fileName) for fileName in changedFiles] if shardName]))
+    os.chdir (os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory ))
+    if len (coverProjectNames) > 0:
+        addToSummaryStatus ('   re-instrumenting ' + str (len (changedFiles)) + ' changed source file(s) ...')
+    for coverProjectName in coverProjectNames:
+        stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'source', 'incremental_reinstrument', environment=coverProjectName), globalAbortOnError, timeLimit=0, idleLimit=0)
+        noteInstrumentedSources (changedFiles)
+    os.chdir (originalWorkingDirectory)
+    
+    
+# Watch mode keeps one watcher for the whole session, so that the edits that are made
+# while a batch runs are in the next batch.  The sources that we instrument in place
+# are written by us, we keep their hashes, and a change to one of them is ignored 
+# for as long as it has the contents that we wrote.
+instrumentedSourceHashes = {}
+
+def noteInstrumentedSources (fileNames):
+    '''
+    Remember the contents of the files that are instrumented in place, call 
+    this after a command that instruments them
+    '''
+    for fileName in fileNames:
+        if instrumentedInPlace (fileName) and os.path.isfile (fileName):
+            instrumentedSourceHashes[fileName] = fileContentHash (fileName)
+            
+            
+def withoutOwnChanges (changedFiles):
+    '''
+    Return the changed files that were not changed by our own instrumentation
+    '''
+    return set ([fileName for fileName in changedFiles if fileName not in instrumentedSourceHashes or 
+                 not os.path.isfile (fileName) or fileContentHash (fileName) != instrumentedSourceHashes[fileName]])
+    
+    
+class pollingFileWatcher:
+    '''
+    This class watches a list of files by comparing their modification time and size
+    every pollInterval seconds.  It is used when inotify is not available.
+    '''
+    def __init__(self, fileNames, pollInterval):
+        self.pollInterval = pollInterval
+        self.stamps = {}
+        self.addFiles (fileNames)
+        
+    def addFiles(self, fileNames):
+        for fileName in fileNames:
+            if fileName not in self.stamps:
+                self.stamps[fileName] = fileStamp (fileName)
+            
+    def changes(self, timeout):
+        '''
+        Wait for up to timeout seconds, and return the set of files that changed
+        '''
+        endTime = time.time() + timeout
+        while True:
+            changedFiles = set()
+            for fileName, oldStamp in self.stamps.items():
+                newStamp = fileStamp (fileName)
+                if newStamp != oldStamp:
+                    self.stamps[fileName] = newStamp
+                    changedFiles.add (fileName)
+            if changedFiles or time.time() >= endTime:
+                return changedFiles
+            time.sleep (min (self.pollInterval, max (0, endTime - time.time())))
+            
+    def close(self):
+        pass
+        
+        
+class inotifyFileWatcher:
+    '''
+    This class watches a list of files using the linux inotify interface.  We watch
+    the directories rather than the files, so that we also see editors and build
+    tools that replace a file by writing a new one and renaming it.
+    '''
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    watchMask = 0x00000002 | 0x00000004 | 0x00000008 | 0x00000080 | 0x00000100
+    eventHeader = 'iIII'
+    
+    def __init__(self, fileNames):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL (ctypes.util.find_library ('c'), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError (ctypes.get_errno(), 'inotify_init failed')
+        self.fileNames = set()
+        self.directories = {}
+        try:
+            self.addFiles (fileNames)
+        except OSError:
+            self.close()
+            raise
+            
+    def addFiles(self, fileNames):
+        import ctypes
+        self.fileNames |= set (fileNames)
+        watchedDirectories = set (self.directories.values())
+        for directory in set ([os.path.dirname (fileName) for fileName in fileNames]) - watchedDirectories:
+            watchDescriptor = self.libc.inotify_add_watch (self.fd, directory, self.watchMask)
+            if watchDescriptor < 0:
+                raise OSError (ctypes.get_errno(), 'inotify_add_watch failed for: ' + directory)
+            self.directories[watchDescriptor] = directory
+            
+    def changes(self, timeout):
+        '''
+        Wait for up to timeout seconds, and return the set of files that changed
+        '''
+        changedFiles = set()
+        readable, writable, errors = select.select ([self.fd], [], [], timeout)
+        if readable:
+            buffer = os.read (self.fd, 65536)
+            headerSize = struct.calcsize (self.eventHeader)
+            offset = 0
+            while offset + headerSize <= len (buffer):
+                watchDescriptor, mask, cookie, nameLength = struct.unpack_from (self.eventHeader, buffer, offset)
+                name = buffer[offset+headerSize:offset+headerSize+nameLength].rstrip ('\0')
+                offset += headerSize + nameLength
+                fileName = os.path.join (self.directories.get (watchDescriptor, ''), name)
+                if fileName in self.fileNames:
+                    changedFiles.add (fileName)
+        return changedFiles
+        
+    def close(self):
+        if self.fd >= 0:
+            os.close (self.fd)
+            self.fd = -1
+            
+            
+def createFileWatcher (fileNames, pollInterval):
+    '''
+    This function will return an inotify watcher if we can create one,
+    otherwise a polling watcher
+    '''
+    if platform.system() == 'Linux':
+        try:
+            return inotifyFileWatcher (fileNames)
+        except (ImportError, OSError, AttributeError):
+            pass
+    return pollingFileWatcher (fileNames, pollInterval)
+    
+    
+def waitForChangeBatch (watcher, settleTime):
+    '''
+    This function will wait until something changes, and then keep collecting
+    changes until nothing has changed for settleTime seconds, so that a build 
+    that writes many files is handled as one batch.  Our own in place instrumentation
+    is not a change, see noteInstrumentedSources
+    '''
+    changedFiles = set()
+    while len (changedFiles) == 0:
+        changedFiles = withoutOwnChanges (watcher.changes (settleTime))
+    while True:
+        moreChanges = withoutOwnChanges (watcher.changes (settleTime))
+        if len (moreChanges) == 0:
+            return changedFiles
+        changedFiles |= moreChanges
+        
+    
+# Number of threads used to search sibling directory trees for environments
+environmentSearchThreads = 8
+
+def listDirectory (directory):
+    '''
+    This function will return a list of (name, isSymlink) tuples for the sub-directories
+    of directory, and a set of the names of everything else.  With scandir, the 
+    type information comes from the directory listing, so we do not stat each entry
+    '''
+    subDirectories = []
+    fileNames = set()
+    try:
+        if scandir:
+            for entry in scandir (directory):
+                if entry.is_dir():
+                    subDirectories.append ((entry.name, entry.is_symlink()))
+                else:
+                    fileNames.add (entry.name)
+        else:
+            for name in os.listdir (directory):
+                fullPath = os.path.join (directory, name)
+                if os.path.isdir (fullPath):
+                    subDirectories.append ((name, os.path.islink (fullPath)))
+                else:
+                    fileNames.add (name)
+    except OSError:
+        # Like os.walk, we silently skip directories that we cannot read
+        pass
+    return subDirectories, fileNames
+    
+
+def scanDirectoryForEnvironments (directory):
+    '''
+    This function will look at the listing of one directory and return the environments
+    that it contains, and the sub-directories that still need to be searched.
+    An environment is a directory: foo with a sibling foo.vce or foo.vcp file.
+    We never descend into the environment directories, or into .BAK directories,
+    and like os.walk we do not follow symbolic links to directories.
+    '''
+    environments = []
+    directoriesToSearch = []
+    subDirectories, fileNames = listDirectory (directory)
+    for name, isSymlink in subDirectories:
+        if name + '.vcp' in fileNames:
+            environments.append (os.path.abspath (os.path.join (directory, name + '.vcp')))
+        elif '.BAK' in name:
+            continue
+        elif name + '.vce' in fileNames:
+            environments.append (os.path.abspath (os.path.join (directory, name + '.vce')))
+        elif not isSymlink:
+            directoriesToSearch.append (os.path.join (directory, name))
+    return environments, directoriesToSearch
+    
+
+def findEnvironmentFiles (rootDirectory):
+    '''
+    This function will search the tree below rootDirectory for .vce and .vcp files
+    Sibling sub-trees are searched in parallel by environmentSearchThreads threads
+    which share a queue of directories still to be listed.
+    '''
+    directoryQueue = Queue.Queue()
+    foundEnvironments = []
+    foundLock = threading.Lock()
+    
+    def searchWorker():
+        while True:
+            directory = directoryQueue.get()
+            if directory is None:
+                directoryQueue.task_done()
+                break
+            try:
+                environments, directoriesToSearch = scanDirectoryForEnvironments (directory)
+                with foundLock:
+                    foundEnvironments.extend (environments)
+                for subDirectory in directoriesToSearch:
+                    directoryQueue.put (subDirectory)
+            finally:
+                directoryQueue.task_done()
+                
+    workers = []
+    for index in range (max (1, environmentSearchThreads)):
+        worker = threading.Thread (target=searchWorker)
+        worker.daemon = True
+        worker.start()
+        workers.append (worker)
+        
+    directoryQueue.put (rootDirectory)
+    directoryQueue.join()
+    
+    # Stop the workers
+    for worker in workers:
+        directoryQueue.put (None)
+    for worker in workers:
+        worker.join()
+    
+    # The threads finish in any order, so sort to keep the results repeatable
+    return sorted (foundEnvironments)
+    
        
 def findAllEnvironments (rootDirectory):
     '''
@@ -1599,14 +5302,10 @@ def findAllEnvironments (rootDirectory):
     if not os.path.isdir (rootDirectory):
         print 'Invalid directory path: ' + rootDirectory
     else:
-        for root, dirs, files in os.walk(rootDirectory):
-            for name in dirs:
-                candidateVCE = os.path.abspath (os.path.join(root, name+'.vce'))
-                candiateVCP = os.path.abspath (os.path.join(root, name+'.vcp'))
-                if os.path.isfile (candiateVCP):
-                    returnList.append (candiateVCP)
-                elif '.BAK' not in candidateVCE and os.path.isfile (candidateVCE):
-                    returnList.append (candidateVCE)     
+        startMS = time.time()*1000.0
+        returnList = findEnvironmentFiles (rootDirectory)
+        endMS = time.time()*1000.0
+        addToSummaryStatus ('   search complete (' + getTimeString(endMS-startMS) + ')')
 
         addToSummaryStatus ('   found ' + str(len (returnList)) + ' total environments ...')
         
@@ -1632,20 +5331,109 @@ def addEnviromentsToManage (enviroList):
     addToSummaryStatus ('Adding Unit Test Environments to Manage Project ...')
     startMS = time.time()*1000.0   
    
+    enviroLevels = {}
     for enviro in enviroList:
         addToSummaryStatus ('   Adding environment: ' + os.path.basename (enviro))
+        enviroName = os.path.splitext (os.path.basename (enviro))[0]
+        recordInProjectModel ('environments', enviroName)
         manageCommands.append ('--import ' + enviro)
+        # The environment is in the tree where its group is attached, we keep that 
+        # level so that a refresh can be done for the environment alone
         if '.vce' in enviro:
             # Get the commands needed to do the work
-            manageCommands.append ('--group ' + unitTestGroupName() + ' --add ' + os.path.splitext (os.path.basename (enviro))[0])
+            manageCommands.append ('--group ' + unitTestGroupName() + ' --add ' + enviroName)
+            enviroLevels[enviro] = (unitTestGroupName(), platformLevelStringWithSlash() + compilerNodeName + '/' + unitTestTestSuiteName() + '/' + enviroName)
         elif '.vcp' in enviro:
-            manageCommands.append ('--group ST-Group --add ' + os.path.splitext (os.path.basename (enviro))[0])
+            manageCommands.append ('--group ST-Group --add ' + enviroName)
+            enviroLevels[enviro] = ('ST-Group', platformLevelStringWithSlash() + systeTestCompilerNodeName + '/SystemTesting/' + enviroName)
                     
     if len (manageCommands) > 0:
-        stdOut = runManageCommands(manageProjectName, manageCommands )
+        stdOut, exitCode = runManageCommands(manageProjectName, manageCommands )
+        if exitCode == 0:
+            # These are already built environments, the import picks up their current data
+            for enviro in enviroList:
+                groupName, levelArg = enviroLevels.get (enviro, (None, ''))
+                registerEnvironment (enviro, imported=True, built=True, dataStamp=environmentDataStamp (enviro),
+                                     group=groupName, level=levelArg.replace ('--level ', '', 1) or None)
         endMS = time.time()*1000.0
         addToSummaryStatus ('   ' + str (len (enviroList)) + ' environment(s) added (' + getTimeString(endMS-startMS) + ')')
            
+
+# When this is True, vcmFromEnvironments refreshes the whole manage project
+# rather than only the environments with new data
+forceFullRefresh = False
+
+def environmentDataStamp (enviroPath):
+    '''
+    This function will return a stamp for the result and coverage data of an already
+    built environment: the newest modification time, the number of entries and the 
+    total size of the .vce/.vcp file and the top level of the environment directory.
+    Adding, removing or re-writing a result or coverage file changes the stamp.
+    '''
+    stamp = [0, 0, 0]
+    candidates = [enviroPath]
+    dataDirectory = os.path.splitext (enviroPath)[0]
+    subDirectories, fileNames = listDirectory (dataDirectory)
+    candidates += [os.path.join (dataDirectory, name) for name, isSymlink in subDirectories]
+    candidates += [os.path.join (dataDirectory, name) for name in fileNames]
+    for candidate in candidates:
+        try:
+            candidateStat = os.stat (candidate)
+        except OSError:
+            continue
+        stamp[0] = max (stamp[0], candidateStat.st_mtime)
+        stamp[1] += 1
+        stamp[2] += candidateStat.st_size
+    return stamp
+
+
+def importedEnvironmentsBelow (rootDirectory):
+    '''
+    Return the registry entries for the built environments (.vce or .vcp) 
+    that were imported from below rootDirectory
+    '''
+    rootPrefix = os.path.join (os.path.abspath (rootDirectory), '')
+    entries = []
+    for name, entry in getEnvironmentRegistry().items():
+        source = entry['source']
+        if entry['imported'] and os.path.splitext (source)[1] in ['.vce', '.vcp'] and source.startswith (rootPrefix):
+            entries.append ((name, entry))
+    return sorted (entries)
+    
+    
+def findChangedEnvironments (rootDirectory):
+    '''
+    This function will return the names of the environments below rootDirectory
+    whose result or coverage data has changed since they were last refreshed
+    '''
+    changedEnvironments = []
+    for name, entry in importedEnvironmentsBelow (rootDirectory):
+        if entry.get ('dataStamp') != environmentDataStamp (entry['source']):
+            changedEnvironments.append (name)
+    return changedEnvironments
+    
+    
+def recordEnvironmentDataStamps (rootDirectory):
+    '''
+    After a refresh, remember the current data stamps
+    '''
+    for name, entry in importedEnvironmentsBelow (rootDirectory):
+        entry['dataStamp'] = environmentDataStamp (entry['source'])
+    saveEnvironmentRegistry()
+    
+    
+def commandsToRefreshOneEnvironment (name):
+    '''
+    This function will return the commands needed to refresh one environment.
+    If we know where the environment is in the tree we refresh at that level
+    otherwise we let manage find the environment by name.
+    '''
+    entry = getEnvironmentRegistry().get (name, {})
+    if entry.get ('level'):
+        return ['--level ' + entry['level'] + ' --refresh --force']
+    else:
+        return ['-e ' + name + ' --refresh --force']
+        
     
 def vcmFromEnvironments (projectName, rootDirectory, statusfile, verbose):
     '''
@@ -1688,8 +5476,8 @@ def vcmFromEnvironments (projectName, rootDirectory, statusfile, verbose):
         # Add the environments ...
         addEnviromentsToManage (enviroList)
         
-        # Save the enviro list for next time
-        saveEnvironmentsInProject(enviroList)
+        # Save the enviro registry for next time
+        saveEnvironmentRegistry()
 
         endMS = time.time()*1000.0
         addToSummaryStatus ('Total Time: ' + getTimeString(endMS-startMS))
@@ -1704,9 +5492,22 @@ def vcmFromEnvironments (projectName, rootDirectory, statusfile, verbose):
         # has the data it needs even if the Manage project is never opened
         manageCommands = []
         
-        # TBD: Do we want to do this only for the local enviro?
-        manageCommands.append ('--refresh --force')  
-        stdOut = runManageCommands(manageProjectName, manageCommands )
+        if forceFullRefresh:
+            addToSummaryStatus ('   full refresh requested')
+            manageCommands.append ('--refresh --force')
+        else:
+            # Only refresh the environments that have new result or coverage data
+            changedEnvironments = findChangedEnvironments (rootDirectory)
+            for name in changedEnvironments:
+                addToSummaryStatus ('   refreshing environment: ' + name)
+                manageCommands += commandsToRefreshOneEnvironment (name)
+            if len (changedEnvironments) == 0:
+                addToSummaryStatus ('   no environment data has changed since the last refresh')
+                
+        if len (manageCommands) > 0:
+            stdOut, exitCode = runManageCommands(manageProjectName, manageCommands )
+            if exitCode == 0:
+                recordEnvironmentDataStamps (rootDirectory)
            
        
     # Close the summary file
@@ -1772,7 +5573,7 @@ def buildListOfMainFilesFromDB():
     addToSummaryStatus ('Computing insert locations for c_cover_io.c ...')
     returnList = []
         
-    stdOut, exitCode = runVCcommand ('vcdb ' + vcshellDBarg(force=True) + ' getapps', globalAbortOnError) 
+    stdOut, exitCode = runVCDBquery ('getapps', globalAbortOnError, force=True)
     if 'Apps Not found' in stdOut:
         applicationList = []
     else:
@@ -1784,11 +5585,11 @@ def buildListOfMainFilesFromDB():
         # Build a list of sets.  One file set for each application
         appFileLists = []
         for app in applicationList: 
-            stdOut, exitCode = runVCcommand ('vcdb ' + vcshellDBarg(force=True) + ' --app=' + app + ' getappfiles', globalAbortOnError) 
+            stdOut, exitCode = runVCDBquery ('--app=' + app + ' getappfiles', globalAbortOnError, force=True)
             listOfAppFiles = stdOut.rstrip('\n').split('\n')
             
             # but only consider files that are in the cover project
-            setOfAppFiles = set (listOfAppFiles) & set (listOfFiles)
+            setOfAppFiles = set (listOfAppFiles) & set (projectPaths.paths (listOfFiles))
                        
             fileSet = set()
             for file in setOfAppFiles:
@@ -1837,12 +5638,214 @@ def buildListOfMainFilesFromDB():
     
 
 
+# The arguments of the last updateProject call in this process
+lastProjectSettings = None
+
+def readNewDatabaseFiles (filterFunction, filesOfInterest):
+    '''
+    This function is the initialize of watch mode: only the files that were not in 
+    the vcshell.db the last time that we read it go through the user filter and into
+    the file lists.  The CFG file, the work area and the make settings are kept from
+    the last run, and the source paths are read again only for new unit test files.
+    '''
+    sectionBreak ('')
+    addToSummaryStatus ('Reading the new files in vcshell.db ... (' + vcshellDBname + ")")
+    startMS = time.time()*1000.0
+    
+    buildFileLists (filterFunction, filesOfInterest, knownFiles=set (databaseFiles))
+    if len (listOfUnitTestFiles) > 0:
+        readDatabasePaths ()
+    addToSummaryStatus ('   ' + str(len (listOfFiles)) + ' files will be added for system testing ... ')
+    writeFileListToFile (projectPaths.paths (listOfFiles))
+    
+    endMS = time.time()*1000.0
+    addToSummaryStatus ('   complete (' + getTimeString (endMS-startMS) + ')')
+    
+    
+def updateProject (compilerCFG, filterFunction, vcdbFlagString, filesOfInterest, inplace, coverageType, listOfMainFiles,
+                   runLint, coverageShardDepth, workBundles, includePathOverRide, envFileEditor, envFilesUseVcdb, tcTimeOut,
+                   newFilesOnly=False):
+    '''
+    This function will read the vcshell.db, and create the project, or when it 
+    exists, add the files and the unit test environments that it does not have yet.
+    The settings of automationController must be set before this is called.
+    With newFilesOnly, only the files that are new in the vcshell.db since the last
+    call are added, and the cover and manage projects are only touched for them.
+    '''
+    if newFilesOnly:
+        readNewDatabaseFiles (filterFunction, filesOfInterest)
+        projectMode = 'update'
+    else:
+        # Initialize the project settings, projectMode will be 'update' or 'new'
+        projectMode = initialize (compilerCFG, filterFunction, vcdbFlagString, filesOfInterest)
+
+    if newFilesOnly and len (listOfFiles) == 0:
+        # Nothing new for the cover projects
+        pass
+        
+    elif useParallelInstrumentation:
+        startCwd =  os.getcwd()
+        os.chdir(originalWorkingDirectory)
+
+        # run vcutil to parallel instrument
+        print "Running vcutil from : " + os.getcwd()
+        vcutilArgs = ['instrument', '--all', '--coverage=' + coverageType, '--db=' + vcshellDBname]
+        if useParallelJobs:
+           vcutilArgs.append ('--jobs=' + useParallelJobs)
+
+        if useParallelDestination:
+           vcutilArgs.append ('--destination_dir=' + useParallelDestination)
+           vc_inst_dir = " " + useParallelDestination
+           if not os.path.isdir(useParallelDestination):
+              os.makedirs (useParallelDestination)
+        else:
+           vc_inst_dir = " vc-inst"
+
+        # The vcutil output can be restored from the instrumentation cache, but not when
+        # the instrumented files are the sources, those are only in the destination directory
+        instrumentationDirectory = os.path.join (originalWorkingDirectory.strip(), vc_inst_dir.strip())
+        cacheKey = None
+        if environmentCacheDirectory and not useParallelUseInPlace:
+            cacheKey = instrumentationCacheKey ('vcutil', projectPaths.paths (listOfFiles), coverageType, False, [], False)
+        if cacheKey and restoreInstrumentationDirectory (instrumentationDirectory, cacheKey):
+            instrumentationCacheStatistics['hits'] += 1
+        else:
+            stdOut, exitCode = runVCcommand (vcutilCommand (*vcutilArgs), globalAbortOnError, timeLimit=0, idleLimit=0)
+            if cacheKey:
+                instrumentationCacheStatistics['misses'] += 1
+                if storeInstrumentationDirectory (instrumentationDirectory, cacheKey):
+                    instrumentationCacheStatistics['stored'] += 1
+        reportInstrumentationCache ()
+
+        os.chdir(os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory))
+        print ("Linking CCAST_.CFG file")
+        getCFGfile ()
+
+        # run command to build the manage project
+        if os.path.isdir(coverageProjectName):
+           print "Removing existing working directory"
+           shutil.rmtree(coverageProjectName)
+        #stdOut, exitCode = runVCcommand ('clicast cover environment build ' +  coverageProjectName + vc_inst_dir, globalAbortOnError)
+        stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'environment', 'build', coverageProjectName, os.path.join (originalWorkingDirectory.strip(), vc_inst_dir.strip())), globalAbortOnError, timeLimit=0, idleLimit=0)
+        os.chdir(os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory))
+
+        if useParallelUseInPlace:
+            stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'environment', 'enable_instrumentation', environment=coverageProjectName), globalAbortOnError, timeLimit=0, idleLimit=0)
+
+        if len(listOfMainFiles)==1 and listOfMainFiles[0]==parameterNotSetString:
+            localListOfMainFiles = buildListOfMainFilesFromDB()
+        else:
+            localListOfMainFiles = listOfMainFiles
+        for file in listOfMainFiles:
+            stdOut, exitCode = runVCcommand (clicastCommand ('cover', 'append_cover_io', 'true', environment=coverageProjectName, unit=file), globalAbortOnError)
+
+        os.chdir(startCwd)
+
+        
+    elif coverageShardMode != 'none':
+        # Each shard gets its own cover project, and only the shards with
+        # new or changed files are built
+        if maximumFilesToSystemTest>0:
+            if len(listOfMainFiles)==1 and listOfMainFiles[0]==parameterNotSetString:
+                localListOfMainFiles = buildListOfMainFilesFromDB()
+            else:
+                localListOfMainFiles = listOfMainFiles
+            buildShardedCoverageProjects (inplace, coverageType, localListOfMainFiles, runLint, coverageShardDepth)
+            
+    else:
+        # A new cover project can be restored from the instrumentation cache,
+        # when the same files were instrumented with the same settings before
+        cacheKey = None
+        if environmentCacheDirectory and projectMode=='new' and maximumFilesToSystemTest>0 and coverageType != 'none' and len (listOfFiles) > 0:
+            if len(listOfMainFiles)==1 and listOfMainFiles[0]==parameterNotSetString:
+                listOfMainFiles = buildListOfMainFilesFromDB()
+            cacheKey = instrumentationCacheKey (coverageProjectName, projectPaths.paths (listOfFiles), coverageType, inplace, listOfMainFiles, runLint)
+            
+        if cacheKey and restoreCachedCoverageProject (cacheKey, coverageType):
+            instrumentationCacheStatistics['hits'] += 1
+            reportInstrumentationCache ()
+        else:
+            # We always build an empty coverage project even if the number of 
+            # files to system test is 0, because this allows us to add files to it later.
+            buildCoverageProject (projectMode, inplace)
+        
+            # If the caller requested lint analysis
+            if maximumFilesToSystemTest>0 and globalCoverageProjectExists:
+                if maximumFilesToSystemTest>0 and runLint:
+                    runLintAnalysis ()
+                
+                if len(listOfMainFiles)==1 and listOfMainFiles[0]==parameterNotSetString:
+                    localListOfMainFiles = buildListOfMainFilesFromDB()
+                else:
+                    localListOfMainFiles = listOfMainFiles
+                
+                if coverageType != 'none':
+                    instrumentFiles (coverageType, localListOfMainFiles)
+                    
+            if cacheKey:
+                instrumentationCacheStatistics['misses'] += 1
+                os.chdir (os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory))
+                if globalCoverageProjectExists and storeCoverageProject (coverageProjectName, cacheKey, projectPaths.paths (listOfFiles), inplace):
+                    instrumentationCacheStatistics['stored'] += 1
+                reportInstrumentationCache ()
+        
+    # Use the IDC EnvCreate to build .env scripts for each file, 
+    # or leave that to the workers that run the exported bundles
+    if newFilesOnly and len (listOfUnitTestFiles) == 0:
+        # No new units that need scripts
+        pass
+    elif maximumFilesToUnitTest > 0 and workBundles > 0:
+        exportWorkBundles (workBundles, coverageType, includePathOverRide, envFileEditor, vcdbFlagString, envFilesUseVcdb)
+    elif maximumFilesToUnitTest > 0:
+        buildEnvScripts (coverageType, includePathOverRide, envFileEditor, vcdbFlagString, envFilesUseVcdb)  
+        
+    # Build the manage project, for new files it only changes when there are 
+    # new environment scripts or new coverage shards
+    newShards = coverageShardMode != 'none' and len (listOfFiles) > 0
+    if not newFilesOnly or (len (listOfUnitTestFiles) > 0 and workBundles == 0) or newShards:
+        os.chdir (os.path.join (originalWorkingDirectory, vcWorkArea, vcManageDirectory ))
+        buildEnterpriseProject (projectMode, coverageType, tcTimeOut)
+    
+    # Add the list of files to the cummulative list of files ...
+    newFileList = os.path.join (originalWorkingDirectory, vcWorkArea, listOfFilenamesFile);
+    fullFileList = os.path.join (originalWorkingDirectory, vcWorkArea, listOfFilesInProject);
+    newFile = open (newFileList, 'r')
+    oldFile = open (fullFileList, 'a')
+    for line in newFile:
+        oldFile.write (line)
+        
+    newFile.close()
+    oldFile.close()
+    
+    
+def extendProject (statusfile):
+    '''
+    This function will add the files that are new in the vcshell.db to the project,
+    with the settings of the last automationController call in this process, and
+    without its validation and reports.  It is used by watch mode.  Returns False
+    if there was no earlier call.
+    '''
+    global summaryStatusFileHandle
+    if lastProjectSettings is None:
+        return False
+    summaryStatusFileHandle = open (statusfile, 'a', 1)
+    try:
+        updateProject (newFilesOnly=True, **lastProjectSettings)
+        noteInstrumentedSources (projectPaths.paths (listOfFiles))
+    finally:
+        stopPythonHelperWorker ()
+        summaryStatusFileHandle.close()
+        os.chdir (originalWorkingDirectory)
+    return True
+    
+    
 # Case     
 validCoverageTypes=['none', 'statement', 'branch', 'mcdc', 'statement+branch', 'statement+mcdc', 'basis_paths', 'probe_point', 'coupling']
 def automationController (projectName, vcshellLocation, listOfMainFiles, runLint, maxToSystemTest, maxToUnitTest,\
                           filterFunction, maxToBuild, compilerCFG, coverageType, \
                           inplace, vcdbFlagString, tcTimeOut, includePathOverRide, envFileEditor, statusfile, verbose,
-                          filesOfInterest,vcast_workarea="vcast-workarea",vcDbName="vcshell.db",envFilesUseVcdb=True):
+                          filesOfInterest,vcast_workarea="vcast-workarea",vcDbName="vcshell.db",envFilesUseVcdb=True,
+                          coverageShards='none', coverageShardDepth=1, workBundles=0, coverageTypes=(), lint='project'):
               
     '''
     This function is passed the configuration data from the vcdb2vcm.py file and 
@@ -1867,6 +5870,11 @@ def automationController (projectName, vcshellLocation, listOfMainFiles, runLint
     global useParallelJobs
     global useParallelDestionation
     global useParallelUseInPlace
+    global coverageShardMode
+    global coverageTypeState
+    global lintMode
+    global testCaseTimeout
+    global lastProjectSettings
     
     print "Automation Controller (AutomataionController.py) : 8/24/2018"
 
@@ -1894,6 +5902,29 @@ def automationController (projectName, vcshellLocation, listOfMainFiles, runLint
     if coverageType not in validCoverageTypes:
         print '    Invalid VCAST_COVERAGE_TYPE requested: "' + coverageType + '", using coverage type none'
         coverageType = 'none'
+    if coverageShards not in validShardModes:
+        print '    Invalid COVERAGE_SHARDS requested: "' + coverageShards + '", using none'
+        coverageShards = 'none'
+    if useParallelInstrumentation and coverageShards != 'none':
+        print '    COVERAGE_SHARDS is not used with parallel instrumentation'
+        coverageShards = 'none'
+    coverageShardMode = coverageShards
+    if type (tcTimeOut)==int:
+        testCaseTimeout = tcTimeOut
+    if lint not in validLintModes:
+        print '    Invalid LINT_MODE requested: "' + lint + '", using project'
+        lint = 'project'
+    lintMode = lint
+    coverageTypeMap[:] = []
+    for pattern, mappedType in coverageTypes:
+        if mappedType not in validCoverageTypes:
+            print '    Invalid coverage type in COVERAGE_TYPE_MAP for "' + pattern + '": "' + mappedType + '", using ' + coverageType
+        else:
+            coverageTypeMap.append ((normalizePath (pattern), mappedType))
+    if useParallelInstrumentation and len (coverageTypeMap) > 0:
+        print '    COVERAGE_TYPE_MAP is not used with parallel instrumentation'
+        coverageTypeMap[:] = []
+    coverageTypeState = None
     if useParallelInstrumentation:
         print '    Using parallel instrumentation'
         maxToSystemTest = sys.maxint
@@ -1909,92 +5940,19 @@ def automationController (projectName, vcshellLocation, listOfMainFiles, runLint
     maximumFilesToUnitTest = int (maxToUnitTest)
     maximumUnitTestsToBuild = int (maxToBuild)
           
-    # Initialize the project settings, projectMode will be 'update' or 'new'
-    projectMode = initialize (compilerCFG, filterFunction, vcdbFlagString, filesOfInterest)
-
-    if useParallelInstrumentation:
-        startCwd =  os.getcwd()
-        os.chdir(originalWorkingDirectory)
-
-        # run vcutil to parallel instrument
-        print "Running vcutil from : " + os.getcwd()
-        if useParallelJobs:
-           para_jobs_str =  " --jobs=" + useParallelJobs
-        else:
-           para_jobs_str = " "
-
-        if useParallelDestination:
-           para_dest_str =  " --destination_dir=" + useParallelDestination
-           vc_inst_dir = " " + useParallelDestination
-           if not os.path.isdir(useParallelDestination):
-              os.makedirs (useParallelDestination)
-        else:
-           para_dest_str = " "
-           vc_inst_dir = " vc-inst"
-
-        stdOut, exitCode = runVCcommand ('vcutil instrument --all --coverage=' + coverageType + " --db="+ vcshellDBname + para_jobs_str + para_dest_str, globalAbortOnError)
-
-        print ("Copying CCAST_.CFG file")
-        shutil.copy("CCAST_.CFG",os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory , "CCAST_.CFG"))
-        os.chdir(os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory))
-
-        # run command to build the manage project
-        if os.path.isdir(coverageProjectName):
-           print "Removing existing working directory"
-           shutil.rmtree(coverageProjectName)
-        #stdOut, exitCode = runVCcommand ('clicast cover environment build ' +  coverageProjectName + vc_inst_dir, globalAbortOnError)
-        stdOut, exitCode = runVCcommand ('clicast cover environment build ' +  coverageProjectName + " " + os.path.join (originalWorkingDirectory.strip(), vc_inst_dir.strip()), globalAbortOnError)
-        os.chdir(os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory))
-
-        if useParallelUseInPlace:
-            stdOut, exitCode = runVCcommand ('clicast -e' + coverageProjectName + ' cover environment enable_instrumentation', globalAbortOnError)
-
-        if len(listOfMainFiles)==1 and listOfMainFiles[0]==parameterNotSetString:
-            localListOfMainFiles = buildListOfMainFilesFromDB()
-        else:
-            localListOfMainFiles = listOfMainFiles
-        for file in listOfMainFiles:
-            stdOut, exitCode = runVCcommand ('clicast -e' + coverageProjectName + ' cover append_cover_io true -u' + file, globalAbortOnError)
-
-        os.chdir(startCwd)
-
-        
-    else:
-        # We always build an empty coverage project even if the number of 
-        # files to system test is 0, because this allows us to add files to it later.
-        buildCoverageProject (projectMode, inplace)
+    # The python helper worker loads while we read the DB
+    startPythonHelperWorker ()
     
-        # If the caller requested lint analysis
-        if maximumFilesToSystemTest>0 and globalCoverageProjectExists:
-            if maximumFilesToSystemTest>0 and runLint:
-                runLintAnalysis ()
-            
-            if len(listOfMainFiles)==1 and listOfMainFiles[0]==parameterNotSetString:
-                localListOfMainFiles = buildListOfMainFilesFromDB()
-            else:
-                localListOfMainFiles = listOfMainFiles
-            
-            if coverageType != 'none':
-                instrumentFiles (coverageType, localListOfMainFiles)
-        
-    # Use the IDC EnvCreate to build .env scripts for each file.
-    if maximumFilesToUnitTest > 0:
-        buildEnvScripts (coverageType, includePathOverRide, envFileEditor, vcdbFlagString, envFilesUseVcdb)  
-        
-    # Build the manage project
-    os.chdir (os.path.join (originalWorkingDirectory, vcWorkArea, vcManageDirectory ))
-    buildEnterpriseProject (projectMode, coverageType, tcTimeOut)
+    # Watch mode repeats the update with the same settings, see extendProject
+    lastProjectSettings = dict (compilerCFG=compilerCFG, filterFunction=filterFunction, vcdbFlagString=vcdbFlagString, 
+                                filesOfInterest=filesOfInterest, inplace=inplace, coverageType=coverageType, 
+                                listOfMainFiles=listOfMainFiles, runLint=runLint, coverageShardDepth=coverageShardDepth, 
+                                workBundles=workBundles, includePathOverRide=includePathOverRide, envFileEditor=envFileEditor, 
+                                envFilesUseVcdb=envFilesUseVcdb, tcTimeOut=tcTimeOut)
+    updateProject (**lastProjectSettings)
     
-    # Add the list of files to the cummulative list of files ...
-    newFileList = os.path.join (originalWorkingDirectory, vcWorkArea, listOfFilenamesFile);
-    fullFileList = os.path.join (originalWorkingDirectory, vcWorkArea, listOfFilesInProject);
-    newFile = open (newFileList, 'r')
-    oldFile = open (fullFileList, 'a')
-    for line in newFile:
-        oldFile.write (line)
-        
-    newFile.close()
-    oldFile.close()
+    stopPythonHelperWorker ()
+    reportLicenseWaits ()
 
     endMS = time.time()*1000.0
     addToSummaryStatus ('Total Time: ' + getTimeString(endMS-startMS))
@@ -2011,10 +5969,16 @@ def automationController (projectName, vcshellLocation, listOfMainFiles, runLint
    
     # TBD: Copy the vcast_lint.xml from the cover project to the manage project (FB 51133)
     if runLint:
-        fromFile = os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory, coverageProjectName, 'vcast_lint.xml')
         toPath = os.path.join (originalWorkingDirectory, vcWorkArea, vcManageDirectory, manageProjectName)
-        if os.path.isfile (fromFile):
-            shutil.copy (fromFile, toPath)
+        if coverageShardMode != 'none':
+            lintFiles = [os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory, shardProject, 'vcast_lint.xml') for shardProject in coverageShardProjects()]
+            lintFiles = [lintFile for lintFile in lintFiles if os.path.isfile (lintFile)]
+            if len (lintFiles) > 0 and os.path.isdir (toPath):
+                mergeLintResults (lintFiles, os.path.join (toPath, 'vcast_lint.xml'))
+        else:
+            fromFile = os.path.join (originalWorkingDirectory, vcWorkArea, vcCoverDirectory, coverageProjectName, 'vcast_lint.xml')
+            if os.path.isfile (fromFile):
+                shutil.copy (fromFile, toPath)
             
     
 def toolBarDashIcon (workareaBaseDirectory, vcProjectFile):
@@ -2136,7 +6100,7 @@ def enterpriseEnvironmentBuild (workareaBaseDirectory, projectName, scriptFile):
             with make_tempDirectory () as tempDirectory:
 
                 fileStructure = scriptFiles (tempDirectory, os.path.join (os.getcwd(), scriptFile))
-                fileStructure.generate_files()
+                stageScriptFiles ([fileStructure])
 
                 # This global variable is used to compute the build commands below
                 maximumUnitTestsToBuild = 1       
@@ -2144,9 +6108,9 @@ def enterpriseEnvironmentBuild (workareaBaseDirectory, projectName, scriptFile):
                 # This function takes a list, so we create a one item list in the call
                 addToSummaryStatus ('   adding environment to project')
                 addCommands, buildCommands = commandsToAddAndBuildEnvironments ([fileStructure])
-                stdOut = runManageCommands(manageProjectName, addCommands)
+                stdOut, exitCode = runManageCommands(manageProjectName, addCommands)
                 addToSummaryStatus ('   building environment')
-                stdOut = runManageCommands(manageProjectName, buildCommands)
+                stdOut, exitCode = runManageCommands(manageProjectName, buildCommands)
                 
         # scriptFile.endswith ('.vcp')
         else:
@@ -2155,7 +6119,7 @@ def enterpriseEnvironmentBuild (workareaBaseDirectory, projectName, scriptFile):
             manageCommands.append ('--import ' + scriptFile)
             scriptFile = os.path.basename (scriptFile)
             manageCommands.append ('--group ST-Group --add ' + scriptFile.split('.')[0])
-            stdOut = runManageCommands(manageProjectName, manageCommands)
+            stdOut, exitCode = runManageCommands(manageProjectName, manageCommands)
    
                 
         summaryStatusFileHandle.close()
@@ -2163,12 +6127,7 @@ def enterpriseEnvironmentBuild (workareaBaseDirectory, projectName, scriptFile):
     else:        
         print 'Script file: "' + scriptFile + '" is invalid'
         print 'Only environment scripts (.env files), and coverage project files (.vcp) are supported'
-        
-        
-     
-
-
-        
-
 
 
+if __name__ == '__main__' and pythonHelperWorkerOption in sys.argv:
+    runHelperWorker ()
@@ -12,9 +12,14 @@ Respond to the menu of command choices
 '''
 
 import argparse
+import inspect
+import json
 import os
 import shutil
+import socket
+import SocketServer
 import subprocess
+import time
 import traceback
 import sys
 from vector.apps.EnvCreator import AutomationController
@@ -28,6 +33,15 @@ originalWorkingDirectory=os.getcwd()
 vcInstallDir = os.environ["VECTORCAST_DIR"]
 globalMakeCommand = ''
 vceBaseDirectory = ''
+bundleJobs = 1
+coverageFiles = []
+
+# The automation daemon listens on this Unix domain socket (relative to the startup directory)
+defaultDaemonSocket = 'vcast-automation.sock'
+# The commands that can be sent to a running daemon
+daemonCommands = ['build-db', 'enable', 'disable', 'toolbar', 'stats', 'stop']
+# The last line that the daemon sends back contains the status of the command
+daemonStatusPrefix = 'AUTOMATION-DAEMON-STATUS: '
 
 
 def setupArgs (toolName):
@@ -43,7 +57,9 @@ def setupArgs (toolName):
                            help='Interactive mode')    
 
     # Command to run -- for non Interactive mode
-    commandChoices=['make', 'clean', 'build-db', 'build-vce', 'vcast', 'analytics', 'enable', 'disable', 'toolbar', 'enterprise']
+    commandChoices=['make', 'clean', 'build-db', 'build-vce', 'vcast', 'analytics', 'enable', 'disable', 'toolbar', 'enterprise',
+                    'daemon', 'stats', 'stop', 'export-bundles', 'run-bundles', 'merge-bundles', 'estimate',
+                    'execute']
     group.add_argument ('--command', dest='command', action='store', default='full',
                            choices=commandChoices, help='Command Choice')
 
@@ -80,6 +96,34 @@ def setupArgs (toolName):
 
     parser.add_argument ('--parallel-destination', dest='parallel_destination', help='Instrument in parallel')    
 
+    parser.add_argument ('--force-refresh', dest='force_refresh', action='store_true', default=False,
+                           help='Refresh the whole project rather than only the changed environments')    
+
+    # Watch mode extends the project whenever the vcshell.db or the source files change (used for command='build-db')
+    parser.add_argument ('--watch', dest='watch', action='store_true', default=False,
+                           help='Keep running and extend the project when vcshell.db or the sources change')    
+
+    parser.add_argument ('--watch-interval', dest='watch_interval', action='store', type=float, default=2.0,
+                           help='Seconds between checks when inotify is not available')    
+
+    parser.add_argument ('--watch-settle', dest='watch_settle', action='store', type=float, default=5.0,
+                           help='Seconds without changes before a batch of changes is processed')    
+
+    # Work bundles (used for command='export-bundles' || 'run-bundles')
+    parser.add_argument ('--bundles', dest='bundles', action='store', type=int, default=0,
+                           help='Number of work bundles to export, overrides WORK_BUNDLES')    
+
+    parser.add_argument ('--bundle-jobs', dest='bundle_jobs', action='store', type=int, default=1,
+                           help='Number of work bundles to run at the same time on this machine, or workers for --command estimate')    
+
+    # Files and directories to enable or disable coverage for (used for command='enable' || 'disable')
+    parser.add_argument ('--files', dest='files', action='store', nargs='+', default=[],
+                           help='Only enable or disable coverage for these source files and directories')    
+
+    # Unix domain socket of the automation daemon (used for command='daemon', and to send commands to it)
+    parser.add_argument ('--socket', dest='socket', action='store', default='',
+                           help='Socket of the automation daemon, ' + defaultDaemonSocket + ' for --command daemon')    
+
     return parser
 
 
@@ -145,10 +189,14 @@ def performTask (whatToDo, verbose):
     elif whatToDo == 'clean':
         clean()
 
-    elif whatToDo == 'build-db' or whatToDo=='build-vce':
+    elif whatToDo in ['build-db', 'build-vce', 'export-bundles', 'run-bundles', 'merge-bundles', 'estimate', 'execute']:
         # Run the vcdb2vcm script to create the project
         try:
-            vcdb2vcm.main(whatToDo, vceBaseDirectory, verbose)
+            # A vcdb2vcm.py copied before the work bundles has no bundleJobs argument
+            if 'bundleJobs' in inspect.getargspec (vcdb2vcm.main).args:
+                vcdb2vcm.main(whatToDo, vceBaseDirectory, verbose, bundleJobs)
+            else:
+                vcdb2vcm.main(whatToDo, vceBaseDirectory, verbose)
         except Exception as e:
             print e
             sys.exit("STARTAC: vcdb2vcm error")
@@ -162,12 +210,12 @@ def performTask (whatToDo, verbose):
         AutomationController.startAnalytics(vcdb2vcm.VCSHELL_DB_LOCATION)
         
     elif whatToDo == 'disable':
-        # Start Analytics for the project
-        AutomationController.disableCoverage()
+        # Disable coverage for the project, or for the --files
+        AutomationController.disableCoverage(coverageFiles)
 
     elif whatToDo == 'enable':
-        # Start Analytics for the project
-        AutomationController.enableCoverage()  
+        # Enable coverage for the project, or for the --files
+        AutomationController.enableCoverage(coverageFiles, vcdb2vcm.VCAST_COVERAGE_TYPE)  
 
 
 
@@ -235,31 +283,78 @@ def argsAreValid (args):
         return True
 
     
-def main():
+def configValue (name, default):
     '''
+    Return a setting from vcdb2vcm.py.  Users keep their own copy of vcdb2vcm.py,
+    so the settings that were added after it was copied use the default
     '''
-    global globalMakeCommand
-    global vceBaseDirectory
+    return getattr (vcdb2vcm, name, default)
     
-    parser = setupArgs ('startAutomation') 
-    # Read the arguments
-    try:
-        args = parser.parse_args()
-    except SystemExit:
-        raise
-        
+    
+def applyOptions (args):
+    '''
+    Copy the option args into the AutomationController settings.  We set every
+    value explicitly, because the daemon runs many commands in one process
+    '''
+    AutomationController.useParallelInstrumentation = args.parallel
     if args.parallel:
-        AutomationController.useParallelInstrumentation = True
         print "setting up for parallel instrumentation"
+    AutomationController.useParallelJobs = args.parallel_jobs or ""
+    AutomationController.useParallelDestination = args.parallel_destination or ""
+    AutomationController.useParallelUseInPlace = args.parallel_use_in_place
+    AutomationController.forceFullRefresh = args.force_refresh
+    envScriptStaging = configValue ('ENV_SCRIPT_STAGING', 'auto')
+    if envScriptStaging in AutomationController.validStagingModes:
+        AutomationController.envScriptStaging = envScriptStaging
+    else:
+        print 'Invalid ENV_SCRIPT_STAGING: "' + envScriptStaging + '", using auto'
+        AutomationController.envScriptStaging = 'auto'
+    
+    AutomationController.unitTestBuildBudget = configValue ('UNIT_TEST_BUILD_BUDGET', 0)
+    unitTestBuildSelection = configValue ('UNIT_TEST_BUILD_SELECTION', 'order')
+    if unitTestBuildSelection in AutomationController.validBuildSelections:
+        AutomationController.unitTestBuildSelection = unitTestBuildSelection
+    else:
+        print 'Invalid UNIT_TEST_BUILD_SELECTION: "' + unitTestBuildSelection + '", using order'
+        AutomationController.unitTestBuildSelection = 'order'
+    if configValue ('ENV_CACHE_DIRECTORY', ''):
+        AutomationController.environmentCacheDirectory = os.path.abspath (configValue ('ENV_CACHE_DIRECTORY', ''))
+    AutomationController.environmentCacheSizeMB = configValue ('ENV_CACHE_SIZE_MB', 4096)
+    AutomationController.lintJobs = configValue ('LINT_JOBS', 4)
+    AutomationController.basisPathJobs = configValue ('BASIS_PATH_JOBS', 4)
+    AutomationController.basisPathTimeLimit = configValue ('BASIS_PATH_TIME_LIMIT', 600)
+    AutomationController.executeAfterBuild = configValue ('EXECUTE_TESTS', False)
+    AutomationController.executionJobs = configValue ('EXECUTION_JOBS', 4)
+    AutomationController.executionTimeLimit = configValue ('EXECUTION_TIME_LIMIT', 1800)
+    AutomationController.commandTimeLimits.update (configValue ('COMMAND_TIME_LIMITS', {}))
+    AutomationController.commandIdleLimits.update (configValue ('COMMAND_IDLE_LIMITS', {}))
+    AutomationController.licenseSeats.update (configValue ('LICENSE_SEATS', {}))
+    AutomationController.licenseRetries = configValue ('LICENSE_RETRIES', 6)
+    AutomationController.licenseBackoffSeconds = configValue ('LICENSE_BACKOFF_SECONDS', 10)
+    pythonHelperMode = configValue ('PYTHON_HELPER_MODE', 'inprocess')
+    if pythonHelperMode in AutomationController.validPythonHelperModes:
+        AutomationController.pythonHelperMode = pythonHelperMode
+    else:
+        print 'Invalid PYTHON_HELPER_MODE: "' + pythonHelperMode + '", using inprocess'
+        AutomationController.pythonHelperMode = 'inprocess'
+    
+    global coverageFiles
+    coverageFiles = args.files
+    
+    global bundleJobs
+    bundleJobs = args.bundle_jobs
+    if args.bundles > 0:
+        vcdb2vcm.WORK_BUNDLES = args.bundles
 
-    if args.parallel_jobs:
-        AutomationController.useParallelJobs = args.parallel_jobs
-
-    if args.parallel_destination:
-        AutomationController.useParallelDestination = args.parallel_destination
 
-    if args.parallel_use_in_place:
-        AutomationController.useParallelUseInPlace = True
+def runCommand (args):
+    '''
+    This function will run the command from the parsed args
+    '''
+    global globalMakeCommand
+    global vceBaseDirectory
+    
+    applyOptions (args)
 
     if args.interactive:
         interactiveMode(args.verbose)
@@ -267,6 +362,12 @@ def main():
         print 'Error: --makecmd not provided'
     elif args.command == 'build-vce' and len (args.vceroot)==0:
         print 'Error: --vceroot not provided'
+    elif len (args.files) > 0 and args.command not in ['enable', 'disable']:
+        print 'Error: --files is only supported with --command enable or disable'
+    elif args.watch and args.command != 'build-db':
+        print 'Error: --watch is only supported with --command build-db'
+    elif args.watch:
+        watchMode (args)
     elif args.command =='toolbar':
         # Tool-bar mode starts an Analytics dashboard for the current project
         # This is only used by the toolbar icon
@@ -281,6 +382,244 @@ def main():
         vceBaseDirectory = args.vceroot
         performTask (args.command, args.verbose)
         
+
+def watchMode (args):
+    '''
+    This function will build the project, and then wait for changes to the vcshell.db
+    or to the source files that are in the project.  When the vcshell.db changes we
+    extend the project, which only adds the new files and builds scripts for the new 
+    units, and when source files change we re-instrument them.  Everything runs in 
+    this process so the AutomationController caches stay warm between batches.
+    '''
+    performTask ('build-db', args.verbose)
+    vcshellDB = os.path.join (vcdb2vcm.VCSHELL_DB_LOCATION, vcdb2vcm.VCDB_FILENAME)
+    statusFile = vcdb2vcm.PROJECT_NAME + '-automation-status.txt'
+    
+    # One watcher for the whole session, so that the changes that are made while
+    # a batch runs are seen in the next batch, the files added to the project are
+    # added to it as we go
+    watchedFiles = set ([vcshellDB] + AutomationController.filesInProject())
+    watcher = AutomationController.createFileWatcher (watchedFiles, args.watch_interval)
+    try:
+        while True:
+            print 'Watching ' + str (len (watchedFiles)) + ' files for changes (ctrl-c to stop) ...'
+            changedFiles = AutomationController.waitForChangeBatch (watcher, args.watch_settle)
+                
+            startTime = time.time()
+            if vcshellDB in changedFiles:
+                print 'vcshell.db has changed, extending the project ...'
+                AutomationController.extendProject (statusFile)
+                newFiles = set (AutomationController.filesInProject()) - watchedFiles
+                watcher.addFiles (newFiles)
+                watchedFiles |= newFiles
+            sourceFiles = changedFiles - set ([vcshellDB])
+            if len (sourceFiles) > 0:
+                AutomationController.summaryStatusFileHandle = open (statusFile, 'a', 1)
+                try:
+                    AutomationController.reinstrumentChangedSources (sourceFiles)
+                finally:
+                    AutomationController.summaryStatusFileHandle.close()
+            print 'Batch complete (' + AutomationController.getTimeString ((time.time()-startTime)*1000.0) + ')'
+    except KeyboardInterrupt:
+        print 'Watch mode stopped'
+    finally:
+        watcher.close()
+        
+
+class daemonOutput:
+    '''
+    This class is used in place of sys.stdout while the daemon runs a command, 
+    so that the output goes back to the client.  If the client goes away we 
+    just keep going and throw away the output.
+    '''
+    def __init__(self, socketFile):
+        self.socketFile = socketFile
+        self.connected = True
+        
+    def write(self, text):
+        if self.connected:
+            try:
+                self.socketFile.write (text)
+                self.socketFile.flush()
+            except socket.error:
+                self.connected = False
+                
+    def flush(self):
+        pass
+        
+
+class automationDaemon (SocketServer.UnixStreamServer):
+    '''
+    The daemon keeps AutomationController imported, so the parsed vcdb queries,
+    CFG options, project model and environment registry stay in memory between
+    commands.  These caches check the files behind them before they are used.
+    Commands are run one at a time, because AutomationController uses globals.
+    '''
+    def __init__(self, socketPath):
+        SocketServer.UnixStreamServer.__init__(self, socketPath, daemonRequestHandler)
+        self.socketPath = socketPath
+        self.stopRequested = False
+        self.startTime = time.time()
+        self.commandCounts = {}
+        self.configurationStamp = configurationStamp()
+        
+    def statistics (self):
+        lines = []
+        lines.append ('automation daemon: ' + self.socketPath)
+        lines.append ('   work area: ' + originalWorkingDirectory)
+        lines.append ('   up time:   ' + AutomationController.getTimeString ((time.time()-self.startTime)*1000.0))
+        for command in sorted (self.commandCounts):
+            lines.append ('   ' + command + ' commands: ' + str (self.commandCounts[command]))
+        for name in sorted (AutomationController.cacheStatistics):
+            lines.append ('   ' + name + ': ' + str (AutomationController.cacheStatistics[name]))
+        return '\n'.join (lines)
+        
+        
+def configurationStamp ():
+    '''
+    Return the modification time of the vcdb2vcm.py configuration file
+    '''
+    return AutomationController.fileStamp (os.path.splitext (vcdb2vcm.__file__)[0] + '.py')
+    
+    
+def runDaemonRequest (server, request):
+    '''
+    This function will run one request that was sent to the daemon, and
+    return the exit status
+    '''
+    global vcdb2vcm
+    
+    if request.get ('cwd') != originalWorkingDirectory:
+        print 'Error: this daemon serves: ' + originalWorkingDirectory
+        return 1
+    
+    args = argparse.Namespace (**request['args'])
+    server.commandCounts[args.command] = server.commandCounts.get (args.command, 0) + 1
+    
+    if args.command == 'stats':
+        print server.statistics()
+    elif args.command == 'stop':
+        print 'Stopping the automation daemon'
+        server.stopRequested = True
+    else:
+        # Pick up any edits to the configuration
+        if configurationStamp() != server.configurationStamp:
+            print 'Reloading vcdb2vcm.py'
+            vcdb2vcm = reload (vcdb2vcm)
+            server.configurationStamp = configurationStamp()
+            
+        # Some of the commands move these, so we put them back afterwards
+        savedLocations = (AutomationController.originalWorkingDirectory, AutomationController.cfgFileLocation)
+        try:
+            runCommand (args)
+        finally:
+            AutomationController.originalWorkingDirectory, AutomationController.cfgFileLocation = savedLocations
+            os.chdir (originalWorkingDirectory)
+    return 0
+    
+    
+class daemonRequestHandler (SocketServer.StreamRequestHandler):
+    '''
+    A request is one line of json: {"cwd":..., "args":{...}} and the reply
+    is the output of the command followed by a status line
+    '''
+    def handle(self):
+        output = daemonOutput (self.wfile)
+        savedOutput = (sys.stdout, sys.stderr)
+        sys.stdout = sys.stderr = output
+        status = 1
+        try:
+            try:
+                status = runDaemonRequest (self.server, json.loads (self.rfile.readline()))
+            except SystemExit, err:
+                status = err.code if isinstance (err.code, int) else 1
+            except Exception, err:
+                if str(err) != 'VCAST Termination Error':
+                    print traceback.format_exc()
+                print Exception, err
+        finally:
+            sys.stdout, sys.stderr = savedOutput
+        output.write ('\n' + daemonStatusPrefix + str (status) + '\n')
+        
+        
+def runDaemon (socketPath):
+    '''
+    This function will run the automation daemon until it gets a stop command
+    '''
+    if not hasattr (socket, 'AF_UNIX'):
+        print 'Error: the automation daemon needs Unix domain sockets'
+        return
+        
+    if os.path.exists (socketPath):
+        if sendToDaemon (socketPath, {'command':'stats'}, quiet=True) is not None:
+            print 'Error: an automation daemon is already running on: ' + socketPath
+            return
+        # A left over socket from a daemon that did not shut down
+        os.remove (socketPath)
+        
+    server = automationDaemon (socketPath)
+    print 'Automation daemon listening on: ' + socketPath
+    try:
+        while not server.stopRequested:
+            server.handle_request()
+    finally:
+        server.server_close()
+        if os.path.exists (socketPath):
+            os.remove (socketPath)
+    
+    
+def sendToDaemon (socketPath, commandArgs, quiet=False):
+    '''
+    This function will send a command to a running daemon, and print the output.
+    It returns the exit status of the command, or None if there is no daemon
+    '''
+    if not hasattr (socket, 'AF_UNIX'):
+        return None
+    client = socket.socket (socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect (socketPath)
+    except socket.error:
+        return None
+        
+    status = None
+    try:
+        client.sendall (json.dumps ({'cwd':originalWorkingDirectory, 'args':commandArgs}) + '\n')
+        for line in client.makefile ('r'):
+            if line.startswith (daemonStatusPrefix):
+                status = int (line[len (daemonStatusPrefix):])
+            elif not quiet:
+                sys.stdout.write (line)
+    finally:
+        client.close()
+    return status
+    
+    
+def main():
+    '''
+    '''
+    parser = setupArgs ('startAutomation') 
+    # Read the arguments
+    try:
+        args = parser.parse_args()
+    except SystemExit:
+        raise
+        
+    if args.command == 'daemon':
+        runDaemon (args.socket or defaultDaemonSocket)
+    elif args.socket and args.command in daemonCommands:
+        status = sendToDaemon (args.socket, vars (args))
+        if status is None:
+            if args.command in ['stats', 'stop']:
+                print 'No automation daemon is running on: ' + args.socket
+            else:
+                print 'No automation daemon is running on: ' + args.socket + ', running the command locally'
+                runCommand (args)
+        elif status != 0:
+            sys.exit (status)
+    elif args.command in ['stats', 'stop']:
+        print 'Error: --socket not provided'
+    else:
+        runCommand (args)
     
 
 if __name__ == "__main__":
@@ -289,6 +628,10 @@ if __name__ == "__main__":
         print "Automation Controller (startAutomation.py) : 8/24/2018"
         
         main()
+    except KeyboardInterrupt:
+        AutomationController.cancelActiveCommands()
+        print 'Interrupted'
+        sys.exit (1)
     except Exception, err:
         if str(err) != 'VCAST Termination Error':
             print Exception, err
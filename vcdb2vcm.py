@@ -84,6 +84,14 @@ VCSHELL_DB_LOCATION=os.getcwd()
 ### Choices are: none, statement, branch, mcdc, statement+branch, statement+mcdc, basis_paths, probe_point, coupling
 VCAST_COVERAGE_TYPE='statement'
 
+### The coverage type can be set for parts of the project, with a list of 
+### (path prefix or glob pattern, coverage type) pairs.  The first pair that
+### matches a file is used, and VCAST_COVERAGE_TYPE is used for the other files.
+### When this list changes, only the files whose coverage type changed are re-instrumented.
+### For example:
+###     COVERAGE_TYPE_MAP=[('/home/build/src/brakes', 'statement+mcdc'), ('*/test/*.c', 'none')]
+COVERAGE_TYPE_MAP=[]
+
 ### This will construct the .env files with the path to the vcshell, rather than the search paths and unit options
 ### Change it to False if you wish to construct .env files with search paths and unit options
 ### Default value is True which uses ENVIRO.VCDB_FILENAME
@@ -114,6 +122,13 @@ LIST_OF_MAIN_FILES = []
 ### You can optionally run Lint analysis on the files in the project
 LINT=False
 
+### LINT_MODE='project' analyzes the whole cover project every time, 'incremental'
+### analyzes only the new or changed files, and merges the results into one vcast_lint.xml
+### With COVERAGE_SHARDS the shards are analyzed in parallel.  In the incremental mode
+### the files of a cover project are analyzed LINT_JOBS at a time.
+LINT_MODE='project'
+LINT_JOBS=4
+
 ### This value will be used to set a TCAST_CASE_TIMEOUT option for the UnitTest node
 ### This is useful, especially for basis path tests that sometimes loop foreever.
 ### If you do not want to use a timeout value, set this variable to 0
@@ -138,6 +153,96 @@ TEST_TIMEOUT=10
 ### INCLUDE_PATH_OVERRIDE = [('/home/mySourceCode/libDir', 'LIB'), ('/home/mySourceCode/newPath', 'SEARCH')
 INCLUDE_PATH_OVERRIDE = []
 
+### For large builds the system test files can be split into several cover projects
+### (shards) that are built and instrumented in parallel, and are all added to the 
+### ST-Group of the manage project.  Only the shards with new or edited files are re-built.
+### Possible values are: 
+###             none:        one cover project for all files (default)
+###             application: one cover project per application in the vcshell database
+###             directory:   one cover project per directory, COVERAGE_SHARD_DEPTH controls
+###                          how many directory levels below the top level make are used
+### Application shards are recommended when LIST_OF_MAIN_FILES is used, because
+### the c_cover_io.c is appended to a main file in each shard that contains one.
+COVERAGE_SHARDS='none'
+COVERAGE_SHARD_DEPTH=1
+
+### The unit test work (environment scripts, environment builds and basis path tests)
+### can be exported as work bundles that run on other machines, using the commands:
+###     startAutomation.py --command export-bundles    (like build-db, but exports the unit test work)
+###     $VECTORCAST_DIR/vpython runBundle.py          (in each bundle directory, on any worker)
+###     startAutomation.py --command merge-bundles     (adds the finished bundles to the project)
+### The workers need the same source tree paths as this machine.
+### WORK_BUNDLES is the number of bundles that export-bundles creates.
+WORK_BUNDLES=4
+
+### The environment scripts are normally imported into the manage project from
+### the vc_ut_scripts directory.  ENV_SCRIPT_STAGING can be set to 'link' or 'copy'
+### to import them from a temporary directory of hard links or copies instead.
+ENV_SCRIPT_STAGING='auto'
+
+### The build time of each environment is estimated, using build times from earlier
+### runs, or estimates from the source size, #includes and stubs.
+### If UNIT_TEST_BUILD_BUDGET is not 0, each run only builds the environments whose
+### estimated build times fit in that many seconds.  UNIT_TEST_BUILD_SELECTION decides
+### which environments are built first when they do not all fit, or when there are more
+### than MAXIMUM_UNIT_TESTS_TO_BUILD: 'order' takes them in the order of the scripts,
+### 'quickest' takes the quickest first.  Use: startAutomation.py --command estimate
+### to see the estimates, and the wall time with parallel workers, without building anything.
+UNIT_TEST_BUILD_BUDGET=0
+UNIT_TEST_BUILD_SELECTION='order'
+
+### Built unit test environments can be kept in a cache directory outside of the
+### work area, and are imported from there when the environment script, the CFG file,
+### the VectorCAST version and the sources are the same as for an earlier build.
+### Instrumented cover projects are kept in the same cache, and are restored when the
+### sources, coverage type, CFG file and VectorCAST version match an earlier run.
+### The cache can be shared by all of the jobs on a machine.  Set ENV_CACHE_DIRECTORY
+### to enable the cache, the least recently used environments are removed when the 
+### cache is bigger than ENV_CACHE_SIZE_MB.
+ENV_CACHE_DIRECTORY=''
+ENV_CACHE_SIZE_MB=4096
+
+### The basis path tests are generated for BASIS_PATH_JOBS environments at a time.
+### An environment that takes more than BASIS_PATH_TIME_LIMIT seconds is stopped 
+### (0 for no limit), so that one unit cannot hold up the others.  The generated
+### tests are kept, and are not generated again while the unit is unchanged.
+BASIS_PATH_JOBS=4
+BASIS_PATH_TIME_LIMIT=600
+
+### The tests of the built environments are executed EXECUTION_JOBS environments at
+### a time, by startAutomation.py --command execute, or after build-db when EXECUTE_TESTS
+### is True.  An environment that runs for more than EXECUTION_TIME_LIMIT seconds, or
+### that has no output for longer than TEST_TIMEOUT plus a minute, is stopped, and its
+### results are not added to the project.  The status and time of each environment 
+### are written to vcast-execution-results.json in the work area.
+EXECUTE_TESTS=False
+EXECUTION_JOBS=4
+EXECUTION_TIME_LIMIT=1800
+
+### Each clicast, clicover, vcutil and manage command is stopped, with everything
+### that it started, when it runs longer than its time limit, or has no output 
+### for longer than its idle limit.  The limits are in seconds, 0 for no limit,
+### and are added to the defaults for each tool, e.g. COMMAND_TIME_LIMITS={'manage':14400}
+### Stopped commands are reported in the status file.
+COMMAND_TIME_LIMITS={}
+COMMAND_IDLE_LIMITS={}
+
+### LICENSE_SEATS limits the number of clicast, manage and cover commands that
+### run at the same time to the license seats of each feature (0 for no limit).
+### When the license server has no free seat, the command is tried again up to
+### LICENSE_RETRIES times, after a random wait of up to LICENSE_BACKOFF_SECONDS
+### that doubles for each retry.  The time spent waiting for seats is reported
+### at the end of the status file.
+LICENSE_SEATS={'clicast':0, 'manage':0, 'cover':0}
+LICENSE_RETRIES=6
+LICENSE_BACKOFF_SECONDS=10
+
+### The VectorCAST python helpers (EnvCreate.py and UnInstrument.py) are run in the 
+### automation process with 'inprocess', in one vpython worker process that is 
+### started early and reused with 'worker', so that a crash in a helper is isolated,
+### or in a new vpython for each call with 'process'.
+PYTHON_HELPER_MODE='inprocess'
+
 ### This filter function below can be used to limit the files that are processed.
 ### You can use the FILTER_PATTERNS objects with the default filterFiles 
 ### function, or you can completely replace the filterFiles function.
@@ -152,6 +257,9 @@ INCLUDE_PATH_OVERRIDE = []
 ### whose path contains the string foo.  MAXIMUM_FILES_TO_SYSTEM_TEST 
 ### and MAXIMUM_FILES_FOR_UNIT_TEST 
 ### still control the maximum number of files to be processed.
+### The files are read from the vcshell.db in batches, and the filterFileList
+### function is called once for each batch, so it should not depend on
+### seeing all of the files at once.
 ###
 FILTER_PATTERNS = []
 def matchesFilter(filePath):
@@ -242,7 +350,7 @@ def instrumentInplaceArg ():
     else:
         return ''
 
-def main(whatToDo='build-db', vceBaseDirectory="", verbose=False):
+def main(whatToDo='build-db', vceBaseDirectory="", verbose=False, bundleJobs=1):
         
     print "Automation Controller (vcdb2vcm.py) :8/24/2018"
 
@@ -250,13 +358,32 @@ def main(whatToDo='build-db', vceBaseDirectory="", verbose=False):
     Calling arguments:
         command     command-arg      Verbose
         build-vce   root-directory   True|False
+        run-bundles runs the unexported work bundles with bundleJobs worker processes
+        estimate    reports the estimated environment build times for bundleJobs workers
+        execute     executes the tests of the built environments
     '''
     
     if whatToDo=='build-vce':
         AutomationController.vcmFromEnvironments ( \
             projectName=PROJECT_NAME, rootDirectory=vceBaseDirectory,\
             statusfile=PROJECT_NAME+'-automation-status.txt',verbose=verbose)
-    elif whatToDo=='build-db':
+    elif whatToDo=='estimate':
+        AutomationController.estimateUnitTestBuilds (projectName=PROJECT_NAME, workers=bundleJobs, 
+                 statusfile=PROJECT_NAME+'-automation-status.txt', verbose=verbose, vcast_workarea=VCAST_WORKAREA)
+    elif whatToDo=='execute':
+        AutomationController.executeUnitTests (projectName=PROJECT_NAME, statusfile=PROJECT_NAME+'-automation-status.txt', 
+                 verbose=verbose, vcast_workarea=VCAST_WORKAREA, tcTimeOut=TEST_TIMEOUT)
+    elif whatToDo=='run-bundles':
+        AutomationController.runWorkBundles (jobs=bundleJobs, statusfile=PROJECT_NAME+'-automation-status.txt', verbose=verbose,
+                 vcast_workarea=VCAST_WORKAREA)
+    elif whatToDo=='merge-bundles':
+        AutomationController.mergeWorkBundles (projectName=PROJECT_NAME, statusfile=PROJECT_NAME+'-automation-status.txt', verbose=verbose,
+                 vcast_workarea=VCAST_WORKAREA, vcshellLocation=VCSHELL_DB_LOCATION, vcDbName=VCDB_FILENAME)
+    elif whatToDo=='build-db' or whatToDo=='export-bundles':
+        if whatToDo=='export-bundles':
+            workBundles = WORK_BUNDLES
+        else:
+            workBundles = 0
         try:
             AutomationController.automationController (projectName=PROJECT_NAME, \
                  vcshellLocation=VCSHELL_DB_LOCATION, \
@@ -268,7 +395,9 @@ def main(whatToDo='build-db', vceBaseDirectory="", verbose=False):
                  vcdbFlagString=VCAST_VCDB_FLAG_STRING, \
                  tcTimeOut=TEST_TIMEOUT, includePathOverRide=INCLUDE_PATH_OVERRIDE, \
                  envFileEditor=envFileEditor, statusfile=PROJECT_NAME+'-automation-status.txt', verbose=verbose,
-                 filesOfInterest=FILES_OF_INTEREST,vcast_workarea=VCAST_WORKAREA, vcDbName=VCDB_FILENAME, envFilesUseVcdb=ENV_FILES_USE_VCDB)
+                 filesOfInterest=FILES_OF_INTEREST,vcast_workarea=VCAST_WORKAREA, vcDbName=VCDB_FILENAME, envFilesUseVcdb=ENV_FILES_USE_VCDB, \
+                 coverageShards=COVERAGE_SHARDS, coverageShardDepth=COVERAGE_SHARD_DEPTH, workBundles=workBundles, \
+                 coverageTypes=COVERAGE_TYPE_MAP, lint=LINT_MODE)
         except Exception as e:
             print "VCDB2VCM: Raising exception"
             print e